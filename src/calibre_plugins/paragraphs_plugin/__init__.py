@@ -1,14 +1,20 @@
 import os
 import logging
 
-import chardet
-# from nltk import tokenize
-
 from calibre.customize import FileTypePlugin
-from .config import get_words_per_line, plugin_prefs, get_merge_paragraphs
-from .epub_split import process_epub
-
-from PyQt5.Qt import QWidget, QVBoxLayout, QLabel, QSpinBox, QCheckBox
+from .config import (get_words_per_line, plugin_prefs, get_merge_paragraphs, get_engine, get_compress_level,
+                     get_spine_only, get_workers, get_cache_enabled, get_cache_size_mb, get_stats_verbosity,
+                     get_profile_dir, get_incremental, get_mode, get_stream_threshold_kb, get_abbreviations,
+                     get_conditional_abbreviations)
+from .epub_split import process_epub, ENGINE_BS4, ENGINE_LXML, ENGINE_LXML_DOM
+from .txt_split import process_txt, detect_encoding
+from .result_cache import ResultCache, default_cache_dir
+from .stats import ProcessingStats, NULL_STATS, report, profiled, profile_path_for
+from .segmenters import parse_abbreviations, format_abbreviations
+from .oeb_transform import (SplitParagraphs, install_transform, transform_needed, MODE_POSTPROCESS, MODE_TRANSFORM,
+                            POSTPROCESS_FILE_TYPES, OEB_FILE_TYPES)
+
+from PyQt5.Qt import QWidget, QVBoxLayout, QLabel, QSpinBox, QCheckBox, QComboBox, QLineEdit, QPlainTextEdit
 
 DEBUG = False
 DEBUGGER_PORT = 5555
@@ -40,10 +46,88 @@ class ConfigWidget(QWidget):
         self.words_per_line_spinbox.setMaximum(100)
         layout.addWidget(self.words_per_line_spinbox)
 
+        # Добавляем выбор режима: разбиение в файле после конвертации или в дереве книги во время конвертации
+        layout.addWidget(QLabel('Когда разбивать абзацы в EPUB и TXT (в MOBI, AZW3, DOCX, FB2 - всегда во время конвертации):'))
+        self.mode_combobox = QComboBox()
+        self.mode_combobox.addItem('После конвертации (в файле EPUB/TXT)', MODE_POSTPROCESS)
+        self.mode_combobox.addItem('Во время конвертации (в книге calibre, без повторной распаковки)', MODE_TRANSFORM)
+        layout.addWidget(self.mode_combobox)
+
         # Добавляем чекбокс для флага объединения абзацев
         self.merge_paragraphs_checkbox = QCheckBox('Объединить все абзацы перед разбиением')
         layout.addWidget(self.merge_paragraphs_checkbox)
 
+        # Добавляем чекбокс для обработки только документов из spine OPF
+        self.spine_only_checkbox = QCheckBox('Обрабатывать только документы книги из OPF (spine)')
+        layout.addWidget(self.spine_only_checkbox)
+
+        # Добавляем выбор движка разбиения абзацев
+        layout.addWidget(QLabel('Движок разбиения:'))
+        self.engine_combobox = QComboBox()
+        self.engine_combobox.addItem('BeautifulSoup (html.parser)', ENGINE_BS4)
+        self.engine_combobox.addItem('lxml', ENGINE_LXML)
+        self.engine_combobox.addItem('lxml, разбиение по дереву (в т.ч. внутри <em>, <span>)', ENGINE_LXML_DOM)
+        layout.addWidget(self.engine_combobox)
+
+        # Добавляем выбор уровня сжатия перезаписываемых файлов EPUB
+        layout.addWidget(QLabel('Уровень сжатия EPUB (0 - без сжатия, 9 - максимальное):'))
+        self.compress_level_spinbox = QSpinBox()
+        self.compress_level_spinbox.setMinimum(0)
+        self.compress_level_spinbox.setMaximum(9)
+        layout.addWidget(self.compress_level_spinbox)
+
+        # Добавляем выбор количества процессов для параллельной обработки документов книги
+        layout.addWidget(QLabel('Количество процессов обработки:'))
+        self.workers_spinbox = QSpinBox()
+        self.workers_spinbox.setMinimum(0)
+        self.workers_spinbox.setMaximum(64)
+        # 0 - по количеству процессоров
+        self.workers_spinbox.setSpecialValueText('Авто')
+        layout.addWidget(self.workers_spinbox)
+
+        # Добавляем настройки кэша результатов обработки документов
+        self.cache_enabled_checkbox = QCheckBox('Кэшировать результаты обработки документов')
+        layout.addWidget(self.cache_enabled_checkbox)
+        layout.addWidget(QLabel('Максимальный размер кэша (МБ):'))
+        self.cache_size_spinbox = QSpinBox()
+        self.cache_size_spinbox.setMinimum(1)
+        self.cache_size_spinbox.setMaximum(10000)
+        layout.addWidget(self.cache_size_spinbox)
+
+        # Добавляем порог потоковой обработки больших документов
+        layout.addWidget(QLabel('Обрабатывать потоково документы больше (КБ):'))
+        self.stream_threshold_spinbox = QSpinBox()
+        self.stream_threshold_spinbox.setMinimum(0)
+        self.stream_threshold_spinbox.setMaximum(1000000)
+        self.stream_threshold_spinbox.setSpecialValueText('Никогда')
+        layout.addWidget(self.stream_threshold_spinbox)
+
+        # Добавляем дополнительные сокращения для разбиения на предложения (по строке на язык: "de: z.B. usw.")
+        layout.addWidget(QLabel('Дополнительные сокращения (строка "язык: сокращения", без языка - для всех книг):'))
+        self.abbreviations_edit = QPlainTextEdit()
+        layout.addWidget(self.abbreviations_edit)
+        layout.addWidget(QLabel('Сокращения, на которых предложение может завершаться (например, "usw."):'))
+        self.conditional_abbreviations_edit = QPlainTextEdit()
+        layout.addWidget(self.conditional_abbreviations_edit)
+
+        # Добавляем чекбокс инкрементальной обработки (манифест обработанных документов в EPUB)
+        self.incremental_checkbox = QCheckBox('Не обрабатывать повторно уже обработанные документы EPUB')
+        layout.addWidget(self.incremental_checkbox)
+
+        # Добавляем выбор подробности статистики обработки в журнале задачи
+        layout.addWidget(QLabel('Статистика обработки в журнале:'))
+        self.stats_verbosity_combobox = QComboBox()
+        self.stats_verbosity_combobox.addItem('Нет', 0)
+        self.stats_verbosity_combobox.addItem('Итог', 1)
+        self.stats_verbosity_combobox.addItem('Итог, этапы и самые медленные документы', 2)
+        self.stats_verbosity_combobox.addItem('Все документы', 3)
+        layout.addWidget(self.stats_verbosity_combobox)
+
+        # Добавляем директорию для профилей cProfile
+        layout.addWidget(QLabel('Директория для профилей cProfile (пусто - не профилировать):'))
+        self.profile_dir_edit = QLineEdit()
+        layout.addWidget(self.profile_dir_edit)
+
         self.setLayout(layout)
 
 
@@ -53,9 +137,51 @@ class SplitParagraphsPlugin(FileTypePlugin):
     supported_platforms = ['windows', 'osx', 'linux']
     author = 'Anton'
     version = VERSION
-    file_types = {'txt', 'epub'}
+    file_types = set(POSTPROCESS_FILE_TYPES | OEB_FILE_TYPES)
     on_postprocess = True  # Run this plugin after conversion is complete
 
+    def initialize(self):
+        # Выходные файлы, абзацы в которых уже разбиты во время конвертации (их не нужно обрабатывать при постобработке)
+        self.transformed_outputs = set()
+        # Вызывается и в рабочих процессах конвертации: встраиваем разбиение в плагины вывода,
+        # а нужно ли оно, решает make_transform по текущим настройкам
+        install_transform(self.file_types, self.make_transform)
+
+    def make_transform(self, file_type, output_path, log):
+        """
+        Преобразование книги calibre для режима MODE_TRANSFORM (см. oeb_transform.py).
+
+        :param file_type: Формат вывода.
+        :param output_path: Путь, по которому плагин вывода запишет книгу.
+        :param log: Журнал задачи конвертации.
+        :return: Функция transform(oeb, opts) или None, если плагин отключен или книга будет обработана
+                 при постобработке.
+        """
+        from calibre.customize.ui import is_disabled
+
+        if not transform_needed(file_type, get_mode(), is_disabled(self), self.file_types):
+            return None
+
+        words_per_line = get_words_per_line()
+        merge_paragraphs = get_merge_paragraphs()
+        engine = get_engine()
+        abbreviations = get_abbreviations()
+        conditional_abbreviations = get_conditional_abbreviations()
+        stats_verbosity = get_stats_verbosity()
+        stats = ProcessingStats() if stats_verbosity else NULL_STATS
+        profile_path = profile_path_for(get_profile_dir(), output_path)
+
+        def transform(oeb, opts):
+            log.info(f"[Split paragraphs plugin] splitting paragraphs during conversion to {file_type}: "
+                     f"words per line: {words_per_line}, merge_paragraphs: {merge_paragraphs}, engine: {engine}")
+            with profiled(profile_path):
+                SplitParagraphs(words_per_line, merge_paragraphs, engine, stats, abbreviations,
+                                conditional_abbreviations)(oeb, opts)
+            report(stats, log, stats_verbosity, os.path.basename(output_path))
+            self.transformed_outputs.add(os.path.abspath(output_path))
+
+        return transform
+
     def is_customizable(self):
         return True
 
@@ -64,6 +190,19 @@ class SplitParagraphsPlugin(FileTypePlugin):
         widget = ConfigWidget()
         widget.words_per_line_spinbox.setValue(get_words_per_line())
         widget.merge_paragraphs_checkbox.setChecked(get_merge_paragraphs())
+        widget.mode_combobox.setCurrentIndex(max(widget.mode_combobox.findData(get_mode()), 0))
+        widget.engine_combobox.setCurrentIndex(max(widget.engine_combobox.findData(get_engine()), 0))
+        widget.compress_level_spinbox.setValue(get_compress_level())
+        widget.spine_only_checkbox.setChecked(get_spine_only())
+        widget.workers_spinbox.setValue(get_workers())
+        widget.cache_enabled_checkbox.setChecked(get_cache_enabled())
+        widget.cache_size_spinbox.setValue(get_cache_size_mb())
+        widget.stream_threshold_spinbox.setValue(get_stream_threshold_kb())
+        widget.abbreviations_edit.setPlainText(format_abbreviations(get_abbreviations()))
+        widget.conditional_abbreviations_edit.setPlainText(format_abbreviations(get_conditional_abbreviations()))
+        widget.incremental_checkbox.setChecked(get_incremental())
+        widget.stats_verbosity_combobox.setCurrentIndex(max(widget.stats_verbosity_combobox.findData(get_stats_verbosity()), 0))
+        widget.profile_dir_edit.setText(get_profile_dir())
 
         return widget
 
@@ -71,8 +210,47 @@ class SplitParagraphsPlugin(FileTypePlugin):
         # Сохраняем новые значения настроек
         plugin_prefs['words_per_line'] = config_widget.words_per_line_spinbox.value()
         plugin_prefs['merge_before_splitting'] = config_widget.merge_paragraphs_checkbox.isChecked()
+        plugin_prefs['mode'] = config_widget.mode_combobox.currentData()
+        plugin_prefs['engine'] = config_widget.engine_combobox.currentData()
+        plugin_prefs['compress_level'] = config_widget.compress_level_spinbox.value()
+        plugin_prefs['spine_only'] = config_widget.spine_only_checkbox.isChecked()
+        plugin_prefs['workers'] = config_widget.workers_spinbox.value()
+        plugin_prefs['cache_enabled'] = config_widget.cache_enabled_checkbox.isChecked()
+        plugin_prefs['cache_size_mb'] = config_widget.cache_size_spinbox.value()
+        plugin_prefs['stream_threshold_kb'] = config_widget.stream_threshold_spinbox.value()
+        plugin_prefs['abbreviations'] = parse_abbreviations(config_widget.abbreviations_edit.toPlainText())
+        plugin_prefs['conditional_abbreviations'] = parse_abbreviations(
+            config_widget.conditional_abbreviations_edit.toPlainText())
+        plugin_prefs['incremental'] = config_widget.incremental_checkbox.isChecked()
+        plugin_prefs['stats_verbosity'] = config_widget.stats_verbosity_combobox.currentData()
+        plugin_prefs['profile_dir'] = config_widget.profile_dir_edit.text().strip()
+
+    def cli_main(self, args):
+        """
+        Пакетная обработка книг из командной строки (см. batch.py):
+
+            calibre-debug -r "Split Paragraphs Plugin" -- [пути, директории, шаблоны] [параметры]
+
+        Значения параметров по умолчанию берутся из настроек плагина.
+        """
+        from .batch import main
+
+        cache_dir = default_cache_dir() if get_cache_enabled() else None
+        # args[0] - имя плагина, дальше - аргументы после "--"
+        return main(args[1:], prog=f'calibre-debug -r "{self.name}" --', cache_version='.'.join(map(str, VERSION)),
+                    len=get_words_per_line(), merge=get_merge_paragraphs(), engine=get_engine(),
+                    compress_level=get_compress_level(), spine_only=get_spine_only(), cache_dir=cache_dir,
+                    cache_size=get_cache_size_mb(), incremental=get_incremental(),
+                    stream_threshold=get_stream_threshold_kb(), abbreviations=get_abbreviations(),
+                    conditional_abbreviations=get_conditional_abbreviations())
 
     def run(self, path_to_ebook):
+        if os.path.abspath(path_to_ebook) in getattr(self, 'transformed_outputs', ()):
+            # Абзацы уже разбиты во время конвертации (см. make_transform)
+            self.transformed_outputs.discard(os.path.abspath(path_to_ebook))
+            logging.info("[Split paragraphs plugin] paragraphs were split during conversion, skipping")
+            return path_to_ebook
+
         self.split_book(path_to_ebook)
 
         logging.info("[Split paragraphs plugin] done")
@@ -80,41 +258,49 @@ class SplitParagraphsPlugin(FileTypePlugin):
         return path_to_ebook
     
     @staticmethod
-    def split_txt_book(path_to_ebook):
+    def split_txt_book(path_to_ebook, words_per_line):
         encoding = detect_encoding(path_to_ebook)
 
         logging.info(f"[Split paragraphs plugin] detected encoding: {encoding}")
 
-        # with open(path_to_ebook, 'r', encoding=encoding, errors='replace') as f:
-        with open(path_to_ebook, 'r') as f:
-            logging.info(f"[Split paragraphs plugin] opened file")
-
-            content = f.read()
-
-            new_content = split_paragraphs2(content)
+        # Файл читается и записывается блоками, целиком в память он не загружается
+        process_txt(path_to_ebook, words_per_line, encoding)
 
-            try:
-                with open(path_to_ebook, 'w', encoding='utf-8') as file:
-                    file.write(new_content)
-
-                    logging.info(f"[Split paragraphs plugin] successfully written new contents")
-            except Exception as e:
-                logging.exception(f"[Split paragraphs plugin] error opening and writing file: {e}")
+        logging.info(f"[Split paragraphs plugin] successfully written new contents")
 
     @staticmethod
-    def split_book(path_to_ebook):
+    def split_book(path_to_ebook, log=None):
         """
         Opens the e-book file located at path_to_ebook and
         splits its content into paragraphs not longer than 4 lines.
 
         :param path_to_ebook: string
+        :param log: журнал для статистики обработки (журнал задачи calibre или logging.Logger).
+                    По умолчанию - корневой logging.Logger: его вывод в stderr попадает в журнал задачи конвертации.
         :return: path_to_ebook: string
         """
 
         words_per_line = get_words_per_line()
         merge_paragraphs = get_merge_paragraphs()
-
-        logging.info(f"[Split paragraphs plugin] words per line: {words_per_line}, merge_paragraphs: {merge_paragraphs}")
+        engine = get_engine()
+        compress_level = get_compress_level()
+        spine_only = get_spine_only()
+        workers = get_workers()
+        cache = None
+        if get_cache_enabled() and default_cache_dir():
+            cache = ResultCache(default_cache_dir(), get_cache_size_mb() * 1024 * 1024, '.'.join(map(str, VERSION)))
+        incremental = get_incremental()
+        stream_threshold_kb = get_stream_threshold_kb()
+        stats_verbosity = get_stats_verbosity()
+        stats = ProcessingStats() if stats_verbosity else NULL_STATS
+        profile_path = profile_path_for(get_profile_dir(), path_to_ebook)
+        log = log or logging.getLogger()
+
+        logging.info(f"[Split paragraphs plugin] words per line: {words_per_line}, merge_paragraphs: {merge_paragraphs}, "
+                     f"engine: {engine}, compress level: {compress_level}, spine only: {spine_only}, workers: {workers}, "
+                     f"cache: {cache.directory if cache else None}, incremental: {incremental}, "
+                     f"stream threshold: {stream_threshold_kb} KB, stats verbosity: {stats_verbosity}, "
+                     f"profile: {profile_path}")
 
         logging.info("[Split paragraphs plugin] starting to split paragraphs...")
 
@@ -123,57 +309,31 @@ class SplitParagraphsPlugin(FileTypePlugin):
 
             logging.info(f"[Split paragraphs plugin] file extension: {ext}")
 
+            if ext[1:] in OEB_FILE_TYPES:
+                # Эти форматы обрабатываются только во время конвертации (см. make_transform)
+                logging.warning(f"[Split paragraphs plugin] {ext} books are split during conversion only, skipping")
+                return
+
             if ext not in ['.txt', '.epub']:
                 raise ValueError(f"Unsupported file type: {ext}")
 
-            if ext == ".txt":
-                self.split_txt_book(path_to_ebook)
-            elif ext == ".epub":
-                process_epub(path_to_ebook, words_per_line, merge_paragraphs)
+            with profiled(profile_path):
+                if ext == ".txt":
+                    SplitParagraphsPlugin.split_txt_book(path_to_ebook, words_per_line)
+                elif ext == ".epub":
+                    process_epub(path_to_ebook, words_per_line, merge_paragraphs, engine=engine,
+                                 compress_level=compress_level, spine_only=spine_only, workers=workers, cache=cache,
+                                 stats=stats, incremental=incremental, version='.'.join(map(str, VERSION)),
+                                 stream_threshold=stream_threshold_kb * 1024, abbreviations=get_abbreviations(),
+                                 conditional_abbreviations=get_conditional_abbreviations())
+                    report(stats, log, stats_verbosity, os.path.basename(path_to_ebook))
+            if profile_path:
+                logging.info(f"[Split paragraphs plugin] profile written to {profile_path}")
 
         except Exception as e:
             logging.exception(f"[Split paragraphs plugin] An error occurred: {e}")
 
 
-def split_paragraphs2(content):
-    lines = content.split('.')
-    # lines = tokenize.sent_tokenize(content)
-
-    logging.info(f"[Split paragraphs plugin] lines: {lines}\n\n")
-    new_content = []
-    paragraph = []
-
-    logging.info(f"[Split paragraphs plugin] will parse {len(lines)} lines")
-
-    for line in lines:
-        paragraph.append(line + ".")
-        if len(paragraph) == 4:
-            new_content.append(' '.join(paragraph) + '\n')
-            paragraph = []
-
-    if paragraph:
-        new_content.append(' '.join(paragraph))
-
-    new_content = '\n'.join(new_content)
-
-    return new_content
-
-
-def detect_encoding(path_to_ebook):
-    with open(path_to_ebook, 'rb') as file:
-        raw_data = file.read()
-        result = chardet.detect(raw_data)
-        encoding = result['encoding']
-
-        if encoding is None:
-            logging.warning(f"[Split paragraphs plugin] Unable to detect encoding, defaulting to 'utf-8'")
-            encoding = 'utf-8'
-        else:
-            logging.info(f"[Split paragraphs plugin] Detected encoding: {encoding}")
-
-        return encoding
-
-
 if __name__ == "__main__":
     # path_to_book = "/Users/anton/sample3.txt"
 
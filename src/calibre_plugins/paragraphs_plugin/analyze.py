@@ -0,0 +1,229 @@
+"""
+Анализ книги без ее перезаписи: что изменит разбиение абзацев.
+
+Документы книги разбираются и абзацы считаются так же, как при обработке (см. process_document в epub_split.py),
+но деревья не меняются и не сериализуются, а архив не пересобирается: для каждого абзаца только решается,
+на сколько новых абзацев он разбился бы. Так можно быстро оценить, что сделает плагин с большой библиотекой:
+распределение длины абзацев, сколько абзацев будет разбито и объединено, насколько изменится размер
+документов и сколько времени займет разбор.
+
+Изменение размера - оценка в байтах UTF-8 несжатых документов: для разбиваемого абзаца - разница между
+суммой новых абзацев (начальный тег, содержимое, закрывающий тег) и исходным абзацем, для объединяемого - минус
+его теги. Изменения разметки, которые вносит сериализация документа (например, запись пустых элементов),
+в оценку не входят.
+"""
+import time
+import zipfile
+from bisect import bisect_right
+
+try:
+    from .epub_split import ENGINE_BS4, ENGINE_LXML_DOM, MIMETYPE_ENTRY, BeautifulSoup, count_words, \
+        merge_adjacent_paragraphs, plan_paragraph_split, _document_filter
+    from .stats import NULL_STATS, STAGE_PARSE, STAGE_MERGE, STAGE_EXTRACT, STAGE_UNZIP, COUNTER_DOCUMENTS, \
+        COUNTER_PARAGRAPHS, COUNTER_PARAGRAPHS_MERGED, COUNTER_PARAGRAPHS_SPLIT, COUNTER_PARAGRAPHS_CREATED, \
+        COUNTER_PARSE_FALLBACKS
+except ImportError:
+    from epub_split import ENGINE_BS4, ENGINE_LXML_DOM, MIMETYPE_ENTRY, BeautifulSoup, count_words, \
+        merge_adjacent_paragraphs, plan_paragraph_split, _document_filter
+    from stats import NULL_STATS, STAGE_PARSE, STAGE_MERGE, STAGE_EXTRACT, STAGE_UNZIP, COUNTER_DOCUMENTS, \
+        COUNTER_PARAGRAPHS, COUNTER_PARAGRAPHS_MERGED, COUNTER_PARAGRAPHS_SPLIT, COUNTER_PARAGRAPHS_CREATED, \
+        COUNTER_PARSE_FALLBACKS
+
+# Границы корзин гистограммы длины абзацев (в словах): корзина i - абзацы, в которых слов меньше
+# HISTOGRAM_BUCKETS[i] (и не меньше предыдущей границы), последняя корзина - все остальные
+HISTOGRAM_BUCKETS = (5, 10, 20, 50, 100, 200, 500)
+
+# Закрывающий тег абзаца
+END_TAG = '</p>'
+
+
+def histogram_labels(buckets=HISTOGRAM_BUCKETS):
+    """Подписи корзин гистограммы: '0-4', '5-9', ..., '500+'."""
+    labels = []
+    previous = 0
+    for bound in buckets:
+        labels.append(f'{previous}-{bound - 1}')
+        previous = bound
+    labels.append(f'{previous}+')
+    return labels
+
+
+class BookAnalysis:
+    """
+    Результат анализа книги: гистограмма длины абзацев (в словах, после объединения и до разбиения),
+    количество документов, абзацев, разбиваемых и объединяемых абзацев, размер документов, оценка изменения
+    их размера и время анализа.
+    """
+
+    FIELDS = ('documents', 'paragraphs', 'paragraphs_merged', 'paragraphs_split', 'paragraphs_created', 'size',
+              'size_delta', 'seconds')
+
+    def __init__(self):
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.documents = 0
+        self.paragraphs = 0
+        self.paragraphs_merged = 0
+        self.paragraphs_split = 0
+        self.paragraphs_created = 0
+        # Размер документов (байты UTF-8) и оценка его изменения после разбиения
+        self.size = 0
+        self.size_delta = 0
+        self.seconds = 0.0
+
+    def add_paragraph(self, words_count):
+        """Учитывает абзац из words_count слов в гистограмме."""
+        self.histogram[bisect_right(HISTOGRAM_BUCKETS, words_count)] += 1
+
+    def update(self, other):
+        """Прибавляет результат анализа другой книги (для сводки по многим книгам)."""
+        for name in self.FIELDS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def as_dict(self):
+        """Результат в виде словаря (гистограмма - словарь "подпись корзины -> количество абзацев")."""
+        result = {name: getattr(self, name) for name in self.FIELDS}
+        result['histogram'] = dict(zip(histogram_labels(), self.histogram))
+        return result
+
+    def summary(self):
+        """Результат одной строкой."""
+        share = self.size_delta / self.size * 100 if self.size else 0.0
+        return (f"{self.documents} documents, paragraphs: {self.paragraphs} seen, {self.paragraphs_merged} "
+                f"to merge, {self.paragraphs_split} to split into {self.paragraphs_created}, "
+                f"size: {self.size / 2 ** 20:.2f} MiB {self.size_delta:+d} bytes ({share:+.1f}%), "
+                f"time: {self.seconds:.3f} s")
+
+    def histogram_lines(self):
+        """Строки гистограммы: подпись корзины, количество абзацев и доля от всех абзацев."""
+        total = sum(self.histogram)
+        return [f"{label:>8} words: {count:8d} {count / total * 100 if total else 0.0:5.1f}%"
+                for label, count in zip(histogram_labels(), self.histogram)]
+
+    def __repr__(self):
+        return f'BookAnalysis({self.as_dict()!r})'
+
+
+def _utf8_size(text):
+    return len(text.encode('utf-8', 'surrogatepass'))
+
+
+def _tags_size(name, attributes):
+    """Размер начального и закрывающего тегов абзаца с атрибутами attributes."""
+    attributes_markup = ''.join(f' {key}="{" ".join(value) if isinstance(value, list) else value}"'
+                                for key, value in attributes.items())
+    return _utf8_size(f'<{name}{attributes_markup}>') + len(END_TAG)
+
+
+def _split_size_delta(paragraph_html, groups, tags_size, engine):
+    """Изменение размера от разбиения абзаца по плану groups (см. plan_paragraph_split)."""
+    if engine == ENGINE_LXML_DOM:
+        # Внутри новых абзацев пробелы остаются как были, удаляются только пробелы между ними
+        contents = [paragraph_html[group[0][0]:group[-1][1]] for group in groups]
+    else:
+        contents = [' '.join(paragraph_html[start:end] for start, end in group) for group in groups]
+    return (len(groups) - 1) * tags_size + sum(map(_utf8_size, contents)) - _utf8_size(paragraph_html)
+
+
+def analyze_document(html_content, context, analysis, stats=NULL_STATS):
+    """
+    Анализирует HTML-контент документа: учитывает в analysis, что изменила бы process_document
+    с теми же настройками, не меняя и не сериализуя документ.
+
+    :param html_content: Строка с HTML-контентом EPUB-файла.
+    :param context: SplitterContext книги (см. splitter_context.py).
+    :param analysis: BookAnalysis, в который добавляется результат.
+    :param stats: ProcessingStats для замера времени этапов (см. stats.py).
+    """
+    engine, max_len, segmenter = context.engine, context.max_len, context.segmenter
+    start_time = stats.clock()
+    if engine != ENGINE_BS4:
+        if __package__:
+            from .lxml_split import PARAGRAPH_TAGS, ParagraphMarkup, MalformedDocument, parse_html, paragraph_text, \
+                merge_adjacent_paragraphs_lxml
+        else:
+            from lxml_split import PARAGRAPH_TAGS, ParagraphMarkup, MalformedDocument, parse_html, paragraph_text, \
+                merge_adjacent_paragraphs_lxml
+        try:
+            _, root = parse_html(html_content)
+        except MalformedDocument:
+            # Как и process_document, некорректный XHTML разбирает BeautifulSoup
+            engine = ENGINE_BS4
+            stats.count(COUNTER_PARSE_FALLBACKS)
+    if engine == ENGINE_BS4:
+        root = BeautifulSoup(html_content, 'html.parser')
+        find_paragraphs = lambda: root.find_all('p')
+        merge = merge_adjacent_paragraphs
+        paragraph_tags_size = lambda paragraph: _tags_size(paragraph.name, paragraph.attrs)
+        paragraph_markup = lambda paragraph: ''.join(str(child) for child in paragraph.children)
+    else:
+        find_paragraphs = lambda: list(root.iter(*PARAGRAPH_TAGS))
+        merge = merge_adjacent_paragraphs_lxml
+        paragraph_tags_size = lambda paragraph: _tags_size('p', paragraph.attrib)
+        if engine == ENGINE_LXML_DOM:
+            paragraph_markup = paragraph_text
+        else:
+            paragraph_markup = lambda paragraph: ParagraphMarkup(paragraph).html
+    start_time = stats.lap(STAGE_PARSE, start_time)
+
+    paragraphs = find_paragraphs()
+    analysis.documents += 1
+    stats.count(COUNTER_DOCUMENTS)
+    if context.merge_before_splitting:
+        # Объединение меняет дерево, но это дерево анализа, а не документ книги. Размер уменьшается
+        # на теги присоединенных абзацев (содержимое переносится в первый абзац серии как есть)
+        tags_size_before = sum(map(paragraph_tags_size, paragraphs))
+        merged = merge(root)
+        paragraphs = find_paragraphs()
+        analysis.paragraphs_merged += merged
+        analysis.size_delta += sum(map(paragraph_tags_size, paragraphs)) - tags_size_before
+        stats.count(COUNTER_PARAGRAPHS_MERGED, merged)
+        start_time = stats.lap(STAGE_MERGE, start_time)
+
+    analysis.paragraphs += len(paragraphs)
+    stats.count(COUNTER_PARAGRAPHS, len(paragraphs))
+    for paragraph in paragraphs:
+        start_time = stats.clock()
+        paragraph_html = paragraph_markup(paragraph)
+        stats.lap(STAGE_EXTRACT, start_time)
+        words_count = count_words(paragraph_html)
+        analysis.add_paragraph(words_count)
+        if words_count <= max_len:
+            continue
+
+        groups = plan_paragraph_split(paragraph_html, max_len, stats, segmenter)
+        if groups is None or (engine == ENGINE_LXML_DOM and len(groups) < 2):
+            continue
+        if len(groups) > 1:
+            analysis.paragraphs_split += 1
+            analysis.paragraphs_created += len(groups)
+            stats.count(COUNTER_PARAGRAPHS_SPLIT)
+            stats.count(COUNTER_PARAGRAPHS_CREATED, len(groups))
+        analysis.size_delta += _split_size_delta(paragraph_html, groups, paragraph_tags_size(paragraph), engine)
+
+
+def analyze_epub(epub_path, context, spine_only=False, stats=NULL_STATS):
+    """
+    Анализирует EPUB файл: читает документы, которые обработала бы process_epub, и считает по ним
+    статистику (см. analyze_document). Ничего не записывает.
+
+    :param epub_path: Путь к .epub файлу.
+    :param context: SplitterContext книги (см. splitter_context.py).
+    :param spine_only: Признак того, что анализируются только документы из spine OPF.
+    :param stats: ProcessingStats для замера времени этапов (см. stats.py).
+    :return: BookAnalysis.
+    """
+    analysis = BookAnalysis()
+    start = time.perf_counter()
+    with zipfile.ZipFile(epub_path, 'r') as source_zip:
+        is_document = _document_filter(source_zip, spine_only, epub_path)
+        for info in source_zip.infolist():
+            if info.filename == MIMETYPE_ENTRY or not is_document(info):
+                continue
+            start_time = stats.clock()
+            content = source_zip.read(info.filename)
+            stats.lap(STAGE_UNZIP, start_time)
+            analysis.size += len(content)
+            analyze_document(content.decode('utf-8'), context, analysis, stats)
+    analysis.seconds = time.perf_counter() - start
+    return analysis
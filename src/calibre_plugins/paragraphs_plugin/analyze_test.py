@@ -0,0 +1,97 @@
+import os
+import zipfile
+import tempfile
+import unittest
+
+from analyze import *
+from epub_split import process_epub, process_document, ENGINE_BS4, ENGINE_LXML, ENGINE_LXML_DOM
+from splitter_context import SplitterContext
+from stats import ProcessingStats
+
+CHAPTER = ('<html><body><p class="a">Один два три. Четыре пять шесть. Семь восемь девять.</p>'
+           '<p class="a">Десять.</p><p>Одиннадцать двенадцать.</p></body></html>')
+
+
+class TestBookAnalysis(unittest.TestCase):
+    def test_histogram(self):
+        analysis = BookAnalysis()
+        for words_count in (0, 4, 5, 499, 500, 10000):
+            analysis.add_paragraph(words_count)
+        self.assertEqual(analysis.as_dict()['histogram'],
+                         {'0-4': 2, '5-9': 1, '10-19': 0, '20-49': 0, '50-99': 0, '100-199': 0, '200-499': 1,
+                          '500+': 2})
+
+    def test_update(self):
+        total, analysis = BookAnalysis(), BookAnalysis()
+        analysis.paragraphs = 3
+        analysis.add_paragraph(7)
+        total.update(analysis)
+        total.update(analysis)
+        self.assertEqual(total.paragraphs, 6)
+        self.assertEqual(total.histogram[1], 2)
+
+
+class TestAnalyzeDocument(unittest.TestCase):
+    def analyze(self, html, context):
+        analysis = BookAnalysis()
+        stats = ProcessingStats()
+        analyze_document(html, context, analysis, stats)
+        return analysis, stats
+
+    def test_same_counts_as_processing(self):
+        for engine in (ENGINE_BS4, ENGINE_LXML, ENGINE_LXML_DOM):
+            for merge in (False, True):
+                with self.subTest(engine=engine, merge=merge):
+                    context = SplitterContext(3, merge, engine)
+                    analysis, _ = self.analyze(CHAPTER, context)
+                    stats = ProcessingStats()
+                    result = process_document(CHAPTER, context, stats)
+                    self.assertEqual(analysis.paragraphs, stats.counters['paragraphs'])
+                    self.assertEqual(analysis.paragraphs_merged, stats.counters['paragraphs merged'])
+                    self.assertEqual(analysis.paragraphs_split, stats.counters['paragraphs split'])
+                    self.assertEqual(analysis.paragraphs_created, stats.counters['paragraphs created'])
+                    # В простом документе сериализация ничего не меняет, и оценка размера точная
+                    self.assertEqual(analysis.size_delta, len(result.encode('utf-8')) - len(CHAPTER.encode('utf-8')))
+
+    def test_histogram_counts_words(self):
+        analysis, _ = self.analyze(CHAPTER, SplitterContext(3))
+        self.assertEqual(analysis.histogram[:2], [2, 1])
+        self.assertEqual(analysis.documents, 1)
+
+    def test_malformed_document_is_parsed_by_bs4(self):
+        html = '<p>Раз два три. Четыре <b>пять шесть. Семь восемь девять.</p><p>Десять одиннадцать.</p>'
+        analysis, stats = self.analyze(html, SplitterContext(3, engine=ENGINE_LXML))
+        expected, _ = self.analyze(html, SplitterContext(3))
+        self.assertEqual(analysis.as_dict(), expected.as_dict())
+        self.assertEqual(stats.counters['parse fallbacks'], 1)
+
+
+class TestAnalyzeEpub(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.epub_path = os.path.join(self.tmp_dir.name, 'book.epub')
+        with zipfile.ZipFile(self.epub_path, 'w') as zip_ref:
+            zip_ref.writestr('mimetype', 'application/epub+zip')
+            zip_ref.writestr('OEBPS/chapter.xhtml', CHAPTER, zipfile.ZIP_DEFLATED)
+            zip_ref.writestr('OEBPS/style.css', 'p { margin: 0 }')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_book_is_not_rewritten(self):
+        with open(self.epub_path, 'rb') as f:
+            original = f.read()
+        analysis = process_epub(self.epub_path, 3, backuping=True, analyze=True)
+        with open(self.epub_path, 'rb') as f:
+            self.assertEqual(f.read(), original)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['book.epub'])
+
+        self.assertEqual(analysis.documents, 1)
+        self.assertEqual(analysis.size, len(CHAPTER.encode('utf-8')))
+        self.assertEqual(analysis.paragraphs_split, 1)
+        self.assertGreater(analysis.seconds, 0)
+        self.assertIsNone(process_epub(self.epub_path, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
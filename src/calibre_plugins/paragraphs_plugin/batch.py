@@ -0,0 +1,280 @@
+"""
+Пакетное разбиение абзацев во многих книгах из командной строки.
+
+Книги (EPUB и TXT) ищутся по путям к файлам, директориям (рекурсивно) и glob-шаблонам и обрабатываются
+параллельно в пуле процессов - по книге на процесс (документы внутри книги обрабатываются
+последовательно, чтобы не запускать пул внутри пула). Для каждой книги печатается время обработки
+и скорость, в конце - сводка.
+
+Запуск:
+
+    python batch.py [пути, директории, шаблоны] [параметры]
+    calibre-debug -r "Split Paragraphs Plugin" -- [пути, директории, шаблоны] [параметры]
+
+Во втором случае (через cli_main плагина) значения параметров по умолчанию берутся из настроек плагина.
+С параметром --output-dir результат записывается в отдельную директорию (с сохранением структуры
+поддиректорий), а оригиналы остаются нетронутыми. С параметром --analyze книги только анализируются
+(см. analyze.py): для каждой книги и в сводке печатается, сколько абзацев будет разбито и объединено,
+насколько изменится размер и распределение длины абзацев, а книги не перезаписываются.
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import collections
+
+try:
+    from .epub_split import process_epub, DEFAULT_COMPRESS_LEVEL, DEFAULT_STREAM_THRESHOLD, ENGINE_BS4, ENGINE_LXML, \
+        ENGINE_LXML_DOM
+    from .txt_split import process_txt, detect_encoding
+    from .parallel import imap_in_processes, resolve_workers
+    from .result_cache import ResultCache, DEFAULT_MAX_SIZE
+    from .analyze import BookAnalysis
+except ImportError:
+    from epub_split import process_epub, DEFAULT_COMPRESS_LEVEL, DEFAULT_STREAM_THRESHOLD, ENGINE_BS4, ENGINE_LXML, \
+        ENGINE_LXML_DOM
+    from txt_split import process_txt, detect_encoding
+    from parallel import imap_in_processes, resolve_workers
+    from result_cache import ResultCache, DEFAULT_MAX_SIZE
+    from analyze import BookAnalysis
+
+# Расширения книг, которые умеет обрабатывать плагин
+BOOK_EXTENSIONS = ('.epub', '.txt')
+
+# Результат обработки одной книги: путь к книге, путь к результату, размер книги в байтах,
+# время обработки в секундах, текст ошибки (None, если книга обработана) и результат анализа
+# (BookAnalysis, если книга только анализировалась, иначе None)
+BookResult = collections.namedtuple('BookResult', 'path output_path size seconds error analysis', defaults=(None,))
+
+
+def _is_book(path):
+    """Признак того, что файл - книга поддерживаемого формата (временные файлы плагина пропускаются)."""
+    name = os.path.basename(path)
+    return name.lower().endswith(BOOK_EXTENSIONS) and not name.startswith('.paragraphs-')
+
+
+def _glob_root(pattern):
+    """Директория, от которой отсчитываются пути найденных по шаблону файлов: часть шаблона до первого спецсимвола."""
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or os.curdir
+
+
+def find_books(paths, exclude_dir=None):
+    """
+    Находит книги по путям к файлам, директориям (рекурсивно) и glob-шаблонам (поддерживается **).
+
+    :param paths: Список путей и шаблонов.
+    :param exclude_dir: Директория, книги в которой пропускаются (например, директория с результатами).
+    :return: Список пар (путь к книге, директория, относительно которой сохраняется структура
+             поддиректорий в режиме --output-dir) без повторов, в порядке обнаружения.
+    """
+    exclude_dir = os.path.abspath(exclude_dir) + os.sep if exclude_dir else None
+    books = []
+    seen = set()
+
+    def add(path, root):
+        key = os.path.abspath(path)
+        if key in seen or (exclude_dir and key.startswith(exclude_dir)):
+            return
+        seen.add(key)
+        books.append((path, root))
+
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                # Обходим директории в алфавитном порядке, чтобы порядок книг был воспроизводимым
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if _is_book(filename):
+                        add(os.path.join(dirpath, filename), path)
+        elif glob.has_magic(path):
+            root = _glob_root(path)
+            for match in sorted(glob.glob(path, recursive=True)):
+                if os.path.isfile(match) and _is_book(match):
+                    add(match, root)
+        elif os.path.isfile(path):
+            # Явно указанный файл обрабатывается при любом расширении (формат определяется в process_book)
+            add(path, os.path.dirname(path))
+    return books
+
+
+def output_path_for(book_path, root, output_dir):
+    """
+    Путь к результату в режиме --output-dir: путь книги относительно root, перенесенный в output_dir.
+
+    :param book_path: Путь к книге.
+    :param root: Директория, относительно которой сохраняется структура поддиректорий.
+    :param output_dir: Директория результатов.
+    :return: Путь к результату.
+    """
+    return os.path.join(output_dir, os.path.relpath(book_path, root or os.curdir))
+
+
+def process_book(book_path, output_path, max_len, merge_before_splitting, backuping, engine, compress_level,
+                 spine_only, cache_dir, cache_size, cache_version, incremental=False,
+                 stream_threshold=DEFAULT_STREAM_THRESHOLD, language=None, abbreviations=None,
+                 conditional_abbreviations=None, analyze=False):
+    """
+    Обрабатывает одну книгу (функция рабочего процесса).
+
+    Ошибка в одной книге не прерывает пакетную обработку: она возвращается в результате.
+
+    :param book_path: Путь к книге.
+    :param output_path: Путь к результату или None (книга перезаписывается).
+    :param cache_dir: Директория кэша результатов или None (кэш не используется).
+    :param cache_size: Максимальный размер кэша в байтах.
+    :param cache_version: Версия, которая входит в ключи кэша (см. ResultCache) и в манифест обработки.
+    :param incremental: Признак инкрементальной обработки EPUB (см. split_manifest.py).
+    :param stream_threshold: Размер документа EPUB в байтах, начиная с которого он обрабатывается потоково
+                             (см. stream_split.py).
+    :param language: Язык книг для разбиения на предложения или None (язык каждой книги берется из ее OPF).
+    :param abbreviations: Пользовательские безусловные сокращения (см. segmenters.py) или None.
+    :param conditional_abbreviations: Пользовательские условные сокращения (см. segmenters.py) или None.
+    :param analyze: Признак анализа EPUB без перезаписи (см. analyze.py).
+    :return: BookResult.
+    """
+    start = time.perf_counter()
+    analysis = None
+    try:
+        size = os.path.getsize(book_path)
+        if output_path:
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+        ext = os.path.splitext(book_path)[1].lower()
+        if ext == '.epub':
+            cache = ResultCache(cache_dir, cache_size, cache_version) if cache_dir else None
+            analysis = process_epub(book_path, max_len, merge_before_splitting, backuping, engine, compress_level,
+                                    spine_only, workers=1, cache=cache, output_path=output_path,
+                                    incremental=incremental, version=cache_version, stream_threshold=stream_threshold,
+                                    language=language, abbreviations=abbreviations,
+                                    conditional_abbreviations=conditional_abbreviations, analyze=analyze)
+        elif ext == '.txt':
+            process_txt(book_path, max_len, detect_encoding(book_path), output_path=output_path)
+        else:
+            raise ValueError(f"Unsupported file type: {ext}")
+    except Exception as e:
+        return BookResult(book_path, output_path, 0, time.perf_counter() - start, f'{type(e).__name__}: {e}')
+    return BookResult(book_path, output_path, size, time.perf_counter() - start, None, analysis)
+
+
+def _throughput(size, seconds):
+    """Скорость обработки в МиБ/с."""
+    return size / 2 ** 20 / seconds if seconds > 0 else 0.0
+
+
+def build_parser(prog=None):
+    """Парсер аргументов командной строки."""
+    parser = argparse.ArgumentParser(prog=prog, description='Пакетное разбиение длинных абзацев в книгах EPUB и TXT.')
+    parser.add_argument('paths', nargs='+', help='Пути к книгам, директории (обходятся рекурсивно) или glob-шаблоны.')
+    parser.add_argument('-o', '--output-dir',
+                        help='Директория для результатов (оригиналы не изменяются). По умолчанию книги перезаписываются.')
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='Количество книг, обрабатываемых параллельно (0 - по количеству процессоров).')
+    parser.add_argument('-l', '--len', type=int, default=10, help='Максимальное количество слов в абзаце.')
+    parser.add_argument('-m', '--merge', action=argparse.BooleanOptionalAction, default=False,
+                        help='Объединить все абзацы перед последующим разбиением.')
+    parser.add_argument('-b', '--backup', action='store_true', help='Делать ли backup перед форматированием.')
+    parser.add_argument('-z', '--compress-level', type=int, choices=range(10), default=DEFAULT_COMPRESS_LEVEL,
+                        help='Уровень сжатия deflate (0-9) для перезаписываемых HTML файлов.')
+    parser.add_argument('-s', '--spine-only', action=argparse.BooleanOptionalAction, default=False,
+                        help='Обрабатывать только документы из spine OPF.')
+    parser.add_argument('-c', '--cache-dir', help='Директория кэша результатов обработки документов.')
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None,
+                        help='Не использовать кэш (даже если директория кэша задана по умолчанию).')
+    parser.add_argument('-i', '--incremental', action=argparse.BooleanOptionalAction, default=False,
+                        help='Записывать в EPUB манифест обработки и не обрабатывать повторно уже обработанные документы.')
+    parser.add_argument('-t', '--stream-threshold', type=int, default=DEFAULT_STREAM_THRESHOLD // 1024,
+                        help='Размер документа EPUB (КБ), начиная с которого он обрабатывается потоково (0 - никогда).')
+    parser.add_argument('-L', '--language',
+                        help='Язык книг для разбиения на предложения (по умолчанию - из метаданных OPF каждой книги).')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_SIZE // 2 ** 20,
+                        help='Максимальный размер кэша (МБ).')
+    parser.add_argument('-e', '--engine', choices=[ENGINE_BS4, ENGINE_LXML, ENGINE_LXML_DOM], default=ENGINE_BS4,
+                        help='Движок разбиения абзацев.')
+    parser.add_argument('-a', '--analyze', action='store_true',
+                        help='Только посчитать, что изменит разбиение, не перезаписывая книги (только EPUB).')
+    return parser
+
+
+def main(argv=None, prog=None, cache_version='', **defaults):
+    """
+    Точка входа пакетной обработки.
+
+    :param argv: Аргументы командной строки (по умолчанию sys.argv[1:]).
+    :param prog: Имя программы для справки.
+    :param cache_version: Версия, которая входит в ключи кэша (см. ResultCache) и в манифест обработки.
+    :param defaults: Значения параметров по умолчанию (имена - как у атрибутов разобранных аргументов).
+    :return: Код возврата: 0 - все книги обработаны, 1 - были ошибки.
+    """
+    parser = build_parser(prog)
+    # Пользовательские сокращения задаются только в настройках плагина (см. segmenters.py)
+    parser.set_defaults(abbreviations=None, conditional_abbreviations=None)
+    parser.set_defaults(**defaults)
+    args = parser.parse_args(argv)
+
+    books = find_books(args.paths, exclude_dir=args.output_dir)
+    if args.analyze:
+        # Анализ без перезаписи есть только для EPUB, результаты никуда не записываются
+        skipped = [book_path for book_path, _ in books if not book_path.lower().endswith('.epub')]
+        if skipped:
+            print(f'Пропущено книг не в формате EPUB: {len(skipped)}')
+        books = [(book_path, root) for book_path, root in books if book_path.lower().endswith('.epub')]
+        args.output_dir = None
+    if not books:
+        parser.error('не найдено ни одной книги')
+
+    args_list = []
+    outputs = {}
+    for book_path, root in books:
+        output_path = output_path_for(book_path, root, args.output_dir) if args.output_dir else None
+        if output_path:
+            # Две книги с одинаковым относительным путем из разных источников перезаписали бы друг друга
+            key = os.path.abspath(output_path)
+            if key in outputs:
+                parser.error(f'книги {outputs[key]} и {book_path} записываются в один файл {output_path}')
+            outputs[key] = book_path
+        args_list.append((book_path, output_path, args.len, args.merge, args.backup, args.engine, args.compress_level,
+                          args.spine_only, args.cache_dir, args.cache_size * 2 ** 20, cache_version, args.incremental,
+                          args.stream_threshold * 1024, args.language, args.abbreviations,
+                          args.conditional_abbreviations, args.analyze))
+
+    jobs = resolve_workers(args.jobs)
+    print(f'Книг: {len(books)}, процессов: {min(jobs, len(books))}')
+
+    start = time.perf_counter()
+    results = []
+    for _, result in imap_in_processes(process_book, args_list, jobs):
+        results.append(result)
+        prefix = f'[{len(results)}/{len(books)}] {result.path}'
+        if result.error:
+            print(f'{prefix}: ошибка: {result.error}', file=sys.stderr)
+        elif result.analysis is not None:
+            print(f'{prefix}: {result.analysis.summary()}')
+        else:
+            print(f'{prefix}: {result.seconds:.2f} s, {result.size / 2 ** 20:.2f} MiB, '
+                  f'{_throughput(result.size, result.seconds):.2f} MiB/s')
+        sys.stdout.flush()
+    elapsed = time.perf_counter() - start
+
+    failed = sum(1 for result in results if result.error)
+    total_size = sum(result.size for result in results)
+    print(f'Обработано книг: {len(results) - failed}, ошибок: {failed}, {total_size / 2 ** 20:.1f} MiB '
+          f'за {elapsed:.2f} s ({_throughput(total_size, elapsed):.1f} MiB/s, '
+          f'суммарное время обработки книг {sum(result.seconds for result in results):.2f} s)')
+    if args.analyze:
+        total = BookAnalysis()
+        for result in results:
+            if result.analysis is not None:
+                total.update(result.analysis)
+        print(f'Итого: {total.summary()}')
+        print('\n'.join(total.histogram_lines()))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import io
+import os
+import zipfile
+import tempfile
+import unittest
+import contextlib
+
+from batch import *
+from parallel_test import fake_calibre_pool
+
+CHAPTER = '<html><body><p>Один два три. Четыре пять шесть. Семь восемь девять.</p></body></html>'
+SPLIT_CHAPTER = '<html><body><p>Один два три.</p><p>Четыре пять шесть.</p><p>Семь восемь девять.</p></body></html>'
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.library = os.path.join(self.tmp_dir.name, 'library')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, *parts):
+        return os.path.join(self.library, *parts)
+
+    def write_epub(self, *parts):
+        path = self.path(*parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with zipfile.ZipFile(path, 'w') as zip_ref:
+            zip_ref.writestr('mimetype', 'application/epub+zip')
+            zip_ref.writestr('OEBPS/chapter.xhtml', CHAPTER, zipfile.ZIP_DEFLATED)
+        return path
+
+    def write_file(self, content, *parts):
+        path = self.path(*parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    @staticmethod
+    def chapter(epub_path):
+        with zipfile.ZipFile(epub_path) as zip_ref:
+            return zip_ref.read('OEBPS/chapter.xhtml').decode('utf-8')
+
+    def run_main(self, *argv):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            code = main(list(argv))
+        return code, stdout.getvalue(), stderr.getvalue()
+
+
+class TestFindBooks(BatchTestCase):
+    def test_directories_globs_and_files(self):
+        a = self.write_epub('A', 'a.epub')
+        b = self.write_epub('B', 'sub', 'b.epub')
+        c = self.write_file('Текст.', 'B', 'c.txt')
+        self.write_file('', 'B', 'cover.jpg')
+        self.write_file('', 'B', '.paragraphs-tmp.epub')
+
+        # Файлы директории идут раньше файлов ее поддиректорий
+        self.assertEqual(find_books([self.library]), [(a, self.library), (c, self.library), (b, self.library)])
+        self.assertEqual(find_books([os.path.join(self.library, '**', '*.epub')]), [(a, self.library), (b, self.library)])
+        # Повторы не добавляются
+        self.assertEqual(find_books([b, self.path('B')]), [(b, os.path.dirname(b)), (c, self.path('B'))])
+        self.assertEqual(find_books([self.path('missing.epub')]), [])
+
+    def test_output_dir_is_excluded(self):
+        a = self.write_epub('a.epub')
+        self.write_epub('out', 'a.epub')
+        self.assertEqual(find_books([self.library], exclude_dir=self.path('out')), [(a, self.library)])
+
+    def test_output_path(self):
+        self.assertEqual(output_path_for(os.path.join('lib', 'A', 'a.epub'), 'lib', 'out'), os.path.join('out', 'A', 'a.epub'))
+        self.assertEqual(output_path_for('a.epub', '', 'out'), os.path.join('out', 'a.epub'))
+
+
+class TestMain(BatchTestCase):
+    def test_output_dir_leaves_originals_untouched(self):
+        a = self.write_epub('A', 'a.epub')
+        b = self.write_epub('B', 'b.epub')
+        with open(a, 'rb') as f:
+            original = f.read()
+        output_dir = os.path.join(self.tmp_dir.name, 'out')
+
+        code, stdout, _ = self.run_main(self.library, '--output-dir', output_dir, '-l', '3', '-j', '2')
+
+        self.assertEqual(code, 0)
+        with open(a, 'rb') as f:
+            self.assertEqual(f.read(), original)
+        self.assertEqual(self.chapter(os.path.join(output_dir, 'A', 'a.epub')), SPLIT_CHAPTER)
+        self.assertEqual(self.chapter(os.path.join(output_dir, 'B', 'b.epub')), SPLIT_CHAPTER)
+        self.assertIn('MiB/s', stdout)
+        self.assertIn('[2/2]', stdout)
+
+    def test_in_place(self):
+        a = self.write_epub('a.epub')
+        txt = self.write_file('Один два три. Четыре пять шесть.\n', 'b.txt')
+
+        code, _, _ = self.run_main(self.library, '-l', '3', '-j', '1')
+
+        self.assertEqual(code, 0)
+        self.assertEqual(self.chapter(a), SPLIT_CHAPTER)
+        with open(txt, encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'Один два три.\nЧетыре пять шесть.\n')
+
+    def test_failed_book_does_not_stop_batch(self):
+        self.write_file('не zip', 'broken.epub')
+        a = self.write_epub('a.epub')
+
+        code, _, stderr = self.run_main(self.library, '-l', '3', '-j', '1')
+
+        self.assertEqual(code, 1)
+        self.assertIn('broken.epub', stderr)
+        self.assertEqual(self.chapter(a), SPLIT_CHAPTER)
+
+    def test_defaults(self):
+        a = self.write_epub('a.epub')
+        with contextlib.redirect_stdout(io.StringIO()):
+            main([a, '-j', '1'], len=3)
+        self.assertEqual(self.chapter(a), SPLIT_CHAPTER)
+
+    def test_calibre_pool(self):
+        # Из calibre-debug -r (cli_main) книги обрабатываются в пуле рабочих процессов calibre
+        a = self.write_epub('A', 'a.epub')
+        b = self.write_epub('B', 'b.epub')
+        with fake_calibre_pool(process_book) as pools:
+            code, stdout, _ = self.run_main(self.library, '-l', '3', '-j', '2')
+
+        self.assertEqual(code, 0)
+        self.assertEqual(len(pools), 1)
+        self.assertEqual(self.chapter(a), SPLIT_CHAPTER)
+        self.assertEqual(self.chapter(b), SPLIT_CHAPTER)
+        self.assertIn('[2/2]', stdout)
+
+    def test_analyze(self):
+        a = self.write_epub('a.epub')
+        self.write_file('Один два три. Четыре пять шесть.\n', 'b.txt')
+
+        code, stdout, _ = self.run_main(self.library, '-l', '3', '-j', '1', '--analyze')
+
+        self.assertEqual(code, 0)
+        self.assertEqual(self.chapter(a), CHAPTER)
+        self.assertIn('1 to split into 3', stdout)
+        self.assertIn('Пропущено книг не в формате EPUB: 1', stdout)
+        self.assertIn('Итого:', stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,20 @@ plugin_prefs = JSONConfig('plugins/SplitParagraphsPlugin')
 # Значения по умолчанию
 defaults = {
     'words_per_line': 10,            # Количество слов в строке по умолчанию
-    'merge_before_splitting': False  # Флаг объединения всех абзацев перед разделением
+    'mode': 'postprocess',            # Когда разбивать абзацы: 'postprocess' (в файле после конвертации) или 'transform' (в дереве книги во время конвертации)
+    'merge_before_splitting': False,  # Флаг объединения всех абзацев перед разделением
+    'engine': 'bs4',                  # Движок разбиения абзацев: 'bs4' (BeautifulSoup), 'lxml' или 'lxml-dom'
+    'compress_level': 6,              # Уровень сжатия deflate (0-9) для перезаписываемых HTML файлов EPUB
+    'spine_only': False,              # Флаг обработки только документов из spine OPF (а не всех HTML файлов)
+    'workers': 1,                     # Количество процессов для обработки документов EPUB (0 - по количеству процессоров)
+    'cache_enabled': True,            # Флаг кэширования результатов обработки документов EPUB
+    'cache_size_mb': 200,             # Максимальный размер кэша результатов (в мегабайтах)
+    'stream_threshold_kb': 2048,      # Размер документа EPUB (в килобайтах), начиная с которого он обрабатывается потоково (0 - никогда)
+    'abbreviations': {},              # Дополнительные безусловные сокращения: язык ('*' - любой) -> список сокращений
+    'conditional_abbreviations': {},  # Дополнительные условные сокращения (после них предложение может завершаться)
+    'incremental': False,             # Флаг инкрементальной обработки EPUB: уже обработанные документы не обрабатываются повторно
+    'stats_verbosity': 1,             # Подробность статистики обработки в журнале (0 - нет, 1 - итог, 2 - этапы, 3 - документы)
+    'profile_dir': '',                # Директория для профилей cProfile (пустая строка - профилирование выключено)
 }
 
 plugin_prefs.defaults = defaults
@@ -15,5 +28,44 @@ plugin_prefs.defaults = defaults
 def get_words_per_line():
     return plugin_prefs['words_per_line']
 
+def get_mode():
+    return plugin_prefs['mode']
+
 def get_merge_paragraphs():
     return plugin_prefs['merge_before_splitting']
+
+def get_engine():
+    return plugin_prefs['engine']
+
+def get_compress_level():
+    return plugin_prefs['compress_level']
+
+def get_spine_only():
+    return plugin_prefs['spine_only']
+
+def get_workers():
+    return plugin_prefs['workers']
+
+def get_cache_enabled():
+    return plugin_prefs['cache_enabled']
+
+def get_cache_size_mb():
+    return plugin_prefs['cache_size_mb']
+
+def get_stream_threshold_kb():
+    return plugin_prefs['stream_threshold_kb']
+
+def get_abbreviations():
+    return plugin_prefs['abbreviations']
+
+def get_conditional_abbreviations():
+    return plugin_prefs['conditional_abbreviations']
+
+def get_incremental():
+    return plugin_prefs['incremental']
+
+def get_stats_verbosity():
+    return plugin_prefs['stats_verbosity']
+
+def get_profile_dir():
+    return plugin_prefs['profile_dir']
@@ -0,0 +1,250 @@
+"""
+Бенчмарк обработки EPUB целиком: генератор синтетических книг и замер времени этапов для каждого движка.
+
+Запуск (из директории плагина):
+
+    python epub_process_bench.py [-o результат.json] [параметры корпуса]
+
+Генерируется синтетическая книга заданного размера (русский и английский текст, диалоги, сокращения,
+инициалы, inline-теги), после чего она обрабатывается process_epub каждым движком. Для каждого движка
+берется лучший из нескольких прогонов и записывается время по этапам (см. stats.py). Результат
+выводится в формате JSON вместе с версией плагина, чтобы результаты разных версий можно было сравнивать.
+"""
+import os
+import re
+import sys
+import json
+import math
+import random
+import time
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+
+from epub_split import process_epub, ENGINE_BS4, ENGINE_LXML, ENGINE_LXML_DOM, DEFAULT_COMPRESS_LEVEL
+from epub_split_bench import SAMPLE_SENTENCES
+from stats import ProcessingStats, STAGES
+
+ENGINES = [ENGINE_BS4, ENGINE_LXML, ENGINE_LXML_DOM]
+
+# Английские предложения: сокращения, инициалы, числа, кавычки и inline-теги
+LATIN_SENTENCES = [
+    'Mr. Darcy looked at her and said nothing.',
+    'The meeting was held at 10 a.m. in St. Petersburg, i.e. in the old building.',
+    'J. R. R. Tolkien wrote <i>The Hobbit</i> in 1937.',
+    'She paid $12.50 for the book, which was quite a lot.',
+    '"Where are you going?" he asked.',
+    'Prof. Moriarty was, e.g., the most dangerous man in London.',
+    'It was a dark and stormy night; the rain fell in torrents.',
+    'See <a href="notes.xhtml#n1">note 1</a> for details.',
+]
+
+# Реплики диалогов: короткие однострочные абзацы
+DIALOGUE_LINES = [
+    '— Да.',
+    '— Куда ты идешь?',
+    '— Не знаю... Может, домой.',
+    '— Постой! — крикнул он ей вслед.',
+    '— Hello, Dr. Watson.',
+    '— Что? — переспросила Наташа.',
+]
+
+CONTAINER_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>'''
+
+OPF_TEMPLATE = '''<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:title>Синтетическая книга</dc:title>
+    <dc:language>ru</dc:language>
+    <dc:identifier id="id">bench</dc:identifier>
+  </metadata>
+  <manifest>
+    <item id="css" href="style.css" media-type="text/css"/>
+    <item id="cover" href="images/cover.png" media-type="image/png"/>
+{items}
+  </manifest>
+  <spine>
+{itemrefs}
+  </spine>
+</package>'''
+
+CHAPTER_TEMPLATE = '''<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title>Глава {number}</title><link rel="stylesheet" type="text/css" href="style.css"/></head>
+<body>
+<h1>Глава {number}</h1>
+{paragraphs}
+</body>
+</html>'''
+
+
+def generate_paragraph(rnd, mean_sentences, sigma, max_sentences, latin_ratio):
+    """
+    Генерирует абзац: количество предложений берется из логнормального распределения
+    с медианой mean_sentences (длинные абзацы встречаются реже коротких, но бывают очень длинными).
+
+    :return: HTML-содержимое абзаца (без тега <p>).
+    """
+    count = min(max(1, round(rnd.lognormvariate(math.log(mean_sentences), sigma))), max_sentences)
+    sentences = [rnd.choice(LATIN_SENTENCES if rnd.random() < latin_ratio else SAMPLE_SENTENCES) for _ in range(count)]
+    return ' '.join(sentences)
+
+
+def generate_epub(path, chapters=20, paragraphs_per_chapter=300, mean_sentences=4.0, sigma=0.8, max_sentences=60,
+                  dialogue_ratio=0.3, latin_ratio=0.2, seed=0):
+    """
+    Генерирует синтетическую книгу EPUB.
+
+    :param path: Путь к создаваемому файлу.
+    :param chapters: Количество глав (документов в spine).
+    :param paragraphs_per_chapter: Количество абзацев в главе.
+    :param mean_sentences: Медиана количества предложений в абзаце (не считая реплик диалогов).
+    :param sigma: Параметр разброса логнормального распределения длины абзаца.
+    :param max_sentences: Максимальное количество предложений в абзаце.
+    :param dialogue_ratio: Доля однострочных реплик диалогов среди абзацев.
+    :param latin_ratio: Доля английских предложений.
+    :param seed: Зерно генератора случайных чисел (для воспроизводимости).
+    :return: Статистика книги: количество абзацев и суммарный размер документов в байтах.
+    """
+    rnd = random.Random(seed)
+    paragraphs_count = 0
+    documents_size = 0
+    with zipfile.ZipFile(path, 'w') as zip_ref:
+        zip_ref.writestr('mimetype', 'application/epub+zip', zipfile.ZIP_STORED)
+        zip_ref.writestr('META-INF/container.xml', CONTAINER_XML, zipfile.ZIP_DEFLATED)
+        zip_ref.writestr('OEBPS/style.css', 'p { margin: 0; text-indent: 1.5em }\n.dialog { margin-left: 1em }\n',
+                         zipfile.ZIP_DEFLATED)
+        # Картинка не сжимается (как и в настоящих книгах) и копируется в новый архив как есть
+        zip_ref.writestr('OEBPS/images/cover.png', rnd.randbytes(64 * 1024), zipfile.ZIP_STORED)
+
+        names = []
+        for number in range(1, chapters + 1):
+            paragraphs = []
+            for _ in range(paragraphs_per_chapter):
+                if rnd.random() < dialogue_ratio:
+                    paragraphs.append(f'<p class="dialog">{rnd.choice(DIALOGUE_LINES)}</p>')
+                else:
+                    paragraph = generate_paragraph(rnd, mean_sentences, sigma, max_sentences, latin_ratio)
+                    paragraphs.append(f'<p class="text">{paragraph}</p>')
+            chapter = CHAPTER_TEMPLATE.format(number=number, paragraphs='\n'.join(paragraphs)).encode('utf-8')
+            name = f'chapter{number:03}.xhtml'
+            zip_ref.writestr('OEBPS/' + name, chapter, zipfile.ZIP_DEFLATED)
+            names.append(name)
+            paragraphs_count += len(paragraphs)
+            documents_size += len(chapter)
+
+        items = '\n'.join(f'    <item id="c{k}" href="{name}" media-type="application/xhtml+xml"/>'
+                          for k, name in enumerate(names))
+        itemrefs = '\n'.join(f'    <itemref idref="c{k}"/>' for k in range(len(names)))
+        zip_ref.writestr('OEBPS/content.opf', OPF_TEMPLATE.format(items=items, itemrefs=itemrefs), zipfile.ZIP_DEFLATED)
+
+    return {'paragraphs': paragraphs_count, 'documents_size': documents_size}
+
+
+def plugin_version():
+    """
+    Версия плагина из __init__.py (сам модуль импортировать нельзя: он импортирует calibre).
+
+    :return: Строка вида '1.0.34' или None.
+    """
+    init_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__init__.py')
+    with open(init_path, encoding='utf-8') as f:
+        match = re.search(r'^VERSION = \(([\d, ]+)\)', f.read(), re.MULTILINE)
+    return '.'.join(part.strip() for part in match.group(1).split(',')) if match else None
+
+
+def bench_engine(epub_path, engine, repeat, max_len, merge_before_splitting, compress_level):
+    """
+    Обрабатывает книгу движком engine repeat раз (каждый раз - исходную книгу, результат пишется во временный файл).
+
+    :return: Пара (полное время лучшего прогона, время этапов этого прогона - ProcessingStats).
+    """
+    best = None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, 'result.epub')
+        for _ in range(repeat):
+            stats = ProcessingStats()
+            start = time.perf_counter()
+            process_epub(epub_path, max_len, merge_before_splitting, engine=engine, compress_level=compress_level,
+                         spine_only=True, output_path=output_path, stats=stats)
+            wall = time.perf_counter() - start
+            if best is None or wall < best[0]:
+                best = (wall, stats)
+    return best
+
+
+def run(args):
+    """Генерирует книгу и замеряет все движки: результат в виде словаря для JSON."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        epub_path = args.epub or os.path.join(tmp_dir, 'bench.epub')
+        corpus = None
+        if not args.epub:
+            corpus = generate_epub(epub_path, args.chapters, args.paragraphs, args.mean_sentences, args.sigma,
+                                   args.max_sentences, args.dialogue_ratio, args.latin_ratio, args.seed)
+            corpus.update(chapters=args.chapters, paragraphs_per_chapter=args.paragraphs,
+                          mean_sentences=args.mean_sentences, sigma=args.sigma, max_sentences=args.max_sentences,
+                          dialogue_ratio=args.dialogue_ratio, latin_ratio=args.latin_ratio, seed=args.seed)
+
+        results = {}
+        for engine in args.engines:
+            wall, stats = bench_engine(epub_path, engine, args.repeat, args.len, args.merge, args.compress_level)
+            # wall - полное время process_epub, total - сумма этапов (без резервной копии, чтения OPF и т.п.)
+            results[engine] = dict(wall=wall, total=stats.total, **stats.as_dict())
+            print(f'{engine:<10} {wall * 1000:10.1f} ms', file=sys.stderr)
+
+        return {
+            'plugin_version': plugin_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'epub': args.epub,
+            'epub_size': os.path.getsize(epub_path),
+            'corpus': corpus,
+            'settings': {'max_len': args.len, 'merge_before_splitting': args.merge,
+                         'compress_level': args.compress_level, 'repeat': args.repeat},
+            'stages': STAGES,
+            'results': results,
+        }
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк обработки EPUB по этапам для каждого движка.')
+    parser.add_argument('-o', '--output', help='Файл для результата в JSON (по умолчанию - стандартный вывод).')
+    parser.add_argument('--epub', help='Замерить эту книгу вместо синтетической.')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES, help='Замеряемые движки.')
+    parser.add_argument('-n', '--repeat', type=int, default=3, help='Количество прогонов каждого движка.')
+    parser.add_argument('-l', '--len', type=int, default=10, help='Максимальное количество слов в абзаце.')
+    parser.add_argument('-m', '--merge', action='store_true', help='Объединять абзацы перед разбиением.')
+    parser.add_argument('-z', '--compress-level', type=int, choices=range(10), default=DEFAULT_COMPRESS_LEVEL,
+                        help='Уровень сжатия deflate (0-9).')
+    corpus = parser.add_argument_group('синтетическая книга')
+    corpus.add_argument('--chapters', type=int, default=20, help='Количество глав.')
+    corpus.add_argument('--paragraphs', type=int, default=300, help='Количество абзацев в главе.')
+    corpus.add_argument('--mean-sentences', type=float, default=4.0, help='Медиана количества предложений в абзаце.')
+    corpus.add_argument('--sigma', type=float, default=0.8, help='Разброс длины абзаца (логнормальное распределение).')
+    corpus.add_argument('--max-sentences', type=int, default=60, help='Максимальное количество предложений в абзаце.')
+    corpus.add_argument('--dialogue-ratio', type=float, default=0.3, help='Доля однострочных реплик диалогов.')
+    corpus.add_argument('--latin-ratio', type=float, default=0.2, help='Доля английских предложений.')
+    corpus.add_argument('--seed', type=int, default=0, help='Зерно генератора случайных чисел.')
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,21 @@
 import re
 import sys
 import os
+import copy
+import logging
+import posixpath
+import struct
 import zipfile
 import tempfile
 import shutil
+import hashlib
 
-from typing import List
+from array import array
+from contextlib import contextmanager
+from bisect import bisect_left
+from typing import Iterator, List, Optional, Set, Tuple
+from urllib.parse import unquote
+from xml.etree import ElementTree
 
 # Добавляем родительскую директорию, чтобы относительный импорт заработал
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -13,7 +23,27 @@ sys.path.insert(0, 'beautifulsoup4')
 
 from bs4 import BeautifulSoup
 
+try:
+    from .stats import NULL_STATS, ProcessingStats, STAGE_UNZIP, STAGE_PARSE, STAGE_MERGE, STAGE_EXTRACT, \
+        STAGE_SENTENCE_SPLIT, STAGE_TOKENIZE, STAGE_REGROUP, STAGE_SERIALIZE, STAGE_ZIP, COUNTER_CACHE_HITS, \
+        COUNTER_PARAGRAPHS, COUNTER_PARAGRAPHS_MERGED, COUNTER_PARAGRAPHS_SPLIT, COUNTER_PARAGRAPHS_CREATED, \
+        COUNTER_SENTENCES, COUNTER_UNCHANGED, COUNTER_PARSE_FALLBACKS
+    from .split_manifest import MANIFEST_ENTRY, settings_fingerprint, read_manifest, is_processed, document_record, \
+        streamed_document_record, manifest_bytes
+    from .word_counts import count_word_starts
+except ImportError:
+    from stats import NULL_STATS, ProcessingStats, STAGE_UNZIP, STAGE_PARSE, STAGE_MERGE, STAGE_EXTRACT, \
+        STAGE_SENTENCE_SPLIT, STAGE_TOKENIZE, STAGE_REGROUP, STAGE_SERIALIZE, STAGE_ZIP, COUNTER_CACHE_HITS, \
+        COUNTER_PARAGRAPHS, COUNTER_PARAGRAPHS_MERGED, COUNTER_PARAGRAPHS_SPLIT, COUNTER_PARAGRAPHS_CREATED, \
+        COUNTER_SENTENCES, COUNTER_UNCHANGED, COUNTER_PARSE_FALLBACKS
+    from split_manifest import MANIFEST_ENTRY, settings_fingerprint, read_manifest, is_processed, document_record, \
+        streamed_document_record, manifest_bytes
+    from word_counts import count_word_starts
+
 class Token:
+    # Без __dict__: при токенизации больших глав таких объектов создаются миллионы
+    __slots__ = ('text', 'is_word')
+
     def __init__(self, text, is_word):
         self.text = text
         self.is_word = is_word
@@ -25,6 +55,60 @@ class Token:
         return f"Token(text={self.text!r}, is_word={self.is_word})"
 
 
+# Шаблоны регулярных выражений для различных типов токенов компилируются один раз при импорте модуля,
+# а не при каждом вызове tokenize_text/count_words.
+
+# 1. Паттерн для тегов: ищет строки, начинающиеся с '<', затем любые символы кроме '>' (0 или более раз),
+# и заканчивающиеся '>'. Это позволит найти такие теги, как <tag>, <tag attr="value"> и т.д.
+TAG_PATTERN = r'<[^>]*>'
+
+# 2. Паттерн для слов, включая слова с дефисами:
+# \b        - граница слова (начало или конец слова)
+# \w+       - один или более буквенно-цифровых символов (буквы, цифры или '_')
+# (?:-\w+)* - ноль или более повторений группы, где дефис и снова одна или более буквенно-цифровых символов
+# \b        - граница слова
+# Этот паттерн позволит найти слова как "слово", так и "нью-йорк", "e-mail" и т.д. как одно цельное слово
+WORD_PATTERN = r'\b\w+(?:-\w+)*\b'
+
+# 3. Паттерн для пробельных символов, включая символ неразрывного пробела (0xA0):
+# [\s\u00A0]+ - один или более пробельных символов (\s) или символов с кодом Unicode U+00A0 (\u00A0)
+WHITESPACE_PATTERN = r'[\s\u00A0]+'
+
+# 4. Паттерн для символов, которые не являются буквами, цифрами, пробелами или дефисом:
+# [^\w\s\u00A0-] - любой символ, который НЕ является буквенно-цифровым (\w), пробельным (\s), неразрывным пробелом (\u00A0) или дефисом (-)
+SYMBOL_PATTERN = r'[^\w\s\u00A0-]'
+
+# Номера групп захвата в комбинированном паттерне - они же виды токенов
+TOKEN_TAG = 1
+TOKEN_WORD = 2
+TOKEN_SYMBOL = 3
+TOKEN_SPACE = 4
+TOKEN_OTHER = 5
+
+# Комбинируем все паттерны в один, используя группы захвата: номер сработавшей группы (match.lastindex)
+# определяет тип токена. Последняя группа `(.)` ловит любой символ, не подошедший под остальные паттерны
+# (например, одиночный дефис), поэтому совпадения идут подряд без пропусков и текст можно обходить через finditer.
+TOKEN_REGEX = re.compile(
+    f'({TAG_PATTERN})|({WORD_PATTERN})|({SYMBOL_PATTERN})|({WHITESPACE_PATTERN})|(.)',
+    re.UNICODE | re.DOTALL
+)
+
+# Паттерн для режима "только подсчет": нас интересуют только слова, но теги нужно распознавать,
+# чтобы не считать словами названия и значения их атрибутов. Остальные символы finditer просто пропускает.
+WORD_COUNT_REGEX = re.compile(f'({TAG_PATTERN})|({WORD_PATTERN})', re.UNICODE)
+
+
+def iter_tokens(text) -> Iterator[Token]:
+    """
+    Лениво разбивает текст на токены за один проход по строке (см. tokenize_text).
+
+    :param text: Текст для разбиения.
+    :return: Итератор токенов.
+    """
+    for match in TOKEN_REGEX.finditer(text):
+        yield Token(match.group(), match.lastindex == TOKEN_WORD)
+
+
 def tokenize_text(text) -> List[Token]:
     """
     Разбивает текст на токены (слова), учитывая что:
@@ -34,76 +118,108 @@ def tokenize_text(text) -> List[Token]:
       * токены-слова могут быть обрамлены кавычками, круглыми скобками;
       * внутри тегов (после объявления `<tagName` и до `>` все токены НЕ являются словами (то есть 
         технически названия и значения аттрибутов - это не слова);
+      * символ, не подходящий ни под один из паттернов, считается отдельным токеном (не словом).
     
     :param text: Текст для разбиения.
     :return: Список токенов, каждый из которых содержит мета-данные (является ли он читаемым словом).
     """
-    tokens = []  # Инициализируем пустой список для хранения токенов
-    
-    # Определяем шаблоны регулярных выражений для различных типов токенов:
-    
-    # 1. Паттерн для тегов: ищет строки, начинающиеся с '<', затем любые символы кроме '>' (0 или более раз),
-    # и заканчивающиеся '>'. Это позволит найти такие теги, как <tag>, <tag attr="value"> и т.д.
-    tag_pattern = r'<[^>]*>'
-    
-    # 2. Паттерн для слов, включая слова с дефисами:
-    # \b        - граница слова (начало или конец слова)
-    # \w+       - один или более буквенно-цифровых символов (буквы, цифры или '_')
-    # (?:-\w+)* - ноль или более повторений группы, где дефис и снова одна или более буквенно-цифровых символов
-    # \b        - граница слова
-    # Этот паттерн позволит найти слова как "слово", так и "нью-йорк", "e-mail" и т.д. как одно цельное слово
-    word_pattern = r'\b\w+(?:-\w+)*\b'
-    
-    # 3. Паттерн для пробельных символов, включая символ неразрывного пробела (0xA0):
-    # [\s\u00A0]+ - один или более пробельных символов (\s) или символов с кодом Unicode U+00A0 (\u00A0)
-    whitespace_pattern = r'[\s\u00A0]+'
-    
-    # 4. Паттерн для символов, которые не являются буквами, цифрами, пробелами или дефисом:
-    # [^\w\s\u00A0-] - любой символ, который НЕ является буквенно-цифровым (\w), пробельным (\s), неразрывным пробелом (\u00A0) или дефисом (-)
-    symbol_pattern = r'[^\w\s\u00A0-]'
-    
-    # Комбинируем все паттерны в один, используя группы захвата:
-    # Каждая пара скобок '()' создает группу захвата, которую мы потом можем использовать для определения типа токена
-    combined_pattern = f'({tag_pattern})|({word_pattern})|({symbol_pattern})|({whitespace_pattern})'
-    
-    # Компилируем комбинированный паттерн в объект регулярного выражения для повышения производительности
-    pattern = re.compile(combined_pattern, re.UNICODE)
-    
-    pos = 0  # Начальная позиция в тексте
-    while pos < len(text):
-        # Ищем совпадение с любым из наших паттернов, начиная с текущей позиции
-        match = pattern.match(text, pos)
-        if match:
-            token_text = match.group(0)  # Получаем текст найденного токена
-            # Определяем тип токена, проверяя, какая группа захвата сработала
-            if match.group(1):  # Если сработала первая группа захвата (тег)
-                is_word = False  # Теги не считаются словами
-            elif match.group(2):  # Если сработала вторая группа захвата (слово или слово с дефисом)
-                is_word = True   # Это слово
-            elif match.group(3):  # Если сработала третья группа захвата (символ)
-                is_word = False  # Символы не являются словами
-            elif match.group(4):  # Если сработала четвертая группа захвата (пробельные символы)
-                is_word = False  # Пробельные символы не являются словами
-            # Добавляем найденный токен в список токенов
-            tokens.append(Token(token_text, is_word))
-            pos += len(token_text)  # Перемещаем позицию вперед на длину найденного токена
-        else:
-            # Если символ не соответствует ни одному из паттернов,
-            # мы считаем его отдельным токеном (например, неизвестный или специальный символ)
-            token_text = text[pos]
-            tokens.append(Token(token_text, is_word=False))  # Помечаем его как не слово
-            pos += 1  # Перемещаем позицию на один символ
-    return tokens  # Возвращаем список токенов
-
-def count_words(text):
+    return list(iter_tokens(text))
+
+def count_words(text, start=0, end=None):
+    """
+    Считает количество слов в тексте в режиме "только подсчет": объекты Token при этом не создаются.
+    Результат совпадает с количеством токенов-слов, которые вернула бы функция tokenize_text.
+
+    Можно посчитать слова только в диапазоне [start, end) без копирования подстроки
+    (диапазон не должен разрезать слова или теги).
+
+    :param text: Текст (возможно, с HTML-разметкой).
+    :param start: Смещение начала диапазона.
+    :param end: Смещение конца диапазона (по умолчанию - конец текста).
+    :return: Количество слов.
+    """
     words_count = 0
 
-    for token in tokenize_text(text):
-        if token.is_word:
+    if end is None:
+        end = len(text)
+    for match in WORD_COUNT_REGEX.finditer(text, start, end):
+        if match.lastindex == TOKEN_WORD:
             words_count += 1
 
     return words_count
 
+class TokenStream:
+    """
+    Компактное представление токенов текста: вместо отдельного объекта Token на каждый токен
+    хранятся параллельные массивы смещений начала/конца токенов в исходной строке и массив байтов
+    с видом токена (TOKEN_TAG, TOKEN_WORD, TOKEN_SYMBOL, TOKEN_SPACE, TOKEN_OTHER).
+    Подстроки из исходного текста не копируются, пока их явно не запросят.
+
+    Для совместимости поток можно индексировать и итерировать - при этом создаются объекты Token.
+    """
+    __slots__ = ('text', 'starts', 'ends', 'kinds', '_word_prefix')
+
+    def __init__(self, text):
+        self.text = text
+        self.starts = array('L')
+        self.ends = array('L')
+        self.kinds = bytearray()
+        # Префиксные суммы количества слов (строятся лениво, см. count_words)
+        self._word_prefix = None
+
+        starts_append = self.starts.append
+        ends_append = self.ends.append
+        kinds_append = self.kinds.append
+        for match in TOKEN_REGEX.finditer(text):
+            start, end = match.span()
+            starts_append(start)
+            ends_append(end)
+            kinds_append(match.lastindex)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i) -> Token:
+        return Token(self.token_text(i), self.kinds[i] == TOKEN_WORD)
+
+    def __iter__(self) -> Iterator[Token]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def token_text(self, i) -> str:
+        return self.text[self.starts[i]:self.ends[i]]
+
+    def is_word(self, i) -> bool:
+        return self.kinds[i] == TOKEN_WORD
+
+    @property
+    def word_count(self) -> int:
+        return self.kinds.count(TOKEN_WORD)
+
+    def count_words(self, start=0, end=None) -> int:
+        """
+        Считает слова, начинающиеся в диапазоне смещений [start, end) исходного текста,
+        без копирования подстроки и повторной токенизации.
+
+        :param start: Смещение начала диапазона.
+        :param end: Смещение конца диапазона (по умолчанию - конец текста).
+        :return: Количество слов.
+        """
+        if self._word_prefix is None:
+            prefix = array('L', [0])
+            total = 0
+            for kind in self.kinds:
+                total += kind == TOKEN_WORD
+                prefix.append(total)
+            self._word_prefix = prefix
+
+        if end is None:
+            end = len(self.text)
+        first = bisect_left(self.starts, start)
+        last = bisect_left(self.starts, end)
+        return self._word_prefix[last] - self._word_prefix[first]
+
+
 # Списки сокращений, после которых пунктуационные знаки не всегда могут считаться знаками, завершающими предложение
 
 # Безусловные сокращения (всегда считаются сокращениями)
@@ -123,7 +239,7 @@ conditional_abbreviations = set([
     'etc.', 'inc.', 'ltd.'
 ])
 
-def is_abbreviation(paragraph_text: str, i: int) -> bool:
+def is_abbreviation(paragraph_text: str, i: int, unconditional=None, conditional=None) -> bool:
     """
     Проверяет, является ли знак препинания в позиции i частью локального сокращения или инициалов.
     То есть функция возвращает True, если знак препинания не является завершающим предложение.
@@ -132,6 +248,8 @@ def is_abbreviation(paragraph_text: str, i: int) -> bool:
 
     :param paragraph_text: Текст абзаца.
     :param i: Позиция знака препинания в тексте.
+    :param unconditional: Безусловные сокращения (по умолчанию unconditional_abbreviations).
+    :param conditional: Условные сокращения (по умолчанию conditional_abbreviations).
     :return: True, если это сокращение или инициалы, иначе False.
     """
     # Проверяем, что i находится в пределах строки
@@ -173,9 +291,9 @@ def is_abbreviation(paragraph_text: str, i: int) -> bool:
     abbrev = abbrev.strip().lower()
 
     # Проверяем, есть ли оно в списке сокращений
-    if abbrev in unconditional_abbreviations:
+    if abbrev in (unconditional_abbreviations if unconditional is None else unconditional):
         return True
-    elif abbrev in conditional_abbreviations:
+    elif abbrev in (conditional_abbreviations if conditional is None else conditional):
         # Проверяем следующее слово
         k = i + 1
         length = len(paragraph_text)
@@ -193,12 +311,142 @@ def is_abbreviation(paragraph_text: str, i: int) -> bool:
     else:
         return False
 
-def split_paragraph_into_sentences(paragraph_text) -> List[str]:
+def compile_abbreviation_regex(unconditional, conditional):
+    """
+    Компилирует автомат для поиска сокращений за один проход по тексту.
+
+    Выражение ищет точки и для каждой проверяет набором lookbehind-альтернатив фиксированной длины,
+    не заканчивается ли перед ней одно из сокращений. Поиск по тексту идет только по символу '.',
+    поэтому остальной текст движок пропускает без проверки альтернатив. Длинные сокращения проверяются
+    первыми. Каждое сокращение захватывается именованной группой: 'u<N>' - безусловное, 'c<N>' - условное.
+
+    :param unconditional: Безусловные сокращения (с завершающей точкой).
+    :param conditional: Условные сокращения (с завершающей точкой).
+    :return: Скомпилированное регулярное выражение.
+    """
+    abbreviations = [(abbreviation, 'u') for abbreviation in unconditional]
+    abbreviations += [(abbreviation, 'c') for abbreviation in conditional]
+    abbreviations.sort(key=lambda item: len(item[0]), reverse=True)
+
+    alternatives = '|'.join(
+        f'(?<=(?P<{kind}{n}>{re.escape(abbreviation[:-1])})\\.)'
+        for n, (abbreviation, kind) in enumerate(abbreviations)
+    )
+    return re.compile(f'\\.(?:{alternatives})', re.IGNORECASE)
+
+ABBREVIATION_REGEX = compile_abbreviation_regex(unconditional_abbreviations, conditional_abbreviations)
+
+# Завершающий знак, отделенный пробелами от предшествующего слова (например, "г ."). Такие случаи редки,
+# и для них используется is_abbreviation.
+SPACED_PUNCTUATION_REGEX = re.compile(r'[.!?…](?<=\s[.!?…])')
+
+# Кандидат в инициалы: завершающий знак сразу после символа, перед которым стоит пробел, точка
+# или неразрывный пробел. Заглавность символа проверяется отдельно.
+INITIAL_REGEX = re.compile(r'[.!?…](?<=[ .\xa0]\S[.!?…])')
+
+# Буква или цифра (то же, что str.isalnum)
+ALNUM_REGEX = re.compile(r'[^\W_]')
+
+# Символы, на которых разбиватель предложений меняет состояние: теги, кавычки и завершающие знаки.
+# Все остальные символы пропускаются поиском по регулярному выражению, без цикла на Python.
+SENTENCE_EVENT_REGEX = re.compile(r'[<"«“»”.!?…]')
+
+def find_abbreviations(paragraph_text, abbreviation_regex=ABBREVIATION_REGEX, unconditional=None,
+                       conditional=None) -> Set[int]:
+    """
+    Находит сразу для всего абзаца позиции знаков препинания, которые не завершают предложение
+    из-за сокращений или инициалов (то есть те, для которых is_abbreviation вернула бы True).
+    Текст просматривается предкомпилированными регулярными выражениями, привязанными к знакам
+    препинания, без посимвольного обхода назад от каждого знака.
+
+    В отличие от is_abbreviation, точки внутри многоточечных сокращений (например, первая точка в "т.д.")
+    тоже считаются частью сокращения.
+
+    :param paragraph_text: Текст абзаца.
+    :param abbreviation_regex: Автомат сокращений (см. compile_abbreviation_regex).
+    :param unconditional: Безусловные сокращения, по которым собран автомат (см. is_abbreviation).
+    :param conditional: Условные сокращения, по которым собран автомат (см. is_abbreviation).
+    :return: Множество позиций знаков препинания.
+    """
+    positions = set()
+
+    # Инициалы: одна заглавная буква перед знаком препинания
+    for match in INITIAL_REGEX.finditer(paragraph_text):
+        i = match.start()
+        if paragraph_text[i - 1].isupper():
+            positions.add(i)
+
+    for match in abbreviation_regex.finditer(paragraph_text):
+        i = match.start()
+        abbreviation = match.group(match.lastgroup)
+        start = i - len(abbreviation)
+        # Сокращение должно быть целым "словом" из букв и точек: совпадение в середине слова
+        # (например, "г" в "снег.") сокращением не является
+        if start > 0 and (paragraph_text[start - 1].isalpha() or paragraph_text[start - 1] == '.'):
+            continue
+
+        # Точки внутри сокращения никогда не завершают предложение
+        dot = abbreviation.find('.')
+        while dot != -1:
+            positions.add(start + dot)
+            dot = abbreviation.find('.', dot + 1)
+
+        if match.lastgroup[0] == 'u':
+            positions.add(i)
+        else:
+            # После условного сокращения предложение продолжается, только если следующее слово
+            # начинается со строчной буквы
+            next_alnum = ALNUM_REGEX.search(paragraph_text, i + 1)
+            if next_alnum is not None and not next_alnum.group().isupper():
+                positions.add(i)
+
+    for match in SPACED_PUNCTUATION_REGEX.finditer(paragraph_text):
+        i = match.start()
+        if is_abbreviation(paragraph_text, i, unconditional, conditional):
+            positions.add(i)
+
+    return positions
+
+def _strip_span(text, start, end) -> Tuple[int, int]:
+    """
+    Сужает диапазон [start, end) так же, как str.strip() обрезал бы соответствующую подстроку.
+    """
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+def split_paragraph_into_sentences(paragraph_text, segmenter=None) -> List[str]:
+    """
+    Разбивает текст абзаца на предложения (см. split_paragraph_into_sentence_spans).
+
+    :param paragraph_text: Текст абзаца для разбиения.
+    :param segmenter: Правила разбиения для языка книги (см. segmenters.py) или None (базовые сокращения).
+    :return: Список строк-предложений.
+    """
+    return [paragraph_text[start:end] for start, end in split_paragraph_into_sentence_spans(paragraph_text, segmenter)]
+
+def split_paragraph_into_counted_sentences(paragraph_text, segmenter=None) -> List[Tuple[int, int, int]]:
+    """
+    Разбивает текст абзаца на предложения (см. split_paragraph_into_sentence_spans) и попутно считает
+    слова в каждом из них. Каждый символ абзаца при подсчете просматривается один раз.
+
+    :param paragraph_text: Текст абзаца для разбиения.
+    :param segmenter: Правила разбиения для языка книги (см. segmenters.py) или None (базовые сокращения).
+    :return: Список троек (начало, конец, количество слов) предложений.
+    """
+    return [
+        (start, end, count_words(paragraph_text, start, end))
+        for start, end in split_paragraph_into_sentence_spans(paragraph_text, segmenter)
+    ]
+
+def split_paragraph_into_sentence_spans(paragraph_text, segmenter=None) -> List[Tuple[int, int]]:
     """
     Разбивает текст абзаца на предложения.
     Разбиение происходит по завершающим знакам пунктуации: .!?…
     При этом завершающие знаки пунктуации исключаются (не считаются) в следующих случаях, если:
-      * идут после сокращений (см. функцию is_abbreviation);
+      * идут после сокращений или инициалов, а также внутри сокращений (см. функцию find_abbreviations);
       * разделяют цифры (без пробелов), например, числа с плавающей точкой;
       * находятся в тексте аттрибутов тегов;
       * находятся внутри тегов, которые еще не закрыты (чтобы не ломать верстку);
@@ -206,18 +454,33 @@ def split_paragraph_into_sentences(paragraph_text) -> List[str]:
         или "!?" или "...");
       * внутри незакрытых кавычек;
 
+    Предложения возвращаются в виде смещений в исходном тексте, без копирования подстрок;
+    пробельные символы по краям предложения в диапазон не входят.
+
     :param paragraph_text: Текст абзаца для разбиения.
-    :return: Список строк-предложений.
+    :param segmenter: Правила разбиения для языка книги (см. segmenters.py): какие слова считать сокращениями.
+                      По умолчанию - базовые русские и английские сокращения.
+    :return: Список пар (начало, конец) предложений.
     """
-    sentences = []             # Список для хранения найденных предложений
+    sentences = []             # Список для хранения найденных предложений (пар смещений)
     sentence_start = 0         # Индекс начала текущего предложения
     i = 0                      # Текущая позиция в тексте
     length = len(paragraph_text)
     tag_stack = []             # Стек для отслеживания открытых тегов
     inside_quotes = False      # Флаг, показывающий, находимся ли мы внутри незакрытых кавычек
-    last_splitting_idx = 0
 
-    while i < length:
+    # Позиции сокращений и инициалов находим заранее сразу для всего абзаца
+    if segmenter is None:
+        abbreviations = find_abbreviations(paragraph_text)
+    else:
+        abbreviations = segmenter.find_abbreviations(paragraph_text)
+
+    while True:
+        # Переходим сразу к следующему значимому символу
+        match = SENTENCE_EVENT_REGEX.search(paragraph_text, i)
+        if match is None:
+            break
+        i = match.start()
         char = paragraph_text[i]
 
         # --- Обработка тегов ---
@@ -258,7 +521,7 @@ def split_paragraph_into_sentences(paragraph_text) -> List[str]:
             should_split = True  # Флаг, показывающий, нужно ли разделять предложение
 
             # 1. Проверка на сокращение
-            if is_abbreviation(paragraph_text, i):
+            if i in abbreviations:
                 should_split = False  # Не разделяем, если это сокращение
 
             # 2. Проверка на числа с плавающей точкой
@@ -284,21 +547,36 @@ def split_paragraph_into_sentences(paragraph_text) -> List[str]:
             if should_split:
                 # Если все проверки пройдены и нужно разделить предложение
                 # Извлекаем предложение от sentence_start до текущей позиции i + 1
-                sentence = paragraph_text[sentence_start:i + 1].strip()
-                if sentence:
-                    sentences.append(sentence)  # Добавляем предложение в список
+                start, end = _strip_span(paragraph_text, sentence_start, i + 1)
+                if start < end:
+                    sentences.append((start, end))  # Добавляем предложение в список
                 sentence_start = i + 1  # Обновляем начало следующего предложения
         i += 1  # Переходим к следующему символу
 
     # --- Обработка оставшегося текста ---
     if sentence_start < length:
         # Если остался текст после последнего завершающего знака
-        sentence = paragraph_text[sentence_start:].strip()
-        if sentence:
-            sentences.append(sentence)  # Добавляем последнее предложение
+        start, end = _strip_span(paragraph_text, sentence_start, length)
+        if start < end:
+            sentences.append((start, end))  # Добавляем последнее предложение
 
     return sentences
 
+# Движки разбиения абзацев (см. process_epub_html)
+ENGINE_BS4 = 'bs4'
+ENGINE_LXML = 'lxml'
+ENGINE_LXML_DOM = 'lxml-dom'
+
+def _merge_key(paragraph):
+    """
+    Ключ совместимости абзаца для объединения: значения атрибутов class и style
+    (список классов приводится к строке, отсутствующий атрибут считается пустой строкой).
+    """
+    paragraph_class = paragraph.get('class') or ''
+    if isinstance(paragraph_class, list):
+        paragraph_class = ' '.join(paragraph_class)
+    return paragraph_class, paragraph.get('style') or ''
+
 def merge_adjacent_paragraphs(soup):
     """
     Объединяет последовательные теги <p>, находящиеся на одном уровне и имеющие одинаковые значения
@@ -306,59 +584,102 @@ def merge_adjacent_paragraphs(soup):
     Объединение происходит путём слияния содержимого тегов в первый тег последовательности.
     Атрибуты объединённого тега берутся из первого тега.
 
+    Работает за линейное время: сначала за один проход абзацы группируются в серии совместимых,
+    затем содержимое каждой серии переносится в ее первый тег, а остальные теги удаляются
+    из родителя по заранее вычисленным индексам (без поиска каждого тега в списке детей).
+
     :param soup: Объект BeautifulSoup, представляющий HTML-документ.
+    :return: Количество абзацев, присоединенных к предыдущим.
     """
-    paragraphs = soup.find_all('p')
-    i = 0
-    while i < len(paragraphs) - 1:
-        current_p = paragraphs[i]
-        next_p = paragraphs[i + 1]
+    # Группируем абзацы в серии: абзац продолжает серию, если у него тот же родитель (тот же объект,
+    # а не равный по содержимому) и те же class и style, что у первого абзаца серии
+    runs = []
+    run_key = None
+    for paragraph in soup.find_all('p'):
+        key = _merge_key(paragraph)
+        if runs and paragraph.parent is runs[-1][0].parent and key == run_key:
+            runs[-1].append(paragraph)
+        else:
+            runs.append([paragraph])
+            run_key = key
 
-        # Проверяем, находятся ли теги на одном уровне
-        if current_p.parent != next_p.parent:
-            i += 1
+    merged_by_parent = {}
+    for run in runs:
+        if len(run) < 2:
             continue
+        head = run[0]
+        for paragraph in run[1:]:
+            # Пустой абзац просто удаляется: переносить из него нечего
+            head.extend(paragraph.contents)
+        merged_by_parent.setdefault(id(head.parent), (head.parent, []))[1].extend(run[1:])
 
-        # Получаем атрибуты class и style для обоих тегов
-        current_class = current_p.get('class', '')
-        next_class = next_p.get('class', '')
-        current_style = current_p.get('style', '')
-        next_style = next_p.get('style', '')
-
-        # Приводим атрибуты class к строковому виду, если они являются списками
-        if isinstance(current_class, list):
-            current_class = ' '.join(current_class)
-        if isinstance(next_class, list):
-            next_class = ' '.join(next_class)
-
-        # Если атрибут отсутствует, считаем его пустой строкой
-        if current_class is None:
-            current_class = ''
-        if next_class is None:
-            next_class = ''
-        if current_style is None:
-            current_style = ''
-        if next_style is None:
-            next_style = ''
-
-        # Сравниваем атрибуты
-        if current_class == next_class and current_style == next_style:
-            # Объединяем содержимое тегов
-            # Проверяем, нужен ли пробел между абзацами
-            if not (str(current_p.contents[-1]).strip().endswith((' ', '\n')) or not str(next_p.contents[0]).strip().startswith(' ')):
-                current_p.append(' ')  # Добавляем пробел между содержимым, если его нет
-            for child in list(next_p.children):
-                current_p.append(child)
-            # Удаляем next_p из дерева
-            next_p.decompose()
-            # Удаляем next_p из списка paragraphs
-            del paragraphs[i + 1]
-            # Не увеличиваем i, т.к. нужно проверить следующий тег
-        else:
-            # Переходим к следующей паре тегов
-            i += 1
+    merged_count = 0
+    for parent, merged in merged_by_parent.values():
+        # Индексы детей считаем один раз и удаляем теги с конца, чтобы индексы оставшихся не сдвигались
+        indexes = {id(child): index for index, child in enumerate(parent.contents)}
+        for paragraph in sorted(merged, key=lambda p: indexes[id(p)], reverse=True):
+            paragraph.extract(_self_index=indexes[id(paragraph)])
+            paragraph.decompose()
+        merged_count += len(merged)
+    return merged_count
+
+def plan_paragraph_split(paragraph_html, max_len, stats=NULL_STATS,
+                         segmenter=None) -> Optional[List[List[Tuple[int, int]]]]:
+    """
+    Решает, как разбить абзац: группирует его предложения в новые абзацы.
+
+    Предложения накапливаются до тех пор, пока сумма слов в накопленных предложениях
+    не достигнет или не превысит max_len. Как только порог достигнут, накопленные предложения
+    формируют новый абзац.
+
+    Короткие абзацы вызывающий код отсекает заранее, одной оценкой сверху количества слов сразу во всех
+    абзацах документа (count_word_starts, см. word_counts.py), поэтому здесь такой проверки нет.
+
+    :param paragraph_html: Содержимое абзаца (HTML-разметка без самого тега <p>).
+    :param max_len: Максимальное количество слов в абзаце.
+    :param stats: ProcessingStats для замера времени этапов (см. stats.py).
+    :param segmenter: Правила разбиения на предложения для языка книги (см. segmenters.py) или None.
+    :return: None, если абзац не нужно трогать, иначе список новых абзацев, каждый из которых -
+             список пар (начало, конец) входящих в него предложений.
+    """
+    # Разбиваем абзац на законченные предложения и считаем слова в каждом из них (то же, что
+    # split_paragraph_into_counted_sentences, но с отдельным замером времени этапов):
+    # дальше нужны только суммы этих чисел, повторно текст не токенизируется
+    start_time = stats.clock()
+    spans = split_paragraph_into_sentence_spans(paragraph_html, segmenter)
+    start_time = stats.lap(STAGE_SENTENCE_SPLIT, start_time)
+    sentences = [(start, end, count_words(paragraph_html, start, end)) for start, end in spans]
+    start_time = stats.lap(STAGE_TOKENIZE, start_time)
+
+    if sum(words_count for _, _, words_count in sentences) <= max_len:
+        return None
+
+    groups = []
+    current_group = []
+    current_group_words_count = 0
+
+    for start, end, words_count in sentences:
+        # Добавляем предложение в текущий буфер абзаца
+        current_group.append((start, end))
+        current_group_words_count += words_count
+
+        # Проверяем, достигло ли количество слов в буфферном абзаце максимального
+        if current_group_words_count >= max_len:
+            # Добавляем текущий абзац в список новых абзацев и сбрасываем буферы
+            groups.append(current_group)
+            current_group = []
+            current_group_words_count = 0
+
+    # Если остались накопленные предложения, формируем из них последний абзац
+    if current_group:
+        groups.append(current_group)
+
+    stats.lap(STAGE_REGROUP, start_time)
+    stats.count(COUNTER_SENTENCES, len(sentences))
+    return groups
 
-def process_epub_html(html_content, max_len=10, merge_before_splitting=False):
+def process_epub_html(html_content, max_len=10, merge_before_splitting=False, engine=ENGINE_BS4, stats=NULL_STATS,
+                      segmenter=None):
     """
     Обрабатывает HTML-контент EPUB-файла, разбивая длинные абзацы на меньшие.
 
@@ -377,50 +698,80 @@ def process_epub_html(html_content, max_len=10, merge_before_splitting=False):
     объединяются в один тег <p>. Атрибуты объединённого тега берутся из первого тега последовательности.
 
     :param html_content: Строка с HTML-контентом EPUB-файла.
-    :param line_len: Целое число, определяющее количество слов в строке при разбиении (по умолчанию 10).
+    :param max_len: Максимальное количество слов в абзаце (по умолчанию 10).
     :param merge_before_splitting: Признак того, что необходимо объединить абзацы в один перед дальнейшим разбиением (по умолчанию False).
+    :param engine: Движок разбиения: ENGINE_BS4 (BeautifulSoup с html.parser), ENGINE_LXML или ENGINE_LXML_DOM
+                   (разбиение по текстовым узлам дерева без сериализации абзаца, см. lxml_split.py).
+    :param stats: ProcessingStats для замера времени этапов (см. stats.py).
+    :param segmenter: Правила разбиения на предложения для языка книги (см. segmenters.py) или None
+                      (базовые русские и английские сокращения).
     :return: Обновлённый HTML-контент с разбитыми абзацами.
     """
+    if __package__:
+        from .splitter_context import SplitterContext
+    else:
+        from splitter_context import SplitterContext
+    return process_document(html_content, SplitterContext(max_len, merge_before_splitting, engine, segmenter), stats)
+
+def process_document(html_content, context, stats=NULL_STATS):
+    """
+    Обрабатывает HTML-контент EPUB-файла так же, как process_epub_html, но с настройками, собранными
+    один раз на книгу (см. splitter_context.py).
+
+    :param html_content: Строка с HTML-контентом EPUB-файла.
+    :param context: SplitterContext книги.
+    :param stats: ProcessingStats для замера времени этапов (см. stats.py).
+    :return: Обновлённый HTML-контент с разбитыми абзацами.
+    """
+    max_len, segmenter = context.max_len, context.segmenter
+    if context.split_paragraph is not None:
+        if __package__:
+            from .lxml_split import process_epub_html_lxml, MalformedDocument
+        else:
+            from lxml_split import process_epub_html_lxml, MalformedDocument
+        try:
+            return process_epub_html_lxml(html_content, max_len, context.merge_before_splitting,
+                                          context.split_paragraph, stats, segmenter)
+        except MalformedDocument as e:
+            # lxml разобрал бы такой документ только с потерей содержимого: его разбирает BeautifulSoup
+            logging.warning(f"[Split paragraphs plugin] malformed XHTML is parsed by BeautifulSoup: {e}")
+            stats.count(COUNTER_PARSE_FALLBACKS)
+
+    start_time = stats.clock()
     # Парсим HTML с помощью BeautifulSoup
     soup = BeautifulSoup(html_content, 'html.parser')
+    start_time = stats.lap(STAGE_PARSE, start_time)
 
-    if merge_before_splitting:
-        merge_adjacent_paragraphs(soup)
+    if context.merge_before_splitting:
+        stats.count(COUNTER_PARAGRAPHS_MERGED, merge_adjacent_paragraphs(soup))
+        stats.lap(STAGE_MERGE, start_time)
 
     # Ищем все теги <p>, так как в HTML абзацы всегда выделены именно этими тегами
-    for paragraph in soup.find_all('p'):
-        # Получаем текст абзаца с сохранением всех вложенных тегов
-        paragraph_html = ''.join(str(child) for child in paragraph.children)
-        
-        if count_words(paragraph_html) <= max_len:
+    paragraphs = soup.find_all('p')
+    stats.count(COUNTER_PARAGRAPHS, len(paragraphs))
+    start_time = stats.clock()
+    # Получаем текст абзацев с сохранением всех вложенных тегов
+    paragraph_htmls = [''.join(str(child) for child in paragraph.children) for paragraph in paragraphs]
+    start_time = stats.lap(STAGE_EXTRACT, start_time)
+    # Оценка сверху количества слов сразу во всех абзацах документа (см. word_counts.py): абзацы, которые точно
+    # не нужно разбивать (а таких большинство), отсекаются без разбиения на предложения
+    words_upper_bounds = count_word_starts(paragraph_htmls)
+    stats.lap(STAGE_TOKENIZE, start_time)
+    for paragraph, paragraph_html, words_upper_bound in zip(paragraphs, paragraph_htmls, words_upper_bounds):
+        if words_upper_bound <= max_len:
             continue
 
-        new_paragraphs = []
-        current_paragraph_sentences = []
-        current_paragraph_words_count = 0
-
-        # Разбиваем абзац на законченные предложения
-        sentences = split_paragraph_into_sentences(paragraph_html)
-
-        for sentence in sentences:
-            # Добавляем предложение в текущий буфер абзаца
-            current_paragraph_sentences.append(sentence)
-            current_paragraph_words_count += count_words(sentence)
-
-            # Проверяем, достигло ли количество слов в буфферном абзаце максимального
-            if current_paragraph_words_count >= max_len:
-                # Добавляем текущий абзац в список новых абзацев
-                new_paragraphs.append(' '.join(current_paragraph_sentences))
-                # Сбрасываем буферы для формирования следующего абзаца
-                current_paragraph_sentences = []
-                current_paragraph_words_count = 0
+        groups = plan_paragraph_split(paragraph_html, max_len, stats, segmenter)
+        if groups is None:
+            continue
+        start_time = stats.clock()
 
-        # Если остались накопленные предложения, формируем из них последний абзац
-        if len(current_paragraph_sentences) > 0:
-            new_paragraphs.append(' '.join(current_paragraph_sentences))
+        new_paragraphs = [' '.join(paragraph_html[start:end] for start, end in group) for group in groups]
 
         # Если был разрыв (абзац разбился на более мелкие), создаем новые теги <p> и добавляем их в HTML
         if len(new_paragraphs) > 1:
+            stats.count(COUNTER_PARAGRAPHS_SPLIT)
+            stats.count(COUNTER_PARAGRAPHS_CREATED, len(new_paragraphs))
             previous_tag = paragraph
             for new_paragraph_html in new_paragraphs:
                 new_tag = soup.new_tag("p")
@@ -437,11 +788,239 @@ def process_epub_html(html_content, max_len=10, merge_before_splitting=False):
             # Если абзац не был разбит, обновляем его содержимое (на случай, если были изменения)
             paragraph.clear()
             paragraph.append(BeautifulSoup(new_paragraphs[0], 'html.parser'))
+        stats.lap(STAGE_REGROUP, start_time)
 
     # Возвращаем обновленный HTML
-    return str(soup)
+    start_time = stats.clock()
+    html_content = str(soup)
+    stats.lap(STAGE_SERIALIZE, start_time)
+    return html_content
+
+def process_epub_html_in_worker(html_content, context, collect_stats):
+    """
+    process_document для рабочего процесса: статистика собирается в отдельном объекте
+    и возвращается вместе с результатом, чтобы ее можно было добавить к общей (см. ProcessingStats.update).
+
+    :param context: SplitterContext книги (передается в процесс по настройкам, см. splitter_context.py).
+    :param collect_stats: Признак того, что нужно собирать статистику.
+    :return: Пара (обновлённый HTML-контент, ProcessingStats или None).
+    """
+    stats = ProcessingStats() if collect_stats else NULL_STATS
+    html_content = process_document(html_content, context, stats)
+    return html_content, stats if collect_stats else None
+
+# Расширения (X)HTML-файлов, которые обрабатывает process_epub
+HTML_EXTENSIONS = {'html', 'htm', 'xhtml', 'xht'}
+
+# Размер блока при побайтовом копировании записей архива
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Запись с типом содержимого EPUB: по спецификации OCF она должна быть первой в архиве,
+# храниться без сжатия и без дополнительного поля
+MIMETYPE_ENTRY = 'mimetype'
+
+# Уровень сжатия deflate (0-9) для перезаписываемых записей, по умолчанию как у zlib
+DEFAULT_COMPRESS_LEVEL = 6
+
+# Документы больше этого размера обрабатываются потоково (см. stream_split.py), а не разбором целого документа
+DEFAULT_STREAM_THRESHOLD = 2 * 1024 * 1024
+
+# Идентификатор дополнительного поля ZIP64 в заголовках записей zip
+ZIP64_EXTRA_ID = 0x0001
+
+def _strip_extra_field(extra, header_id):
+    """Удаляет из дополнительных полей записи zip (ZipInfo.extra) все поля с идентификатором header_id."""
+    fields = []
+    i = 0
+    while i + 4 <= len(extra):
+        field_id, size = struct.unpack('<HH', extra[i:i + 4])
+        if field_id != header_id:
+            fields.append(extra[i:i + 4 + size])
+        i += 4 + size
+    return b''.join(fields)
+
+def copy_zip_entry_raw(source_zip, target_zip, info):
+    """
+    Копирует запись из одного zip-архива в другой как есть, не распаковывая и не сжимая ее заново:
+    переносятся уже сжатые байты, метод сжатия, CRC и размеры из исходного архива.
+
+    У zipfile нет открытого API для такого копирования, поэтому функция работает с архивами так же,
+    как сам ZipFile при записи: под их блокировками, с записью с позиции начала центрального каталога.
+
+    :param source_zip: Исходный архив (zipfile.ZipFile, открытый на чтение).
+    :param target_zip: Архив, в который записывается копия (zipfile.ZipFile, открытый на запись).
+    :param info: Запись исходного архива (zipfile.ZipInfo).
+    """
+    new_info = copy.copy(info)
+    # CRC и размеры известны заранее, поэтому пишем их в локальный заголовок, а не в дескриптор после данных
+    new_info.flag_bits &= ~0x08
+    # Поле ZIP64 из центрального каталога исходного архива FileHeader при необходимости добавит заново
+    # (с размерами записи), иначе в локальном заголовке оказалось бы два таких поля
+    new_info.extra = _strip_extra_field(info.extra, ZIP64_EXTRA_ID)
+    zip64 = info.file_size > zipfile.ZIP64_LIMIT or info.compress_size > zipfile.ZIP64_LIMIT
+    if zip64 and not target_zip._allowZip64:
+        raise zipfile.LargeZipFile("Filesize would require ZIP64 extensions")
+
+    with source_zip._lock, target_zip._lock:
+        if target_zip._writing:
+            raise ValueError("Can't write to the ZIP file while there is another write handle open on it")
+
+        # Сжатые данные начинаются сразу после локального заголовка записи, длина которого зависит
+        # от длины имени и дополнительного поля (они могут отличаться от центрального каталога)
+        source_zip.fp.seek(info.header_offset)
+        header = source_zip.fp.read(zipfile.sizeFileHeader)
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        source_zip.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+        if target_zip._seekable:
+            target_zip.fp.seek(target_zip.start_dir)
+        new_info.header_offset = target_zip.fp.tell()
+        target_zip.fp.write(new_info.FileHeader(zip64))
+
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = source_zip.fp.read(min(remaining, COPY_CHUNK_SIZE))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated entry in zip file: {info.filename}")
+            target_zip.fp.write(chunk)
+            remaining -= len(chunk)
+
+        target_zip.filelist.append(new_info)
+        target_zip.NameToInfo[new_info.filename] = new_info
+        target_zip.start_dir = target_zip.fp.tell()
+        target_zip._didModify = True
 
-def process_epub(epub_path, max_len=10, merge_before_splitting=False, backuping=False):
+# Файл, в котором EPUB (OCF) указывает путь к OPF-пакету, и типы содержимого документов книги
+CONTAINER_ENTRY = 'META-INF/container.xml'
+HTML_MEDIA_TYPES = {'application/xhtml+xml', 'text/html'}
+
+def _local_name(tag):
+    """Имя XML-тега без пространства имен (в OPF 2 его иногда не указывают)."""
+    return tag.rsplit('}', 1)[-1]
+
+def _read_opf(epub_zip):
+    """
+    Читает OPF-пакет книги: путь к нему берется из META-INF/container.xml.
+
+    :param epub_zip: Архив EPUB (zipfile.ZipFile, открытый на чтение).
+    :return: Пара (путь к OPF в архиве, корень разобранного OPF) или None, если OPF не удалось найти или прочитать.
+    """
+    try:
+        container = ElementTree.fromstring(epub_zip.read(CONTAINER_ENTRY))
+        opf_path = next(
+            element.get('full-path') for element in container.iter()
+            if _local_name(element.tag) == 'rootfile' and element.get('full-path')
+        )
+        return opf_path, ElementTree.fromstring(epub_zip.read(opf_path))
+    except (KeyError, StopIteration, ElementTree.ParseError):
+        return None
+
+def find_language(epub_zip) -> Optional[str]:
+    """
+    Находит язык книги: первый элемент dc:language в метаданных OPF.
+
+    :param epub_zip: Архив EPUB (zipfile.ZipFile, открытый на чтение).
+    :return: Код языка (например, 'ru' или 'de-DE') или None, если язык не указан или OPF не удалось прочитать.
+    """
+    opf = _read_opf(epub_zip)
+    if opf is None:
+        return None
+    for element in opf[1].iter():
+        if _local_name(element.tag) == 'language' and (element.text or '').strip():
+            return element.text.strip()
+    return None
+
+def find_spine_documents(epub_zip) -> Optional[Set[str]]:
+    """
+    Находит документы книги по OPF: путь к OPF берется из META-INF/container.xml, документы -
+    из элементов itemref в spine, которые ссылаются на элементы манифеста с типом XHTML.
+    Навигационный документ (properties="nav") и необязательные для чтения документы (linear="no")
+    не учитываются, как и файлы, которых нет в spine.
+
+    :param epub_zip: Архив EPUB (zipfile.ZipFile, открытый на чтение).
+    :return: Множество имен записей архива или None, если OPF не удалось найти или прочитать.
+    """
+    opf = _read_opf(epub_zip)
+    if opf is None:
+        return None
+    opf_path, opf = opf
+
+    # Ссылки в OPF относительны директории, в которой он лежит
+    opf_dir = posixpath.dirname(opf_path)
+    manifest = {}
+    for element in opf.iter():
+        if _local_name(element.tag) == 'item' and element.get('id') and element.get('href'):
+            manifest[element.get('id')] = element
+
+    documents = set()
+    for element in opf.iter():
+        if _local_name(element.tag) != 'itemref' or element.get('linear', 'yes').strip() == 'no':
+            continue
+        item = manifest.get(element.get('idref'))
+        if item is None or item.get('media-type', '').strip() not in HTML_MEDIA_TYPES:
+            continue
+        if 'nav' in item.get('properties', '').split():
+            continue
+        href = unquote(item.get('href').split('#', 1)[0])
+        documents.add(posixpath.normpath(posixpath.join(opf_dir, href)))
+    return documents
+
+@contextmanager
+def atomic_replace(path, mode='wb', mode_source=None, **open_kwargs):
+    """
+    Открывает временный файл рядом с path для записи нового содержимого. Если блок with завершился
+    без ошибок, временный файл атомарно заменяет path (с сохранением прав доступа), иначе удаляется,
+    и файл path остается нетронутым.
+
+    :param path: Путь к заменяемому (или создаваемому) файлу.
+    :param mode: Режим открытия временного файла.
+    :param mode_source: Файл, права доступа которого получит новый файл (по умолчанию - сам path).
+    :param open_kwargs: Остальные аргументы open (encoding, newline и т.д.).
+    """
+    # Временный файл создаем в той же директории: os.replace атомарен только в пределах одной файловой системы
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.paragraphs-', suffix=os.path.splitext(path)[1], dir=directory)
+    try:
+        with open(fd, mode, **open_kwargs) as tmp_file:
+            yield tmp_file
+        # Сохраняем права доступа оригинального файла (mkstemp создает файл с правами 0600)
+        shutil.copymode(mode_source or path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def _is_html_entry(info):
+    """Признак того, что запись архива - HTML файл (по расширению)."""
+    return not info.is_dir() and info.filename.lower().split('.')[-1] in HTML_EXTENSIONS
+
+def _rewritten_entry_info(info):
+    """Заголовок для перезаписываемой записи: имя, дата, атрибуты и метод сжатия исходной записи."""
+    new_info = zipfile.ZipInfo(info.filename, info.date_time)
+    new_info.compress_type = info.compress_type
+    new_info.create_system = info.create_system
+    new_info.external_attr = info.external_attr
+    new_info.comment = info.comment
+    return new_info
+
+def _document_filter(source_zip, spine_only, epub_path):
+    """
+    Какие записи архива обрабатывать: документы из spine OPF или все HTML файлы по расширению.
+
+    :return: Функция, которая принимает запись архива (zipfile.ZipInfo) и возвращает признак документа.
+    """
+    spine_documents = find_spine_documents(source_zip) if spine_only else None
+    if spine_documents is not None:
+        return lambda info: info.filename in spine_documents
+    if spine_only:
+        logging.warning(f"[Split paragraphs plugin] could not read OPF spine of {epub_path}, "
+                        f"processing all HTML files instead")
+    return _is_html_entry
+
+def process_epub(epub_path, max_len=10, merge_before_splitting=False, backuping=False, engine=ENGINE_BS4,
+                 compress_level=DEFAULT_COMPRESS_LEVEL, spine_only=False, workers=1, cache=None, output_path=None,
+                 stats=NULL_STATS, incremental=False, version='', stream_threshold=DEFAULT_STREAM_THRESHOLD,
+                 language=None, abbreviations=None, conditional_abbreviations=None, analyze=False):
     """
     Обрабатывает EPUB файл, находя все HTML файлы внутри него, применяет функцию форматирования
     к их содержимому и перезаписывает оригинальное содержимое отформатированной версией.
@@ -451,49 +1030,217 @@ def process_epub(epub_path, max_len=10, merge_before_splitting=False, backuping=
         max_len (int): Максимальное количество слов в абзаце.
         merge_before_splitting (bool): Признак того, что необходимо объединить абзацы в один перед дальнейшим разбиением.
         backuping (bool): Признак того, что необходимо создать резервную копию оригинального EPUB файла.
+        engine (str): Движок разбиения абзацев (ENGINE_BS4, ENGINE_LXML или ENGINE_LXML_DOM).
+        compress_level (int): Уровень сжатия deflate (0-9) для перезаписываемых HTML файлов.
+        spine_only (bool): Признак того, что нужно обрабатывать только документы из spine OPF (см. find_spine_documents),
+            а не все файлы с расширением HTML.
+        workers (int): Количество процессов, в которых параллельно обрабатываются документы (0 - по количеству
+            процессоров, 1 - без пула процессов).
+        cache (ResultCache): Кэш результатов обработки документов (см. result_cache.py) или None.
+        output_path (str): Путь, по которому записывается результат. По умолчанию - epub_path
+            (оригинал перезаписывается); если путь передан, оригинал остается нетронутым.
+        stats (ProcessingStats): Статистика обработки: время этапов, счетчики и время обработки каждого
+            документа (см. stats.py). Рабочие процессы возвращают свою статистику вместе с результатом.
+        incremental (bool): Признак инкрементальной обработки: в архив записывается манифест обработанных документов
+            (см. split_manifest.py), а документы, которые по манифесту уже обработаны с теми же настройками,
+            копируются как есть. Если обработаны все документы, книга не перезаписывается.
+        version (str): Версия плагина, которая входит в настройки манифеста.
+        stream_threshold (int): Размер документа в байтах, начиная с которого документ обрабатывается потоково,
+            с расходом памяти по размеру самого большого абзаца (см. stream_split.py). 0 или None - всегда
+            разбирать документ целиком.
+        language (str): Язык книги, по которому выбираются правила разбиения на предложения (см. segmenters.py).
+            По умолчанию - из метаданных OPF (dc:language).
+        abbreviations (dict): Пользовательские безусловные сокращения: словарь "язык -> список сокращений".
+        conditional_abbreviations (dict): Пользовательские условные сокращения в том же виде.
+        analyze (bool): Признак анализа без обработки: документы разбираются и абзацы считаются, но книга
+            не перезаписывается (см. analyze.py). Резервная копия, кэш, пул процессов и манифест при этом
+            не используются.
+
+    Возвращает:
+        BookAnalysis (см. analyze.py), если передан analyze, иначе None.
 
     Функция выполняет следующие шаги:
-    - Извлекает содержимое EPUB файла во временную директорию.
-    - Рекурсивно ищет все HTML файлы (.html или .htm) внутри извлеченного содержимого.
-    - Читает содержимое каждого HTML файла и применяет к нему функцию `process_epub_html`.
-    - Перезаписывает оригинальные HTML файлы отформатированным содержимым.
-    - Пересобирает измененное содержимое обратно в EPUB файл, перезаписывая оригинальный файл.
     - Создает резервную копию оригинального EPUB файла с расширением '.bak' в той же директории, где лежит оригинал.
+    - Читает записи архива по одной, в исходном порядке, ничего не распаковывая на диск.
+    - Запись mimetype записывает первой и без сжатия, как требует спецификация EPUB (OCF),
+      даже если в исходном архиве это было не так.
+    - HTML файлы (.html, .htm, .xhtml, .xht) или, если передан spine_only, XHTML документы из spine OPF
+      (при любом расширении) читает в память, применяет к ним функцию `process_epub_html`
+      и записывает результат в новый архив с тем же методом сжатия (deflate - с уровнем compress_level).
+      Если workers больше 1, документы обрабатываются заранее в пуле процессов (см. parallel.py),
+      а в архив записываются в том же исходном порядке. Если передан cache, документы, которые уже
+      обрабатывались с теми же настройками, берутся из кэша без разбора HTML. Документы больше
+      stream_threshold читаются, разбиваются и записываются в новый архив потоково, по одному абзацу.
+    - Остальные записи (шрифты, картинки, аудио) копирует в новый архив в сжатом виде, не распаковывая.
+    - Если передан incremental, документы, которые по манифесту уже обработаны, тоже копирует не распаковывая,
+      а в конец архива записывает новый манифест.
+    - Новый архив пишется во временный файл рядом с оригиналом, который затем атомарно заменяет оригинал:
+      при ошибке оригинальный файл остается нетронутым.
     """
-    valid_extensions = {'html', 'htm', 'xhtml', 'xht'}
-
-    # Работаем с копией книги во временной директории
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        # Извлекаем содержимое epub файла во временную директорию
-        with zipfile.ZipFile(epub_path, 'r') as zip_ref:
-            zip_ref.extractall(tmpdirname)
-        
-        # Проходим по извлеченным файлам (рекурсивно)
-        for root, dirs, files in os.walk(tmpdirname):
-            for file in files:
-                if file.lower().split('.')[-1] in valid_extensions:
-                    file_path = os.path.join(root, file)
-
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    # Форматируем содержимое и перезаписываем старое отфрматированным
-                    formatted_content = process_epub_html(content, max_len, merge_before_splitting)
-                    with open(file_path, 'w', encoding='utf-8') as f:
-                        f.write(formatted_content)
-        
-        # Сначала делаем резервную копию оригинального файла, если был передан параметр
-        if backuping:
-            backup_epub_path = epub_path + '.bak'
-            shutil.copy2(epub_path, backup_epub_path)
-        
-        # Создаем новый epub файл (перезаписываем оригинал)
-        with zipfile.ZipFile(epub_path, 'w') as zip_ref:
-            for foldername, subfolders, filenames in os.walk(tmpdirname):
-                for filename in filenames:
-                    filepath = os.path.join(foldername, filename)
-                    # Относительный путь для сохранения в zip архиве
-                    arcname = os.path.relpath(filepath, tmpdirname)
-                    zip_ref.write(filepath, arcname)
+    if __package__:
+        from .splitter_context import SplitterContext
+    else:
+        from splitter_context import SplitterContext
+    if language is None:
+        with zipfile.ZipFile(epub_path, 'r') as source_zip:
+            language = find_language(source_zip)
+    # Настройки разбиения и правила для языка книги собираются один раз на всю книгу
+    context = SplitterContext.for_book(max_len, merge_before_splitting, engine, language, abbreviations,
+                                       conditional_abbreviations)
+    logging.info(f"[Split paragraphs plugin] language: {language}, sentence rules: {context.segmenter.key}")
+    if analyze:
+        if __package__:
+            from .analyze import analyze_epub
+        else:
+            from analyze import analyze_epub
+        return analyze_epub(epub_path, context, spine_only, stats)
+
+    fingerprint = settings_fingerprint(version, *context.settings) if incremental else None
+    processed = {}
+    if incremental:
+        # Документы, уже обработанные с теми же настройками (по манифесту предыдущей обработки)
+        with zipfile.ZipFile(epub_path, 'r') as source_zip:
+            is_document = _document_filter(source_zip, spine_only, epub_path)
+            documents = [info for info in source_zip.infolist() if info.filename != MIMETYPE_ENTRY and is_document(info)]
+            previous_manifest = read_manifest(source_zip, fingerprint)
+            start_time = stats.clock()
+            for info in documents:
+                if is_processed(source_zip, info, previous_manifest.get(info.filename)):
+                    processed[info.filename] = previous_manifest[info.filename]
+            stats.lap(STAGE_UNZIP, start_time)
+        stats.count(COUNTER_UNCHANGED, len(processed))
+        if processed and len(processed) == len(documents):
+            logging.info(f"[Split paragraphs plugin] {epub_path} is already processed with the same settings")
+            if output_path:
+                shutil.copy2(epub_path, output_path)
+            return
+
+    # Сначала делаем резервную копию оригинального файла, если был передан параметр
+    if backuping:
+        backup_epub_path = epub_path + '.bak'
+        shutil.copy2(epub_path, backup_epub_path)
+
+    with atomic_replace(output_path or epub_path, mode_source=epub_path) as tmp_file, \
+            zipfile.ZipFile(epub_path, 'r') as source_zip, \
+            zipfile.ZipFile(tmp_file, 'w') as target_zip:
+        is_document = _document_filter(source_zip, spine_only, epub_path)
+
+        # Сортировка устойчивая: mimetype переезжает в начало, остальные записи сохраняют исходный порядок.
+        # Манифест предыдущей обработки при инкрементальной обработке не копируется, а пишется заново в конце
+        infos = sorted((info for info in source_zip.infolist() if not (incremental and info.filename == MANIFEST_ENTRY)),
+                       key=lambda info: info.filename != MIMETYPE_ENTRY)
+        # Манифест новой обработки: уже обработанные документы переносятся из старого
+        manifest = dict(processed)
+        # Большие документы не загружаются в память целиком: они обрабатываются потоково в основном цикле
+        # (без пула процессов и без кэша, результат которого пришлось бы держать в памяти)
+        is_streamed = lambda info: bool(stream_threshold) and info.file_size > stream_threshold
+
+        def cache_key(content):
+            return cache.key(content, *context.settings) if cache is not None else None
+
+        def cached(key):
+            return cache.get(key) if cache is not None else None
+
+        # Документы независимы друг от друга, поэтому при нескольких процессах обрабатываем их все сразу
+        # (кроме найденных в кэше). Для каждого документа запоминаем тройку
+        # (результат, размер исходного документа, время обработки в рабочем процессе)
+        formatted_documents = {}
+        documents = [info for info in infos
+                     if info.filename != MIMETYPE_ENTRY and is_document(info) and info.filename not in processed
+                     and not is_streamed(info)]
+        if workers != 1 and len(documents) > 1:
+            if __package__:
+                from .parallel import map_in_processes, resolve_workers
+            else:
+                from parallel import map_in_processes, resolve_workers
+            missing = []
+            for info in documents:
+                start_time = stats.clock()
+                content = source_zip.read(info)
+                stats.lap(STAGE_UNZIP, start_time)
+                key = cache_key(content)
+                formatted_content = cached(key)
+                if formatted_content is not None:
+                    stats.count(COUNTER_CACHE_HITS)
+                    formatted_documents[info.filename] = (formatted_content, len(content), 0.0)
+                else:
+                    missing.append((info, content, key))
+
+            collect_stats = stats is not NULL_STATS
+            args_list = [(content.decode('utf-8'), context, collect_stats) for _, content, _ in missing]
+            results = map_in_processes(process_epub_html_in_worker, args_list, resolve_workers(workers))
+            for (info, content, key), (result, document_stats) in zip(missing, results):
+                formatted_content = result.encode('utf-8')
+                seconds = 0.0
+                if document_stats is not None:
+                    stats.update(document_stats)
+                    seconds = document_stats.total
+                formatted_documents[info.filename] = (formatted_content, len(content), seconds)
+                if cache is not None:
+                    cache.put(key, formatted_content)
+
+        for info in infos:
+            if info.filename == MIMETYPE_ENTRY:
+                start_time = stats.clock()
+                mimetype_info = _rewritten_entry_info(info)
+                mimetype_info.compress_type = zipfile.ZIP_STORED
+                target_zip.writestr(mimetype_info, source_zip.read(info))
+                stats.lap(STAGE_ZIP, start_time)
+            elif is_document(info) and info.filename not in processed and is_streamed(info):
+                document_start_time = stats.clock()
+                if __package__:
+                    from .stream_split import process_epub_html_stream
+                else:
+                    from stream_split import process_epub_html_stream
+                new_info = _rewritten_entry_info(info)
+                # Уровень сжатия записи, открытой на запись через ZipFile.open, берется из ZipInfo
+                new_info._compresslevel = compress_level
+                digest = hashlib.sha256()
+                with source_zip.open(info) as source, target_zip.open(new_info, 'w') as target:
+                    def write(text):
+                        data = text.encode('utf-8')
+                        digest.update(data)
+                        target.write(data)
+
+                    process_epub_html_stream(source, write, context, stats)
+                stats.add_document(info.filename, stats.clock() - document_start_time, info.file_size,
+                                   new_info.file_size)
+                if incremental:
+                    manifest[info.filename] = streamed_document_record(new_info, digest)
+            elif is_document(info) and info.filename not in processed:
+                document_start_time = stats.clock()
+                if info.filename in formatted_documents:
+                    formatted_content, content_size, seconds = formatted_documents.pop(info.filename)
+                else:
+                    seconds = 0.0
+                    start_time = stats.clock()
+                    content = source_zip.read(info)
+                    stats.lap(STAGE_UNZIP, start_time)
+                    content_size = len(content)
+                    key = cache_key(content)
+                    formatted_content = cached(key)
+                    if formatted_content is None:
+                        # Форматируем содержимое и записываем его вместо старого
+                        formatted_content = process_document(content.decode('utf-8'), context, stats).encode('utf-8')
+                        if cache is not None:
+                            cache.put(key, formatted_content)
+                    else:
+                        stats.count(COUNTER_CACHE_HITS)
+                start_time = stats.clock()
+                target_zip.writestr(_rewritten_entry_info(info), formatted_content, compresslevel=compress_level)
+                stats.lap(STAGE_ZIP, start_time)
+                stats.add_document(info.filename, seconds + stats.clock() - document_start_time, content_size,
+                                   len(formatted_content))
+                if incremental:
+                    manifest[info.filename] = document_record(formatted_content)
+            else:
+                start_time = stats.clock()
+                copy_zip_entry_raw(source_zip, target_zip, info)
+                stats.lap(STAGE_ZIP, start_time)
+
+        if incremental:
+            target_zip.writestr(MANIFEST_ENTRY, manifest_bytes(fingerprint, manifest), zipfile.ZIP_DEFLATED,
+                                compresslevel=compress_level)
 
 if __name__ == "__main__":
     import argparse
@@ -503,8 +1250,43 @@ if __name__ == "__main__":
     parser.add_argument('-l', '--len', type=int, default=10, help='Максимальное количество слов в абзаце.')
     parser.add_argument('-m', '--merge', action='store_true', help='Объединить все абзацы перед последующим разбиением.')
     parser.add_argument('-b', '--backup', action='store_true', help='Делать ли backup перед форматированием.')
+    parser.add_argument('-z', '--compress-level', type=int, choices=range(10), default=DEFAULT_COMPRESS_LEVEL,
+                        help='Уровень сжатия deflate (0-9) для перезаписываемых HTML файлов.')
+    parser.add_argument('-s', '--spine-only', action='store_true', help='Обрабатывать только документы из spine OPF.')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Количество процессов для параллельной обработки документов (0 - по количеству процессоров).')
+    parser.add_argument('-c', '--cache-dir', help='Директория кэша результатов обработки документов.')
+    parser.add_argument('-t', '--stream-threshold', type=int, default=DEFAULT_STREAM_THRESHOLD // 1024,
+                        help='Размер документа (КБ), начиная с которого документ обрабатывается потоково (0 - никогда).')
+    parser.add_argument('-L', '--language',
+                        help='Язык книги для разбиения на предложения (по умолчанию - из метаданных OPF).')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Записать манифест обработки и не обрабатывать повторно уже обработанные документы.')
+    parser.add_argument('-e', '--engine', choices=[ENGINE_BS4, ENGINE_LXML, ENGINE_LXML_DOM], default=ENGINE_BS4, help='Движок разбиения абзацев.')
+    parser.add_argument('-v', '--verbosity', type=int, choices=range(4), default=0,
+                        help='Подробность статистики обработки (0 - нет, 1 - итог, 2 - этапы, 3 - документы).')
+    parser.add_argument('-p', '--profile', help='Записать профиль cProfile в этот файл.')
+    parser.add_argument('-a', '--analyze', action='store_true',
+                        help='Только посчитать, что изменит разбиение, не перезаписывая книгу.')
 
     # Добавьте дополнительные аргументы здесь, если потребуется в будущем
     args = parser.parse_args()
 
-    process_epub(args.epub_path, args.line_len, args.merge)
+    cache = None
+    if args.cache_dir:
+        from result_cache import ResultCache
+        cache = ResultCache(args.cache_dir)
+
+    from stats import report, profiled
+
+    logging.basicConfig(level=logging.DEBUG if args.verbosity >= 3 else logging.INFO, format='%(message)s')
+    stats = ProcessingStats() if args.verbosity else NULL_STATS
+    with profiled(args.profile):
+        analysis = process_epub(args.epub_path, args.len, args.merge, args.backup, args.engine, args.compress_level,
+                                args.spine_only, args.workers, cache, stats=stats, incremental=args.incremental,
+                                stream_threshold=args.stream_threshold * 1024, language=args.language,
+                                analyze=args.analyze)
+    report(stats, logging.getLogger(), args.verbosity, args.epub_path)
+    if analysis is not None:
+        print(f'{args.epub_path}: {analysis.summary()}')
+        print('\n'.join(analysis.histogram_lines()))
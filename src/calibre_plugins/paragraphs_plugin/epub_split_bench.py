@@ -0,0 +1,336 @@
+"""
+Микробенчмарки для функций из epub_split.py.
+
+Запуск (из директории плагина):
+
+    python epub_split_bench.py [путь/к/корпусу.txt] [-n КОЛИЧЕСТВО_ПОВТОРОВ]
+
+Если корпус не передан, используется синтетический русский художественный текст
+объемом около 300 тысяч слов (примерно размер романа).
+"""
+import re
+import random
+import timeit
+import argparse
+import tracemalloc
+
+from epub_split import *
+
+
+# Фрагменты для синтетического корпуса: диалоги, сокращения, инициалы, многоточия и inline-теги
+SAMPLE_SENTENCES = [
+    'Князь Андрей посмотрел на небо и ничего не ответил.',
+    '— Что это было?! — воскликнула Наташа, оборачиваясь к двери.',
+    'Мы посетили ул. Ленина и г. Москву, а потом вернулись домой.',
+    'Известный поэт А. С. Пушкин написал это стихотворение в 1830 г. в Болдине.',
+    'Никто не знает... Может, узнаем позже.',
+    'Он сказал: «Приходите завтра, т.к. сегодня уже поздно».',
+    'Цена составляла 15.99 руб. за штуку, т.е. совсем недорого.',
+    'В саду росли яблони, груши, вишни и т.д. Все это требовало ухода.',
+    'Она читала <i>«Войну и мир»</i> уже третий раз.',
+    'Dr. Watson был помощником <b>Sherlock Holmes</b>, e.g. в деле о собаке.',
+    'Вечер был тихий, и только где-то вдалеке лаяла собака.',
+    'Пьер долго стоял у окна, глядя на темную улицу, по которой изредка проезжали извозчики.',
+]
+
+
+def generate_corpus(words=300_000, seed=0):
+    """
+    Генерирует синтетический корпус из абзацев по 3-12 предложений.
+
+    :param words: Примерное количество слов в корпусе.
+    :param seed: Зерно генератора случайных чисел (для воспроизводимости).
+    :return: Список абзацев (строк).
+    """
+    rnd = random.Random(seed)
+    paragraphs = []
+    total = 0
+    while total < words:
+        paragraph = ' '.join(rnd.choice(SAMPLE_SENTENCES) for _ in range(rnd.randint(3, 12)))
+        paragraphs.append(paragraph)
+        total += count_words(paragraph)
+    return paragraphs
+
+
+def load_corpus(path):
+    """
+    Загружает корпус из текстового файла: каждая непустая строка считается абзацем.
+
+    :param path: Путь к файлу в кодировке UTF-8.
+    :return: Список абзацев (строк).
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+# --- Эталонные (исходные) реализации для сравнения ---
+
+def legacy_tokenize_text(text):
+    """Исходная реализация tokenize_text: компиляция паттерна на каждый вызов и pattern.match по позиции."""
+    tokens = []
+    combined_pattern = r'(<[^>]*>)|(\b\w+(?:-\w+)*\b)|([^\w\s\u00A0-])|([\s\u00A0]+)'
+    pattern = re.compile(combined_pattern, re.UNICODE)
+    pos = 0
+    while pos < len(text):
+        match = pattern.match(text, pos)
+        if match:
+            token_text = match.group(0)
+            is_word = bool(match.group(2))
+            tokens.append(Token(token_text, is_word))
+            pos += len(token_text)
+        else:
+            tokens.append(Token(text[pos], is_word=False))
+            pos += 1
+    return tokens
+
+
+def legacy_count_words(text):
+    """Исходная реализация count_words поверх legacy_tokenize_text."""
+    return sum(1 for token in legacy_tokenize_text(text) if token.is_word)
+
+
+def legacy_split_paragraph_into_sentences(paragraph_text):
+    """Исходная реализация разбиения на предложения: посимвольный цикл и is_abbreviation на каждом знаке."""
+    sentences = []
+    sentence_start = 0
+    i = 0
+    length = len(paragraph_text)
+    tag_stack = []
+    inside_quotes = False
+
+    while i < length:
+        char = paragraph_text[i]
+        if char == '<':
+            end_tag_pos = paragraph_text.find('>', i)
+            if end_tag_pos == -1:
+                tag_stack.append(paragraph_text[i:])
+                break
+            tag_content = paragraph_text[i + 1:end_tag_pos]
+            if tag_content.startswith('/'):
+                if tag_stack:
+                    tag_stack.pop()
+            else:
+                tag_stack.append(tag_content)
+            i = end_tag_pos
+        elif char == '"':
+            inside_quotes = not inside_quotes
+        elif char in '«“':
+            inside_quotes = True
+        elif char in '»”':
+            inside_quotes = False
+        elif char in '.!?…':
+            should_split = True
+            if is_abbreviation(paragraph_text, i):
+                should_split = False
+            elif i > 0 and i + 1 < length and paragraph_text[i - 1].isdigit() and paragraph_text[i + 1].isdigit():
+                should_split = False
+            elif tag_stack:
+                should_split = False
+            elif i + 1 < length and paragraph_text[i + 1] in '.!?…':
+                should_split = False
+            elif inside_quotes:
+                should_split = False
+                if i - sentence_start > 200:
+                    inside_quotes = False
+                    should_split = True
+            if should_split:
+                sentence = paragraph_text[sentence_start:i + 1].strip()
+                if sentence:
+                    sentences.append(sentence)
+                sentence_start = i + 1
+        i += 1
+
+    if sentence_start < length:
+        sentence = paragraph_text[sentence_start:].strip()
+        if sentence:
+            sentences.append(sentence)
+
+    return sentences
+
+
+def legacy_merge_adjacent_paragraphs(soup):
+    """
+    Исходная реализация merge_adjacent_paragraphs: удаление из списка абзацев внутри цикла,
+    структурное сравнение родителей и перенос детей по одному (квадратичное время).
+    """
+    paragraphs = soup.find_all('p')
+    i = 0
+    while i < len(paragraphs) - 1:
+        current_p = paragraphs[i]
+        next_p = paragraphs[i + 1]
+        if current_p.parent != next_p.parent:
+            i += 1
+            continue
+
+        current_class = current_p.get('class', '')
+        next_class = next_p.get('class', '')
+        if isinstance(current_class, list):
+            current_class = ' '.join(current_class)
+        if isinstance(next_class, list):
+            next_class = ' '.join(next_class)
+        current_style = current_p.get('style', '') or ''
+        next_style = next_p.get('style', '') or ''
+
+        if (current_class or '') == (next_class or '') and current_style == next_style:
+            if not (str(current_p.contents[-1]).strip().endswith((' ', '\n')) or not str(next_p.contents[0]).strip().startswith(' ')):
+                current_p.append(' ')
+            for child in list(next_p.children):
+                current_p.append(child)
+            next_p.decompose()
+            del paragraphs[i + 1]
+        else:
+            i += 1
+
+
+def bench(label, func, paragraphs, number):
+    """
+    Замеряет время прогона func по всем абзацам корпуса (лучший результат из number повторов).
+
+    :return: Время в секундах.
+    """
+    best = min(timeit.repeat(lambda: [func(p) for p in paragraphs], number=1, repeat=number))
+    print(f'{label:<40} {best * 1000:10.1f} ms')
+    return best
+
+
+def compare(title, legacy, current, paragraphs, number, check=True, normalize=None):
+    """
+    Сравнивает две реализации: сначала (если check=True) проверяет совпадение результатов,
+    потом замеряет время.
+
+    normalize(абзац, результат) приводит результат исходной реализации к виду текущей там, где они
+    расходятся намеренно (замер времени normalize не затрагивает).
+    """
+    if check:
+        for p in paragraphs[:200]:
+            expected = normalize(p, legacy(p)) if normalize else legacy(p)
+            assert expected == current(p), f'{title}: результаты не совпадают на абзаце {p!r}'
+
+    print(f'\n== {title}')
+    old = bench('было', legacy, paragraphs, number)
+    new = bench('стало', current, paragraphs, number)
+    print(f'{"ускорение":<40} {old / new:10.2f}x')
+
+
+def join_abbreviation_splits(paragraph_text, sentences):
+    """
+    Склеивает предложения, которые исходная реализация разбиения разрезала внутри сокращений из нескольких
+    точек ("т.д.", "т.е.", "e.g."): такое "предложение" начинается сразу после точки, без пробела.
+    """
+    joined = []
+    end = 0
+    for sentence in sentences:
+        start = paragraph_text.find(sentence, end)
+        if joined and start == end:
+            joined[-1] += sentence
+        else:
+            joined.append(sentence)
+        end = start + len(sentence)
+    return joined
+
+
+def peak_memory(func, paragraphs):
+    """
+    Замеряет пиковый объем памяти, который занимают результаты func для всех абзацев одновременно.
+
+    :return: Пиковый объем в байтах.
+    """
+    tracemalloc.start()
+    results = [func(p) for p in paragraphs]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+    return peak
+
+
+def compare_memory(title, legacy, current, paragraphs):
+    """Сравнивает пиковое потребление памяти двух реализаций."""
+    print(f'\n== {title} (пиковая память)')
+    old = peak_memory(legacy, paragraphs)
+    new = peak_memory(current, paragraphs)
+    print(f'{"было":<40} {old / 2 ** 20:10.1f} MiB')
+    print(f'{"стало":<40} {new / 2 ** 20:10.1f} MiB')
+
+
+def generate_dialogue_chapter(paragraphs=10_000, seed=0):
+    """
+    Генерирует главу из коротких однострочных абзацев (как в длинных диалогах): соседние абзацы
+    с одинаковыми атрибутами объединяются merge_adjacent_paragraphs.
+
+    :param paragraphs: Количество абзацев.
+    :param seed: Зерно генератора случайных чисел (для воспроизводимости).
+    :return: HTML главы.
+    """
+    rnd = random.Random(seed)
+    lines = []
+    for _ in range(paragraphs):
+        css_class = rnd.choice(['text', 'text', 'text', 'dialog'])
+        lines.append(f'<p class="{css_class}">{rnd.choice(SAMPLE_SENTENCES)}</p>')
+    return '<html><body>\n' + '\n'.join(lines) + '\n</body></html>'
+
+
+def compare_merge(chapter, number):
+    """
+    Сравнивает исходную и текущую реализации merge_adjacent_paragraphs, а также merge_adjacent_paragraphs_lxml
+    (движки lxml), на одной главе.
+    """
+    from lxml_split import PARAGRAPH_TAGS, parse_html, merge_adjacent_paragraphs_lxml
+
+    def parse_bs4():
+        return BeautifulSoup(chapter, 'html.parser')
+
+    def parse_lxml():
+        return parse_html(chapter)[1]
+
+    def run(merge):
+        soup = parse_bs4()
+        merge(soup)
+        return str(soup)
+
+    assert run(legacy_merge_adjacent_paragraphs) == run(merge_adjacent_paragraphs), \
+        'merge_adjacent_paragraphs: результаты не совпадают'
+    # Сериализация lxml отличается от BeautifulSoup, поэтому сверяется текст объединенных абзацев
+    soup, root = parse_bs4(), parse_lxml()
+    merge_adjacent_paragraphs(soup)
+    merge_adjacent_paragraphs_lxml(root)
+    assert [p.get_text() for p in soup.find_all('p')] == [''.join(p.itertext()) for p in root.iter(*PARAGRAPH_TAGS)], \
+        'merge_adjacent_paragraphs_lxml: результаты не совпадают'
+
+    print(f'\n== merge_adjacent_paragraphs ({chapter.count("<p ")} абзацев)')
+    # Разбор HTML в замер не входит: замеряется только объединение
+    times = {}
+    for label, parse, merge in (('было', parse_bs4, legacy_merge_adjacent_paragraphs),
+                                ('стало', parse_bs4, merge_adjacent_paragraphs),
+                                ('lxml', parse_lxml, merge_adjacent_paragraphs_lxml)):
+        best = None
+        for _ in range(number):
+            root = parse()
+            start = timeit.default_timer()
+            merge(root)
+            elapsed = timeit.default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f'{label:<40} {best * 1000:10.1f} ms')
+        times[label] = best
+    print(f'{"ускорение":<40} {times["было"] / times["стало"]:10.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарки разбиения абзацев.')
+    parser.add_argument('corpus', nargs='?', help='Текстовый файл с корпусом (абзац на строку).')
+    parser.add_argument('-n', '--number', type=int, default=3, help='Количество повторов замера.')
+    args = parser.parse_args()
+
+    paragraphs = load_corpus(args.corpus) if args.corpus else generate_corpus()
+    print(f'Корпус: {len(paragraphs)} абзацев, {sum(map(len, paragraphs))} символов')
+
+    compare('tokenize_text', legacy_tokenize_text, tokenize_text, paragraphs, args.number)
+    compare('count_words', legacy_count_words, count_words, paragraphs, args.number)
+    compare_memory('tokenize_text -> TokenStream', legacy_tokenize_text, TokenStream, paragraphs)
+    # Исходная реализация разбивала предложения внутри "т.д.", "т.к." и т.п.: перед сверкой эти разрезы склеиваются
+    compare('split_paragraph_into_sentences', legacy_split_paragraph_into_sentences,
+            split_paragraph_into_sentences, paragraphs, args.number, normalize=join_abbreviation_splits)
+    compare_merge(generate_dialogue_chapter(), args.number)
+
+
+if __name__ == '__main__':
+    main()
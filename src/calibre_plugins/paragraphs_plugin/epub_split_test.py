@@ -1,6 +1,14 @@
+import os
+import shutil
+import struct
+import zipfile
+import tempfile
 import unittest
 
+from unittest import mock
+
 from epub_split import *
+from stats import ProcessingStats
 
 class TestTokenizeParagraph(unittest.TestCase):
     def test_spaces_and_nbsp(self):
@@ -119,7 +127,80 @@ class TestTokenizeParagraph(unittest.TestCase):
         ]
         self.assertEqual(tokens, expected)
 
+    def test_lone_hyphen(self):
+        paragraph = 'Слово - слово--слово'
+        tokens = tokenize_text(paragraph)
+        expected = [
+            Token('Слово', True),
+            Token(' ', False),
+            Token('-', False),
+            Token(' ', False),
+            Token('слово', True),
+            Token('-', False),
+            Token('-', False),
+            Token('слово', True),
+        ]
+        self.assertEqual(tokens, expected)
+
+class TestCountWords(unittest.TestCase):
+    def test_matches_tokenizer(self):
+        paragraphs = [
+            'Слово1 Слово2 Слово3',
+            'Текст с тегом<tag attr="value">и после</tag> тега.',
+            'Он сказал: "Привет!" и зачем-то ушёл.',
+            'Слово - слово--слово <незакрытый тег',
+            '',
+        ]
+        for paragraph in paragraphs:
+            expected = sum(1 for token in tokenize_text(paragraph) if token.is_word)
+            self.assertEqual(count_words(paragraph), expected)
+
+    def test_tag_attributes_are_not_words(self):
+        paragraph = '<a href="http://example.com" class="link">ссылка</a> на сайт'
+        self.assertEqual(count_words(paragraph), 3)
+
+    def test_range(self):
+        paragraph = 'Первое предложение. Второе <b class="x">длинное</b> предложение!'
+        start = paragraph.find('Второе')
+        self.assertEqual(count_words(paragraph, start), 3)
+        self.assertEqual(count_words(paragraph, 0, start), 2)
+
+class TestTokenStream(unittest.TestCase):
+    def test_same_tokens_as_tokenize_text(self):
+        paragraph = 'Текст\u00A0с тегом <tag>и (символами), например: "пример" - вот.'
+        stream = TokenStream(paragraph)
+        self.assertEqual(list(stream), tokenize_text(paragraph))
+        self.assertEqual(len(stream), len(tokenize_text(paragraph)))
+
+    def test_offsets_and_kinds(self):
+        paragraph = 'Слово <b>два</b>.'
+        stream = TokenStream(paragraph)
+        self.assertEqual(list(stream.starts), [0, 5, 6, 9, 12, 16])
+        self.assertEqual(list(stream.ends), [5, 6, 9, 12, 16, 17])
+        self.assertEqual(list(stream.kinds), [TOKEN_WORD, TOKEN_SPACE, TOKEN_TAG, TOKEN_WORD, TOKEN_TAG, TOKEN_SYMBOL])
+        self.assertEqual(stream.token_text(2), '<b>')
+
+    def test_count_words_in_range(self):
+        paragraph = 'Первое предложение. Второе <b>длинное</b> предложение!'
+        stream = TokenStream(paragraph)
+        self.assertEqual(stream.word_count, count_words(paragraph))
+        for start, end in split_paragraph_into_sentence_spans(paragraph):
+            self.assertEqual(stream.count_words(start, end), count_words(paragraph[start:end]))
+
 class TestSplitParagraphIntoSentences(unittest.TestCase):
+    def test_sentence_spans(self):
+        paragraph = '  Первое предложение.\u00A0Второе!  '
+        spans = split_paragraph_into_sentence_spans(paragraph)
+        self.assertEqual([paragraph[start:end] for start, end in spans], ['Первое предложение.', 'Второе!'])
+
+    def test_counted_sentences(self):
+        paragraph = 'Первое предложение. Второе <b>длинное</b> предложение! Третье?'
+        sentences = split_paragraph_into_counted_sentences(paragraph)
+        self.assertEqual(
+            [(paragraph[start:end], words_count) for start, end, words_count in sentences],
+            [('Первое предложение.', 2), ('Второе <b>длинное</b> предложение!', 3), ('Третье?', 1)]
+        )
+
     def test_simple_sentences(self):
         paragraph = 'Первое предложение. Второе предложение! Третье предложение?'
         sentences = split_paragraph_into_sentences(paragraph)
@@ -167,6 +248,39 @@ class TestSplitParagraphIntoSentences(unittest.TestCase):
         ]
         self.assertEqual(sentences, expected)
 
+    def test_multi_dot_abbreviations(self):
+        paragraph = 'Мы изучали физику и т.д. затем пошли домой. Потом т.е. вечером всё закончилось.'
+        sentences = split_paragraph_into_sentences(paragraph)
+        expected = [
+            'Мы изучали физику и т.д. затем пошли домой.',
+            'Потом т.е. вечером всё закончилось.'
+        ]
+        self.assertEqual(sentences, expected)
+
+    def test_multi_dot_abbreviations_are_not_cut(self):
+        # Исходная реализация разрезала такие сокращения по первой точке ("т." | "д."): см. epub_split_bench.py
+        paragraph = ('Он сказал: «Приходите завтра, т.к. сегодня уже поздно». В саду росли вишни и т.д. '
+                     'Все это требовало ухода. Dr. Watson помогал Холмсу, e.g. в деле о собаке. '
+                     'Цена 15.99 руб. за штуку, т.е. недорого.')
+        sentences = split_paragraph_into_sentences(paragraph)
+        expected = [
+            'Он сказал: «Приходите завтра, т.к. сегодня уже поздно».',
+            'В саду росли вишни и т.д.',
+            'Все это требовало ухода.',
+            'Dr. Watson помогал Холмсу, e.g. в деле о собаке.',
+            'Цена 15.99 руб. за штуку, т.е. недорого.'
+        ]
+        self.assertEqual(sentences, expected)
+
+    def test_initials(self):
+        paragraph = 'Известный поэт А. С. Пушкин написал это. И Dr. Watson тоже.'
+        sentences = split_paragraph_into_sentences(paragraph)
+        expected = [
+            'Известный поэт А. С. Пушкин написал это.',
+            'И Dr. Watson тоже.'
+        ]
+        self.assertEqual(sentences, expected)
+
     def test_inside_unclosed_tag(self):
         paragraph = 'Текст с <b>незакрытым тегом. Он продолжается</b>. А теперь новое предложение.'
         sentences = split_paragraph_into_sentences(paragraph)
@@ -332,6 +446,32 @@ class TestIsAbbreviation(unittest.TestCase):
         result = is_abbreviation(text, position + 3)  # Индекс последней точки в инициале
         self.assertTrue(result)
 
+class TestFindAbbreviations(unittest.TestCase):
+    def test_matches_is_abbreviation(self):
+        texts = [
+            'Мы посетили ул. Ленина и г. Москву. Это было интересно.',
+            'Известный поэт А. С. Пушкин. Он же А.С. Пушкин!',
+            'Мы изучали математику, физику и т.д. Теперь перейдем к другим предметам.',
+            'Компания была зарегистрирована как ABC Ltd.',
+            'Он сказал: "Достаточно и т.п.! Теперь переходим дальше."',
+            'Мы встретили Prof. Smith на конференции. Снег. Город г .',
+        ]
+        for text in texts:
+            positions = find_abbreviations(text)
+            for i, char in enumerate(text):
+                # Внутренние точки сокращений find_abbreviations помечает дополнительно
+                if char in '.!?…' and not (char == '.' and text[i + 1:i + 2].isalpha()):
+                    self.assertEqual(i in positions, is_abbreviation(text, i), (text, i))
+
+    def test_internal_dots(self):
+        text = 'и т.д. затем'
+        self.assertEqual(find_abbreviations(text), {3, 5})
+
+    def test_custom_abbreviations(self):
+        regex = compile_abbreviation_regex({'z.b.'}, set())
+        text = 'Das ist z.B. ein Beispiel.'
+        self.assertEqual(find_abbreviations(text, regex), {9, 11})
+
 class TestProcessEpubHtml(unittest.TestCase):
     def test_short_paragraph(self):
         html_content = '<p>Это короткий абзац с небольшим количеством слов.</p>'
@@ -452,5 +592,340 @@ class TestMergeAdjacentParagraphs(unittest.TestCase):
         # Ожидаем 2 абзаца, так как они на разных уровнях
         self.assertEqual(len(paragraphs), 2)
 
+    def test_merge_empty_paragraphs(self):
+        html_content = '<div><p></p><p>Абзац 1.</p><p/><p>Абзац 2.</p><p></p></div>'
+        soup = BeautifulSoup(html_content, 'html.parser')
+        merge_adjacent_paragraphs(soup)
+        self.assertEqual(str(soup), '<div><p>Абзац 1.Абзац 2.</p></div>')
+
+    def test_no_merge_equal_parents(self):
+        # Родители с одинаковым содержимым - разные элементы
+        html_content = '<div><p>Абзац.</p></div><div><p>Абзац.</p></div>'
+        soup = BeautifulSoup(html_content, 'html.parser')
+        merge_adjacent_paragraphs(soup)
+        self.assertEqual(str(soup), html_content)
+
+    def test_merge_long_runs(self):
+        html_content = '<div>' + '<p class="a">А.</p>\n' * 100 + '<p class="b">Б.</p>\n' * 100 + '</div>'
+        soup = BeautifulSoup(html_content, 'html.parser')
+        merge_adjacent_paragraphs(soup)
+        self.assertEqual(str(soup), '<div><p class="a">' + 'А.' * 100 + '</p>' + '\n' * 100 +
+                         '<p class="b">' + 'Б.' * 100 + '</p>' + '\n' * 100 + '</div>')
+
+class TestCopyZipEntryRaw(unittest.TestCase):
+    DATA = bytes(range(256)) * 16
+
+    def local_extra_ids(self, path, name):
+        """Идентификаторы дополнительных полей в локальном заголовке записи."""
+        with zipfile.ZipFile(path) as zip_ref:
+            offset = zip_ref.getinfo(name).header_offset
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            name_length, extra_length = struct.unpack('<HH', f.read(zipfile.sizeFileHeader)[26:30])
+            f.seek(name_length, os.SEEK_CUR)
+            extra = f.read(extra_length)
+        ids = []
+        while extra:
+            field_id, size = struct.unpack('<HH', extra[:4])
+            ids.append(field_id)
+            extra = extra[4 + size:]
+        return ids
+
+    def test_zip64_entry(self):
+        # Предел ZIP64 уменьшен, чтобы не создавать запись больше 4 ГиБ
+        with tempfile.TemporaryDirectory() as tmp_dir, mock.patch.object(zipfile, 'ZIP64_LIMIT', 1000):
+            source_path = os.path.join(tmp_dir, 'source.zip')
+            target_path = os.path.join(tmp_dir, 'target.zip')
+            with zipfile.ZipFile(source_path, 'w') as zip_ref:
+                zip_ref.writestr('first.txt', 'Первая запись', zipfile.ZIP_DEFLATED)
+                zip_ref.writestr('data.bin', self.DATA, zipfile.ZIP_STORED)
+
+            with zipfile.ZipFile(source_path) as source_zip, zipfile.ZipFile(target_path, 'w') as target_zip:
+                info = source_zip.getinfo('data.bin')
+                self.assertIn(ZIP64_EXTRA_ID, self.local_extra_ids(source_path, 'data.bin'))
+                for info in source_zip.infolist():
+                    copy_zip_entry_raw(source_zip, target_zip, info)
+
+            # Поле ZIP64 в локальном заголовке одно, архив читается
+            self.assertEqual(self.local_extra_ids(target_path, 'data.bin'), [ZIP64_EXTRA_ID])
+            with zipfile.ZipFile(target_path) as zip_ref:
+                self.assertIsNone(zip_ref.testzip())
+                self.assertEqual(zip_ref.read('data.bin'), self.DATA)
+                self.assertEqual(zip_ref.read('first.txt').decode('utf-8'), 'Первая запись')
+
+
+class TestProcessEpub(unittest.TestCase):
+    CHAPTER = '<html><body><p>Один два три. Четыре пять шесть. Семь восемь девять.</p></body></html>'
+    IMAGE = bytes(range(256)) * 64
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.epub_path = os.path.join(self.tmp_dir.name, 'book.epub')
+        with zipfile.ZipFile(self.epub_path, 'w') as zip_ref:
+            zip_ref.writestr('mimetype', 'application/epub+zip', zipfile.ZIP_STORED)
+            zip_ref.writestr('OEBPS/images/', '')
+            zip_ref.writestr('OEBPS/images/cover.png', self.IMAGE, zipfile.ZIP_DEFLATED)
+            zip_ref.writestr('OEBPS/chapter.xhtml', self.CHAPTER, zipfile.ZIP_DEFLATED)
+            zip_ref.writestr('OEBPS/style.css', 'p { margin: 0 }', zipfile.ZIP_STORED)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_entries_are_rewritten_in_place(self):
+        with zipfile.ZipFile(self.epub_path) as zip_ref:
+            original = [(info.filename, info.compress_type, info.CRC) for info in zip_ref.infolist()]
+
+        process_epub(self.epub_path, max_len=3)
+
+        with zipfile.ZipFile(self.epub_path) as zip_ref:
+            self.assertIsNone(zip_ref.testzip())
+            infos = zip_ref.infolist()
+            # Порядок записей и методы сжатия сохраняются
+            self.assertEqual([(info.filename, info.compress_type) for info in infos],
+                             [(name, compress_type) for name, compress_type, _ in original])
+            # Нетронутые записи скопированы как есть
+            self.assertEqual([info.CRC for info in infos if info.filename != 'OEBPS/chapter.xhtml'],
+                             [crc for name, _, crc in original if name != 'OEBPS/chapter.xhtml'])
+            self.assertEqual(zip_ref.read('OEBPS/images/cover.png'), self.IMAGE)
+            self.assertEqual(
+                zip_ref.read('OEBPS/chapter.xhtml').decode('utf-8'),
+                '<html><body><p>Один два три.</p><p>Четыре пять шесть.</p><p>Семь восемь девять.</p></body></html>'
+            )
+        # Временных файлов рядом с книгой не остается
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['book.epub'])
+
+    def test_mimetype_is_first_and_stored(self):
+        with zipfile.ZipFile(self.epub_path, 'w') as zip_ref:
+            zip_ref.writestr('OEBPS/chapter.xhtml', self.CHAPTER, zipfile.ZIP_DEFLATED)
+            zip_ref.writestr('mimetype', 'application/epub+zip', zipfile.ZIP_DEFLATED)
+            zip_ref.writestr('OEBPS/style.css', 'p { margin: 0 }', zipfile.ZIP_DEFLATED)
+
+        process_epub(self.epub_path, max_len=3)
+
+        with zipfile.ZipFile(self.epub_path) as zip_ref:
+            infos = zip_ref.infolist()
+            self.assertEqual([info.filename for info in infos], ['mimetype', 'OEBPS/chapter.xhtml', 'OEBPS/style.css'])
+            self.assertEqual(infos[0].compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(infos[0].extra, b'')
+            self.assertEqual(zip_ref.read('mimetype'), b'application/epub+zip')
+        # По спецификации OCF тип содержимого можно прочитать по фиксированному смещению в начале файла
+        with open(self.epub_path, 'rb') as f:
+            self.assertEqual(f.read(58)[30:], b'mimetypeapplication/epub+zip')
+
+    def test_compress_level(self):
+        chapter = '<html><body>' + '<p>Один два три четыре пять шесть семь восемь.</p>' * 500 + '</body></html>'
+        with zipfile.ZipFile(self.epub_path, 'w') as zip_ref:
+            zip_ref.writestr('mimetype', 'application/epub+zip', zipfile.ZIP_STORED)
+            zip_ref.writestr('OEBPS/chapter.xhtml', chapter, zipfile.ZIP_DEFLATED)
+
+        sizes = []
+        for compress_level in (0, 9):
+            process_epub(self.epub_path, max_len=100, compress_level=compress_level)
+            with zipfile.ZipFile(self.epub_path) as zip_ref:
+                info = zip_ref.getinfo('OEBPS/chapter.xhtml')
+                self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+                self.assertEqual(zip_ref.read(info).decode('utf-8'), chapter)
+                sizes.append(info.compress_size)
+        self.assertLess(sizes[1], sizes[0])
+
+    def test_workers(self):
+        with zipfile.ZipFile(self.epub_path, 'w') as zip_ref:
+            zip_ref.writestr('mimetype', 'application/epub+zip')
+            for i in range(8):
+                zip_ref.writestr(f'OEBPS/chapter{i}.xhtml', self.CHAPTER.replace('Один', f'Глава{i}'), zipfile.ZIP_DEFLATED)
+                zip_ref.writestr(f'OEBPS/image{i}.png', self.IMAGE, zipfile.ZIP_DEFLATED)
+        sequential_path = os.path.join(self.tmp_dir.name, 'sequential.epub')
+        shutil.copy(self.epub_path, sequential_path)
+
+        process_epub(sequential_path, max_len=3)
+        process_epub(self.epub_path, max_len=3, workers=2)
+
+        with zipfile.ZipFile(sequential_path) as expected, zipfile.ZipFile(self.epub_path) as result:
+            self.assertEqual(result.namelist(), expected.namelist())
+            for name in expected.namelist():
+                self.assertEqual(result.read(name), expected.read(name))
+
+    def test_cache(self):
+        from unittest import mock
+        from result_cache import ResultCache
+
+        cache = ResultCache(os.path.join(self.tmp_dir.name, 'cache'))
+        with open(self.epub_path, 'rb') as f:
+            original = f.read()
+        process_epub(self.epub_path, max_len=3, cache=cache)
+        with open(self.epub_path, 'rb') as f:
+            expected = f.read()
+
+        # Повторная обработка той же книги не разбирает документы, а берет результат из кэша
+        with open(self.epub_path, 'wb') as f:
+            f.write(original)
+        with mock.patch('epub_split.process_epub_html') as process_epub_html_mock:
+            process_epub(self.epub_path, max_len=3, cache=cache)
+            process_epub_html_mock.assert_not_called()
+        with open(self.epub_path, 'rb') as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_backup(self):
+        with open(self.epub_path, 'rb') as f:
+            original = f.read()
+        process_epub(self.epub_path, max_len=3, backuping=True)
+        with open(self.epub_path + '.bak', 'rb') as f:
+            self.assertEqual(f.read(), original)
+
+    def test_output_path(self):
+        with open(self.epub_path, 'rb') as f:
+            original = f.read()
+        output_path = os.path.join(self.tmp_dir.name, 'out.epub')
+        process_epub(self.epub_path, max_len=3, output_path=output_path)
+        with open(self.epub_path, 'rb') as f:
+            self.assertEqual(f.read(), original)
+        with zipfile.ZipFile(output_path) as zip_ref:
+            self.assertEqual(zip_ref.read('OEBPS/chapter.xhtml').decode('utf-8').count('<p>'), 3)
+
+    def test_stage_times(self):
+        for engine in (ENGINE_BS4, ENGINE_LXML, ENGINE_LXML_DOM):
+            stats = ProcessingStats()
+            process_epub(self.epub_path, max_len=3, merge_before_splitting=True, engine=engine, stats=stats)
+            for stage in ('unzip', 'parse', 'merge', 'extract', 'sentence split', 'tokenize', 'regroup', 'serialize', 'zip'):
+                self.assertGreater(stats.times[stage], 0, (engine, stage))
+
+    def test_counters(self):
+        with zipfile.ZipFile(self.epub_path, 'a') as zip_ref:
+            zip_ref.writestr('OEBPS/dialog.xhtml', '<p>Да нет. </p><p>Может быть. </p><p>Один два три.</p>')
+        with open(self.epub_path, 'rb') as f:
+            original = f.read()
+
+        for workers in (1, 2):
+            with open(self.epub_path, 'wb') as f:
+                f.write(original)
+            stats = ProcessingStats()
+            process_epub(self.epub_path, max_len=3, merge_before_splitting=True, workers=workers, stats=stats)
+            self.assertEqual(stats.counters['documents'], 2)
+            self.assertEqual(stats.counters['paragraphs'], 2)
+            self.assertEqual(stats.counters['paragraphs merged'], 2)
+            self.assertEqual(stats.counters['paragraphs split'], 2)
+            self.assertEqual(stats.counters['paragraphs created'], 5)
+            self.assertEqual(stats.counters['sentences'], 6)
+            self.assertEqual(stats.counters['bytes in'], sum(size for _, _, size, _ in stats.documents))
+            self.assertEqual(len(stats.slowest_documents()), 2)
+
+    def test_incremental(self):
+        from unittest import mock
+
+        with zipfile.ZipFile(self.epub_path, 'a') as zip_ref:
+            zip_ref.writestr('OEBPS/chapter2.xhtml', self.CHAPTER.replace('Один', 'Раз'), zipfile.ZIP_DEFLATED)
+        process_epub(self.epub_path, max_len=3, incremental=True, version='1.0.0')
+        with zipfile.ZipFile(self.epub_path) as zip_ref:
+            self.assertEqual(zip_ref.namelist()[-1], 'META-INF/paragraphs-plugin.json')
+            self.assertEqual(zip_ref.read('OEBPS/chapter.xhtml').decode('utf-8').count('<p>'), 3)
+        with open(self.epub_path, 'rb') as f:
+            processed = f.read()
+
+        # Повторная обработка с теми же настройками не разбирает документы и не перезаписывает книгу
+        stats = ProcessingStats()
+        with mock.patch('epub_split.process_epub_html') as process_epub_html_mock:
+            process_epub(self.epub_path, max_len=3, incremental=True, version='1.0.0', stats=stats)
+            process_epub_html_mock.assert_not_called()
+        self.assertEqual(stats.counters['unchanged'], 2)
+        with open(self.epub_path, 'rb') as f:
+            self.assertEqual(f.read(), processed)
+
+        # Обрабатывается только измененный документ
+        chapter2 = '<html><body><p>Четыре пять шесть. Семь восемь девять.</p></body></html>'
+        with zipfile.ZipFile(self.epub_path) as zip_ref:
+            entries = [(info, zip_ref.read(info)) for info in zip_ref.infolist()]
+        with zipfile.ZipFile(self.epub_path, 'w') as zip_ref:
+            for info, content in entries:
+                zip_ref.writestr(info, chapter2 if info.filename == 'OEBPS/chapter2.xhtml' else content)
+        stats = ProcessingStats()
+        process_epub(self.epub_path, max_len=3, incremental=True, version='1.0.0', stats=stats)
+        self.assertEqual([name for _, name, _, _ in stats.documents], ['OEBPS/chapter2.xhtml'])
+        self.assertEqual(stats.counters['unchanged'], 1)
+        with zipfile.ZipFile(self.epub_path) as zip_ref:
+            self.assertIsNone(zip_ref.testzip())
+            self.assertEqual(zip_ref.read('OEBPS/chapter2.xhtml').decode('utf-8').count('<p>'), 2)
+            self.assertEqual(zip_ref.namelist().count('META-INF/paragraphs-plugin.json'), 1)
+
+        # С другими настройками документы обрабатываются заново
+        stats = ProcessingStats()
+        process_epub(self.epub_path, max_len=4, incremental=True, version='1.0.0', stats=stats)
+        self.assertEqual(stats.counters['documents'], 2)
+        self.assertEqual(stats.counters['unchanged'], 0)
+
+    def test_original_is_kept_on_error(self):
+        with open(self.epub_path, 'rb') as f:
+            original = f.read()
+        with self.assertRaises(ValueError):
+            process_epub(self.epub_path, max_len=3, engine='unknown')
+        with open(self.epub_path, 'rb') as f:
+            self.assertEqual(f.read(), original)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['book.epub'])
+
+
+class TestSpineDocuments(unittest.TestCase):
+    CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+    OPF = """<?xml version="1.0"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+    <item id="c1" href="text/chapter%201.xhtml" media-type="application/xhtml+xml"/>
+    <item id="c2" href="../chapter2.xml" media-type="application/xhtml+xml"/>
+    <item id="notes" href="text/notes.xhtml" media-type="application/xhtml+xml"/>
+    <item id="svg" href="cover.svg" media-type="image/svg+xml"/>
+  </manifest>
+  <spine>
+    <itemref idref="svg"/>
+    <itemref idref="nav"/>
+    <itemref idref="c1"/>
+    <itemref idref="c2"/>
+    <itemref idref="notes" linear="no"/>
+  </spine>
+</package>"""
+    CHAPTER = '<html><body><p>Один два три. Четыре пять шесть.</p></body></html>'
+    SPLIT_CHAPTER = '<html><body><p>Один два три.</p><p>Четыре пять шесть.</p></body></html>'
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.epub_path = os.path.join(self.tmp_dir.name, 'book.epub')
+        with zipfile.ZipFile(self.epub_path, 'w') as zip_ref:
+            zip_ref.writestr('mimetype', 'application/epub+zip')
+            zip_ref.writestr('META-INF/container.xml', self.CONTAINER)
+            zip_ref.writestr('OEBPS/content.opf', self.OPF)
+            for name in ('OEBPS/nav.xhtml', 'OEBPS/text/chapter 1.xhtml', 'chapter2.xml',
+                         'OEBPS/text/notes.xhtml', 'OEBPS/orphan.html'):
+                zip_ref.writestr(name, self.CHAPTER)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_find_spine_documents(self):
+        with zipfile.ZipFile(self.epub_path) as zip_ref:
+            self.assertEqual(find_spine_documents(zip_ref), {'OEBPS/text/chapter 1.xhtml', 'chapter2.xml'})
+
+    def test_no_container(self):
+        with zipfile.ZipFile(self.epub_path, 'w') as zip_ref:
+            zip_ref.writestr('mimetype', 'application/epub+zip')
+        with zipfile.ZipFile(self.epub_path) as zip_ref:
+            self.assertIsNone(find_spine_documents(zip_ref))
+
+    def test_process_spine_only(self):
+        process_epub(self.epub_path, max_len=3, spine_only=True)
+        with zipfile.ZipFile(self.epub_path) as zip_ref:
+            processed = {name for name in zip_ref.namelist()
+                         if zip_ref.read(name).decode('utf-8') == self.SPLIT_CHAPTER}
+        self.assertEqual(processed, {'OEBPS/text/chapter 1.xhtml', 'chapter2.xml'})
+
+    def test_process_all_html_files(self):
+        process_epub(self.epub_path, max_len=3)
+        with zipfile.ZipFile(self.epub_path) as zip_ref:
+            processed = {name for name in zip_ref.namelist()
+                         if zip_ref.read(name).decode('utf-8') == self.SPLIT_CHAPTER}
+        self.assertEqual(processed, {'OEBPS/nav.xhtml', 'OEBPS/text/chapter 1.xhtml',
+                                     'OEBPS/text/notes.xhtml', 'OEBPS/orphan.html'})
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,555 @@
+"""
+Движок разбиения абзацев на lxml (альтернатива BeautifulSoup с html.parser в epub_split.py).
+
+Документ разбирается libxml2 один раз, абзацы разбиваются прямо в дереве (без повторного разбора
+фрагментов), а результат сериализуется lxml. На документах, которые одинаково разбирают оба движка,
+результат совпадает с результатом движка BeautifulSoup побайтно. Известные отличия (в пользу lxml):
+  * BeautifulSoup схлопывает текстовые узлы из одних пробельных символов до '\n' или ' ' и добавляет
+    перевод строки после DOCTYPE, lxml сохраняет форматирование исходного документа;
+  * в разбиваемых абзацах BeautifulSoup теряет разметку комментариев и экранирование символов '<' и '&'
+    в тексте, lxml их сохраняет.
+
+Документ разбирается строго: восстанавливая некорректный XML, libxml2 молча теряет содержимое, поэтому
+такие документы разбирает BeautifulSoup (parse_html выбрасывает MalformedDocument, см. process_document).
+"""
+import re
+
+from bisect import bisect_right
+from html.entities import name2codepoint
+from xml.sax.saxutils import escape, unescape
+
+from lxml import etree
+
+try:
+    from .epub_split import plan_paragraph_split
+    from .word_counts import count_word_starts
+    from .stats import NULL_STATS, STAGE_PARSE, STAGE_MERGE, STAGE_EXTRACT, STAGE_TOKENIZE, STAGE_REGROUP, \
+        STAGE_SERIALIZE, COUNTER_PARAGRAPHS, COUNTER_PARAGRAPHS_MERGED, COUNTER_PARAGRAPHS_SPLIT, \
+        COUNTER_PARAGRAPHS_CREATED, COUNTER_PARAGRAPHS_UNSPLIT
+except ImportError:
+    from epub_split import plan_paragraph_split
+    from word_counts import count_word_starts
+    from stats import NULL_STATS, STAGE_PARSE, STAGE_MERGE, STAGE_EXTRACT, STAGE_TOKENIZE, STAGE_REGROUP, \
+        STAGE_SERIALIZE, COUNTER_PARAGRAPHS, COUNTER_PARAGRAPHS_MERGED, COUNTER_PARAGRAPHS_SPLIT, \
+        COUNTER_PARAGRAPHS_CREATED, COUNTER_PARAGRAPHS_UNSPLIT
+
+XHTML_NS = 'http://www.w3.org/1999/xhtml'
+
+# Теги абзацев (с пространством имен XHTML и без него)
+PARAGRAPH_TAGS = ('p', f'{{{XHTML_NS}}}p')
+
+# Пустые элементы HTML: только их можно сериализовать в виде <br/>, остальные пустые элементы
+# записываются как <a></a> (так же, как это делает BeautifulSoup)
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'
+])
+
+# Начало корневого элемента: все, что до него (XML-декларация, DOCTYPE, комментарии), переносится в результат как есть
+ROOT_START_REGEX = re.compile(r'<(?![?!])')
+
+# Именованные сущности HTML, которых нет в XML (например, &nbsp;)
+ENTITY_REGEX = re.compile(r'&([a-zA-Z][a-zA-Z0-9]*);')
+XML_ENTITIES = frozenset(['amp', 'lt', 'gt', 'quot', 'apos'])
+
+# Все фрагменты документа разбираются внутри служебного корня, чтобы обрабатывать и фрагменты с несколькими
+# элементами верхнего уровня (или вовсе без них)
+WRAPPER_TAG = 'paragraphs-plugin-wrapper'
+
+PARSER = etree.XMLParser(huge_tree=True, resolve_entities=False)
+
+
+class MalformedDocument(ValueError):
+    """Документ не является корректным XML: разобрать его lxml можно только с потерей содержимого."""
+
+
+class CannotSplitParagraph(Exception):
+    """Граница предложения попала внутрь разметки элемента, и абзац нельзя разбить по узлам дерева."""
+
+
+def _replace_html_entity(match):
+    name = match.group(1)
+    if name in XML_ENTITIES or name not in name2codepoint:
+        return match.group()
+    return chr(name2codepoint[name])
+
+
+def parse_html(html_content):
+    """
+    Разбирает HTML-контент EPUB-файла с помощью lxml.
+
+    :param html_content: Строка с HTML-контентом.
+    :return: Пара (пролог документа, служебный корень с содержимым документа).
+    :raises MalformedDocument: Если документ не является корректным XML.
+    """
+    match = ROOT_START_REGEX.search(html_content)
+    split_at = match.start() if match else len(html_content)
+    prolog, body = html_content[:split_at], html_content[split_at:]
+
+    body = ENTITY_REGEX.sub(_replace_html_entity, body)
+    try:
+        root = etree.fromstring(f'<{WRAPPER_TAG}>{body}</{WRAPPER_TAG}>', PARSER)
+    except etree.XMLSyntaxError as e:
+        raise MalformedDocument(str(e)) from e
+    return prolog, root
+
+
+def close_empty_elements(element):
+    """
+    Чтобы непустые по смыслу элементы без содержимого (якоря сносок <a id="n1"></a>, пустые <span>)
+    сериализовались с закрывающим тегом, а не как <a id="n1"/>, записывает в них пустой текст.
+
+    :param element: Элемент lxml-дерева: обрабатываются он сам и все вложенные элементы.
+    """
+    for empty in element.xpath('descendant-or-self::*[not(node())]'):
+        if etree.QName(empty).localname not in VOID_ELEMENTS:
+            empty.text = ''
+
+
+def serialize_html(prolog, root):
+    """
+    Сериализует документ, разобранный parse_html, обратно в строку.
+
+    :param prolog: Пролог документа.
+    :param root: Служебный корень с содержимым документа.
+    :return: Строка с HTML-контентом.
+    """
+    close_empty_elements(root)
+
+    parts = [prolog, escape(root.text or '')]
+    parts.extend(etree.tostring(child, encoding='unicode') for child in root)
+    return ''.join(parts)
+
+
+def _class_and_style(paragraph):
+    return paragraph.get('class', ''), paragraph.get('style', '')
+
+
+def _append_text(element, text):
+    """Дописывает текст в конец содержимого элемента."""
+    if len(element):
+        last = element[-1]
+        last.tail = (last.tail or '') + text
+    else:
+        element.text = (element.text or '') + text
+
+
+def _append_element(element, child):
+    """Переносит дочерний узел в конец содержимого элемента (без его хвостового текста)."""
+    child.tail = None
+    element.append(child)
+
+
+def _append_text_before(node, text):
+    """Дописывает текст перед узлом (в хвост предыдущего соседа или в текст родителя)."""
+    previous = node.getprevious()
+    if previous is not None:
+        previous.tail = (previous.tail or '') + text
+    else:
+        parent = node.getparent()
+        parent.text = (parent.text or '') + text
+
+
+def merge_adjacent_paragraphs_lxml(root):
+    """
+    Объединяет последовательные теги <p> с одинаковыми атрибутами class и style (см. merge_adjacent_paragraphs).
+
+    Как и версия для BeautifulSoup, работает за линейное время: абзацы за один проход группируются в серии
+    совместимых, затем содержимое каждой серии переносится в ее первый абзац (см. _merge_run).
+
+    :param root: Корень lxml-дерева.
+    :return: Количество абзацев, присоединенных к предыдущим.
+    """
+    # Абзац продолжает серию, если у него тот же родитель и те же class и style, что у первого абзаца серии
+    runs = []
+    run_key = None
+    for paragraph in root.iter(*PARAGRAPH_TAGS):
+        key = _class_and_style(paragraph)
+        if runs and key == run_key and paragraph.getparent() is runs[-1][0].getparent():
+            runs[-1].append(paragraph)
+        else:
+            runs.append([paragraph])
+            run_key = key
+
+    merged_count = 0
+    for run in runs:
+        if len(run) > 1:
+            _merge_run(run)
+            merged_count += len(run) - 1
+    return merged_count
+
+
+def _merge_run(run):
+    """
+    Переносит содержимое абзацев серии в ее первый абзац и удаляет остальные, сохраняя текст после них.
+
+    Текст, который дописывается к одному узлу, накапливается в списке и записывается один раз: повторная
+    конкатенация (как и len() элемента lxml, который перебирает детей) сделала бы объединение квадратичным.
+    """
+    head = run[0]
+    parent = head.getparent()
+    # Последний дочерний элемент первого абзаца и текст, который нужно записать после него
+    last = head[-1] if len(head) else None
+    inside = [(last.tail if last is not None else head.text) or '']
+    # Сосед, в хвост которого переносятся хвосты удаляемых абзацев, и накопленный для него текст
+    anchor, outside = None, []
+    for paragraph in run[1:]:
+        if paragraph.text:
+            inside.append(paragraph.text)
+        for child in list(paragraph):
+            tail = child.tail
+            _set_text_after(head, last, ''.join(inside))
+            _append_element(head, child)
+            last, inside = child, [tail or '']
+
+        if paragraph.tail:
+            # Перед абзацем серии всегда есть сосед: как минимум первый абзац серии
+            previous = paragraph.getprevious()
+            if previous is not anchor:
+                if anchor is not None:
+                    anchor.tail = ''.join(outside)
+                anchor, outside = previous, [previous.tail or '']
+            outside.append(paragraph.tail)
+        parent.remove(paragraph)
+
+    _set_text_after(head, last, ''.join(inside))
+    if anchor is not None:
+        anchor.tail = ''.join(outside)
+
+
+def _set_text_after(element, last, text):
+    """Записывает текст в конец содержимого элемента: в хвост его последнего дочернего элемента last или в текст."""
+    if last is not None:
+        last.tail = text or None
+    else:
+        element.text = text or None
+
+
+class ParagraphMarkup:
+    """
+    Разметка содержимого абзаца в том виде, в каком ее видит разбиватель предложений, и соответствие
+    ее участков узлам дерева: текстовым участкам (текст абзаца и хвосты дочерних элементов)
+    и дочерним элементам.
+    """
+
+    def __init__(self, paragraph):
+        parts = []
+        # Для каждого участка разметки: смещение начала, смещение конца,
+        # дочерний элемент (или None для текста), экранированный текст (или None для элемента)
+        self.segments = []
+        offset = 0
+
+        def add(markup, element):
+            nonlocal offset
+            if markup:
+                parts.append(markup)
+                self.segments.append((offset, offset + len(markup), element, None if element is not None else markup))
+                offset += len(markup)
+
+        add(escape(paragraph.text or ''), None)
+        for child in paragraph:
+            # Разбиватель предложений считает <a .../> незакрытым тегом, поэтому пустые элементы записываются
+            # с закрывающим тегом, как у BeautifulSoup и в serialize_html
+            if isinstance(child.tag, str):
+                close_empty_elements(child)
+            add(etree.tostring(child, encoding='unicode', with_tail=False), child)
+            add(escape(child.tail or ''), None)
+
+        self.html = ''.join(parts)
+        self.starts = [segment[0] for segment in self.segments]
+
+    def pieces(self, start, end):
+        """
+        Возвращает узлы, из которых состоит участок разметки [start, end): строки (текст)
+        и дочерние элементы.
+        """
+        i = max(bisect_right(self.starts, start) - 1, 0)
+        while i < len(self.segments):
+            segment_start, segment_end, element, markup = self.segments[i]
+            if segment_start >= end:
+                break
+            if element is None:
+                text = unescape(markup[max(start, segment_start) - segment_start:min(end, segment_end) - segment_start])
+                if text:
+                    yield text
+            elif start <= segment_start and segment_end <= end:
+                yield element
+            else:
+                raise CannotSplitParagraph()
+            i += 1
+
+
+def split_paragraph_lxml(paragraph, max_len, stats=NULL_STATS, segmenter=None, markup=None):
+    """
+    Разбивает абзац прямо в lxml-дереве: предложения группируются так же, как в движке BeautifulSoup,
+    дочерние элементы переносятся в новые абзацы целиком, а текстовые узлы режутся по границам предложений.
+
+    :param paragraph: Элемент <p>.
+    :param max_len: Максимальное количество слов в абзаце.
+    :param stats: ProcessingStats для замера времени этапов (см. stats.py).
+    :param segmenter: Правила разбиения на предложения для языка книги (см. segmenters.py) или None.
+    :param markup: ParagraphMarkup абзаца, если она уже построена (см. split_paragraphs_in_tree).
+    """
+    if markup is None:
+        start_time = stats.clock()
+        markup = ParagraphMarkup(paragraph)
+        stats.lap(STAGE_EXTRACT, start_time)
+    groups = plan_paragraph_split(markup.html, max_len, stats, segmenter)
+    if groups is None:
+        return
+    start_time = stats.clock()
+
+    # Сначала собираем содержимое новых абзацев, и только потом меняем дерево
+    try:
+        contents = [
+            [list(markup.pieces(start, end)) for start, end in group]
+            for group in groups
+        ]
+    except CannotSplitParagraph:
+        # Абзац остается как есть: в статистике видно, сколько таких абзацев
+        stats.lap(STAGE_REGROUP, start_time)
+        stats.count(COUNTER_PARAGRAPHS_UNSPLIT)
+        return
+
+    new_paragraphs = []
+    for sentences in contents:
+        new_paragraph = paragraph.makeelement(paragraph.tag, paragraph.attrib)
+        for k, pieces in enumerate(sentences):
+            # Предложения внутри абзаца разделяются одним пробелом
+            if k:
+                _append_text(new_paragraph, ' ')
+            for piece in pieces:
+                if isinstance(piece, str):
+                    _append_text(new_paragraph, piece)
+                else:
+                    _append_element(new_paragraph, piece)
+        new_paragraphs.append(new_paragraph)
+
+    # Новые абзацы встают на место старого, текст после старого абзаца остается после последнего нового
+    # (addnext, в отличие от parent.insert, не ищет позицию абзаца среди соседей)
+    new_paragraphs[-1].tail = paragraph.tail
+    paragraph.tail = None
+    for new_paragraph in reversed(new_paragraphs):
+        paragraph.addnext(new_paragraph)
+    paragraph.getparent().remove(paragraph)
+    stats.lap(STAGE_REGROUP, start_time)
+    if len(new_paragraphs) > 1:
+        stats.count(COUNTER_PARAGRAPHS_SPLIT)
+        stats.count(COUNTER_PARAGRAPHS_CREATED, len(new_paragraphs))
+
+
+def _text_length(element):
+    """Длина текста элемента (без хвостового текста), в тех же координатах, что и paragraph_text."""
+    if not isinstance(element.tag, str):
+        # Комментарии и инструкции обработки в текст абзаца не входят
+        return 0
+    return sum(len(text) for text in element.itertext())
+
+
+def paragraph_text(paragraph):
+    """
+    Текст абзаца без разметки: текстовые узлы абзаца и всех вложенных элементов в порядке документа.
+
+    Смещения в этой строке совпадают со смещениями в текстовых узлах дерева. Символ '<' заменяется
+    на символ той же длины, чтобы разбиватель предложений не принял текст за начало тега.
+    """
+    return ''.join(paragraph.itertext()).replace('<', '\ufffc')
+
+
+def split_element_at(element, position):
+    """
+    Разрезает элемент по смещению position в его тексте: все, что после смещения, переносится
+    в новый элемент с тем же тегом и атрибутами (клон обертки). Если смещение попадает внутрь
+    вложенного элемента, он разрезается рекурсивно.
+
+    Пустые элементы (<br/>, <img/>, пустые якоря), стоящие ровно на смещении, уходят во вторую часть.
+    Атрибут id остается только у первой части, чтобы в документе не появлялись повторяющиеся id.
+
+    :param element: Разрезаемый элемент (остается первой частью).
+    :param position: Смещение в тексте элемента.
+    :return: Новый элемент со второй частью содержимого (без хвостового текста).
+    """
+    right = element.makeelement(element.tag, {name: value for name, value in element.attrib.items() if name != 'id'})
+    children = list(element)
+
+    text = element.text or ''
+    if position <= len(text):
+        element.text, right.text = text[:position] or None, text[position:] or None
+        right.extend(children)
+        return right
+
+    offset = len(text)
+    for i, child in enumerate(children):
+        if position <= offset:
+            # Элемент начинается на месте разреза или после него
+            right.extend(children[i:])
+            return right
+
+        length = _text_length(child)
+        if position < offset + length:
+            # Разрез внутри вложенного элемента: режем и его, вторая часть забирает хвостовой текст
+            right_child = split_element_at(child, position - offset)
+            right_child.tail, child.tail = child.tail, None
+            right.append(right_child)
+            right.extend(children[i + 1:])
+            return right
+        offset += length
+
+        tail = child.tail or ''
+        if position < offset + len(tail):
+            child.tail, right.text = tail[:position - offset] or None, tail[position - offset:]
+            right.extend(children[i + 1:])
+            return right
+        offset += len(tail)
+
+    return right
+
+
+def _text_slots(element):
+    """Текстовые узлы элемента в порядке документа: пары (элемент, 'text' или 'tail')."""
+    if isinstance(element.tag, str):
+        yield element, 'text'
+        for child in element:
+            yield from _text_slots(child)
+            yield child, 'tail'
+
+
+def delete_text_range(element, start, end):
+    """
+    Удаляет из текстовых узлов элемента символы со смещениями [start, end). Вложенные элементы без id,
+    у которых после этого не осталось содержимого, удаляются (их хвостовой текст сохраняется).
+
+    :param element: Элемент.
+    :param start: Смещение начала удаляемого участка.
+    :param end: Смещение конца удаляемого участка.
+    """
+    emptied = []
+    offset = 0
+    for node, slot in list(_text_slots(element)):
+        if offset >= end:
+            break
+        text = getattr(node, slot) or ''
+        if text and offset + len(text) > start:
+            left, right = max(start - offset, 0), min(end - offset, len(text))
+            setattr(node, slot, text[:left] + text[right:] or None)
+            if slot == 'text' and node is not element and not node.text and not len(node) and node.get('id') is None:
+                emptied.append(node)
+        offset += len(text)
+
+    for node in emptied:
+        parent = node.getparent()
+        if node.tail:
+            _append_text_before(node, node.tail)
+        parent.remove(node)
+
+
+def split_paragraph_dom(paragraph, max_len, stats=NULL_STATS, segmenter=None, text=None):
+    """
+    Разбивает абзац по дереву, не сериализуя его: предложения ищутся в тексте абзаца без разметки,
+    а границы новых абзацев переводятся в смещения внутри текстовых узлов. Соседние узлы переносятся
+    в новые абзацы, а inline-обертки (<em>, <span>, ...), внутрь которых попала граница, клонируются.
+
+    В отличие от split_paragraph_lxml, граница может проходить внутри inline-элемента, а пробелы
+    внутри новых абзацев остаются такими же, как в исходном тексте (между абзацами они удаляются).
+
+    :param paragraph: Элемент <p>.
+    :param max_len: Максимальное количество слов в абзаце.
+    :param stats: ProcessingStats для замера времени этапов (см. stats.py).
+    :param segmenter: Правила разбиения на предложения для языка книги (см. segmenters.py) или None.
+    :param text: Текст абзаца (paragraph_text), если он уже получен (см. split_paragraphs_in_tree).
+    """
+    if text is None:
+        start_time = stats.clock()
+        text = paragraph_text(paragraph)
+        stats.lap(STAGE_EXTRACT, start_time)
+    groups = plan_paragraph_split(text, max_len, stats, segmenter)
+    if groups is None or len(groups) < 2:
+        return
+    start_time = stats.clock()
+
+    tail, paragraph.tail = paragraph.tail, None
+
+    # Режем с конца, чтобы смещения еще не обработанных границ оставались верными
+    new_paragraphs = []
+    for previous_group, group in reversed(list(zip(groups, groups[1:]))):
+        previous_end, start = previous_group[-1][1], group[0][0]
+        # Пробелы между последним предложением одного абзаца и первым предложением следующего не нужны
+        delete_text_range(paragraph, previous_end, start)
+        new_paragraphs.append(split_element_at(paragraph, previous_end))
+
+    # Вторые части собраны с конца, поэтому addnext вставляет их в правильном порядке
+    new_paragraphs[0].tail = tail
+    for new_paragraph in new_paragraphs:
+        paragraph.addnext(new_paragraph)
+    stats.lap(STAGE_REGROUP, start_time)
+    stats.count(COUNTER_PARAGRAPHS_SPLIT)
+    stats.count(COUNTER_PARAGRAPHS_CREATED, len(groups))
+
+
+def paragraph_content(paragraph, split_paragraph=split_paragraph_lxml):
+    """
+    Содержимое абзаца, которое разбивает функция split_paragraph (передается ей последним аргументом):
+    ParagraphMarkup для split_paragraph_lxml или текст без разметки для split_paragraph_dom.
+    """
+    if split_paragraph is split_paragraph_dom:
+        return paragraph_text(paragraph)
+    return ParagraphMarkup(paragraph)
+
+
+def split_paragraphs_in_tree(root, max_len=10, merge_before_splitting=False, split_paragraph=split_paragraph_lxml,
+                             stats=NULL_STATS, segmenter=None):
+    """
+    Разбивает абзацы в уже разобранном lxml-дереве (документе EPUB или документе книги calibre, см. oeb_transform.py).
+
+    :param root: Корень lxml-дерева.
+    :param max_len: Максимальное количество слов в абзаце.
+    :param merge_before_splitting: Признак того, что необходимо объединить абзацы в один перед дальнейшим разбиением.
+    :param split_paragraph: Функция разбиения абзаца: split_paragraph_lxml (по разметке, как движок BeautifulSoup)
+                            или split_paragraph_dom (по тексту, с клонированием inline-оберток).
+    :param stats: ProcessingStats для замера времени этапов (см. stats.py).
+    :param segmenter: Правила разбиения на предложения для языка книги (см. segmenters.py) или None.
+    """
+    if merge_before_splitting:
+        start_time = stats.clock()
+        stats.count(COUNTER_PARAGRAPHS_MERGED, merge_adjacent_paragraphs_lxml(root))
+        stats.lap(STAGE_MERGE, start_time)
+
+    paragraphs = list(root.iter(*PARAGRAPH_TAGS))
+    stats.count(COUNTER_PARAGRAPHS, len(paragraphs))
+    # Как и в process_document, абзацы, которые точно не нужно разбивать, отсекаются одной оценкой сверху
+    # количества слов сразу во всех абзацах документа (см. word_counts.py)
+    start_time = stats.clock()
+    contents = [paragraph_content(paragraph, split_paragraph) for paragraph in paragraphs]
+    start_time = stats.lap(STAGE_EXTRACT, start_time)
+    words_upper_bounds = count_word_starts([content.html if isinstance(content, ParagraphMarkup) else content
+                                            for content in contents])
+    stats.lap(STAGE_TOKENIZE, start_time)
+    for paragraph, content, words_upper_bound in zip(paragraphs, contents, words_upper_bounds):
+        if words_upper_bound > max_len:
+            split_paragraph(paragraph, max_len, stats, segmenter, content)
+
+
+def process_epub_html_lxml(html_content, max_len=10, merge_before_splitting=False, split_paragraph=split_paragraph_lxml,
+                           stats=NULL_STATS, segmenter=None):
+    """
+    Обрабатывает HTML-контент EPUB-файла так же, как process_epub_html, но на lxml-дереве.
+
+    :param html_content: Строка с HTML-контентом EPUB-файла.
+    :param max_len: Максимальное количество слов в абзаце.
+    :param merge_before_splitting: Признак того, что необходимо объединить абзацы в один перед дальнейшим разбиением.
+    :param split_paragraph: Функция разбиения абзаца: split_paragraph_lxml (по разметке, как движок BeautifulSoup)
+                            или split_paragraph_dom (по тексту, с клонированием inline-оберток).
+    :param stats: ProcessingStats для замера времени этапов (см. stats.py).
+    :param segmenter: Правила разбиения на предложения для языка книги (см. segmenters.py) или None.
+    :return: Обновлённый HTML-контент с разбитыми абзацами.
+    :raises MalformedDocument: Если документ не является корректным XML.
+    """
+    start_time = stats.clock()
+    prolog, root = parse_html(html_content)
+    stats.lap(STAGE_PARSE, start_time)
+
+    split_paragraphs_in_tree(root, max_len, merge_before_splitting, split_paragraph, stats, segmenter)
+
+    start_time = stats.clock()
+    html_content = serialize_html(prolog, root)
+    stats.lap(STAGE_SERIALIZE, start_time)
+    return html_content
@@ -0,0 +1,189 @@
+import unittest
+
+from unittest import mock
+
+from epub_split import *
+from lxml_split import *
+from stats import ProcessingStats, COUNTER_PARSE_FALLBACKS, COUNTER_PARAGRAPHS_UNSPLIT
+
+XHTML_DOCUMENT = '''<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title>Глава 1</title></head>
+<body>
+<h1>Глава 1</h1>
+<p class="text">Князь Андрей посмотрел на небо. Он ничего не ответил. Мы посетили ул. Ленина и г. Москву, а потом вернулись домой. Никто не знает&nbsp;зачем.</p>
+<p>Она читала <i>«Войну и мир»</i> уже третий раз. Это была ее любимая книга.<br/> После этого она уснула.</p>
+</body>
+</html>'''
+
+
+class TestProcessEpubHtmlLxml(unittest.TestCase):
+    def assertSameAsBs4(self, html_content, max_len, merge_before_splitting=False):
+        expected = process_epub_html(html_content, max_len, merge_before_splitting, engine=ENGINE_BS4)
+        result = process_epub_html(html_content, max_len, merge_before_splitting, engine=ENGINE_LXML)
+        self.assertEqual(result, expected)
+        return result
+
+    def test_short_paragraph(self):
+        result = self.assertSameAsBs4('<p>Это короткий абзац с небольшим количеством слов.</p>', 20)
+        self.assertEqual(result, '<p>Это короткий абзац с небольшим количеством слов.</p>')
+
+    def test_long_paragraph_split(self):
+        html_content = '<p>Это очень длинный абзац, который содержит много предложений. Первое предложение. Второе предложение, которое немного длиннее первого. Третье предложение с некоторым количеством слов. Четвёртое предложение, которое, возможно, превысит лимит строк. Пятое и последнее предложение в этом абзаце.</p>'
+        result = self.assertSameAsBs4(html_content, 20)
+        self.assertGreater(result.count('<p>'), 1)
+
+    def test_paragraph_with_tags(self):
+        html_content = '<p>Текст с <b>жирным</b> и <i>курсивом</i>. Это предложение должно быть вместе с предыдущим. А это уже нет.</p>'
+        result = self.assertSameAsBs4(html_content, 5)
+        self.assertIn('<b>жирным</b>', result)
+        self.assertIn('<i>курсивом</i>', result)
+
+    def test_empty_anchor(self):
+        # Пустой якорь сноски не должен выглядеть для разбивателя предложений как незакрытый тег <a id="n1"/>
+        html_content = ('<p>Один два три четыре. <a id="n1"></a>Пять шесть семь восемь. '
+                        'Девять десять одиннадцать двенадцать. <span class="x"><span></span></span>Тринадцать.</p>')
+        result = self.assertSameAsBs4(html_content, 4)
+        self.assertEqual(result.count('<p>'), 4)
+        self.assertIn('<a id="n1"></a>', result)
+
+    def test_paragraph_with_attributes(self):
+        html_content = '<p class="text">Абзац с атрибутом класса. Длинный текст, который должен быть разбит на несколько абзацев.</p>'
+        result = self.assertSameAsBs4(html_content, 4)
+        self.assertEqual(result.count('<p class="text">'), 2)
+
+    def test_no_paragraphs(self):
+        result = self.assertSameAsBs4('<div>Текст без тегов абзацев.</div>', 20)
+        self.assertEqual(result, '<div>Текст без тегов абзацев.</div>')
+
+    def test_xhtml_document(self):
+        for max_len in (3, 10, 20):
+            for merge_before_splitting in (False, True):
+                self.assertSameAsBs4(XHTML_DOCUMENT, max_len, merge_before_splitting)
+
+    def test_prolog_is_kept(self):
+        result = process_epub_html(XHTML_DOCUMENT, 5, engine=ENGINE_LXML)
+        self.assertTrue(result.startswith('<?xml version="1.0" encoding="utf-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml">'))
+
+    def test_malformed_document_is_parsed_by_bs4(self):
+        # Восстанавливая такой документ, lxml потерял бы текст после незакрытого тега
+        html_content = '<p>Раз два три. Четыре <b>пять шесть. Семь восемь девять.</p><p>Десять одиннадцать.</p>'
+        with self.assertRaises(MalformedDocument):
+            parse_html(html_content)
+        stats = ProcessingStats()
+        with self.assertLogs(level='WARNING'):
+            result = process_epub_html(html_content, 3, engine=ENGINE_LXML, stats=stats)
+        self.assertEqual(result, process_epub_html(html_content, 3, engine=ENGINE_BS4))
+        self.assertEqual(stats.counters[COUNTER_PARSE_FALLBACKS], 1)
+
+    def test_unsupported_engine(self):
+        with self.assertRaises(ValueError):
+            process_epub_html('<p>Текст.</p>', engine='html5lib')
+
+
+class TestMergeAdjacentParagraphsLxml(unittest.TestCase):
+    def test_merge_same_attributes(self):
+        prolog, root = parse_html('<div><p class="a">Первый <b>абзац</b>.</p>\n<p class="a">Второй абзац.</p><p class="b">Третий.</p></div>')
+        merge_adjacent_paragraphs_lxml(root)
+        self.assertEqual(
+            serialize_html(prolog, root),
+            '<div><p class="a">Первый <b>абзац</b>.Второй абзац.</p>\n<p class="b">Третий.</p></div>'
+        )
+
+    def test_no_merge_different_levels(self):
+        html_content = '<div><p>Первый.</p><div><p>Второй.</p></div></div>'
+        prolog, root = parse_html(html_content)
+        merge_adjacent_paragraphs_lxml(root)
+        self.assertEqual(serialize_html(prolog, root), html_content)
+
+    def test_merge_long_run(self):
+        # Вся серия переносится в первый абзац, текст и элементы между абзацами остаются на месте
+        prolog, root = parse_html('<div><p>0</p>\n<p>1<i>и</i>.</p>\n<img/>т<p><b>2</b></p>\n<p></p>\n<p>3</p></div>')
+        self.assertEqual(merge_adjacent_paragraphs_lxml(root), 4)
+        self.assertEqual(
+            serialize_html(prolog, root),
+            '<div><p>01<i>и</i>.<b>2</b>3</p>\n\n<img/>т\n\n</div>'
+        )
+
+
+class TestSplitParagraphLxml(unittest.TestCase):
+    def test_inline_elements_are_moved(self):
+        prolog, root = parse_html('<p>Один <a href="#n1">два</a> три. Четыре <i>пять</i> шесть.</p>')
+        split_paragraph_lxml(root[0], 3)
+        self.assertEqual(
+            serialize_html(prolog, root),
+            '<p>Один <a href="#n1">два</a> три.</p><p>Четыре <i>пять</i> шесть.</p>'
+        )
+
+    def test_tail_after_paragraph_is_kept(self):
+        prolog, root = parse_html('<div><p>Один два три. Четыре пять шесть.</p>\n</div>')
+        split_paragraph_lxml(root[0][0], 3)
+        self.assertEqual(serialize_html(prolog, root), '<div><p>Один два три.</p><p>Четыре пять шесть.</p>\n</div>')
+
+    def test_unsplit_paragraph_is_counted(self):
+        prolog, root = parse_html('<p>Один два три. Четыре пять шесть.</p>')
+        stats = ProcessingStats()
+        with mock.patch.object(ParagraphMarkup, 'pieces', side_effect=CannotSplitParagraph):
+            split_paragraph_lxml(root[0], 3, stats)
+        self.assertEqual(serialize_html(prolog, root), '<p>Один два три. Четыре пять шесть.</p>')
+        self.assertEqual(stats.counters[COUNTER_PARAGRAPHS_UNSPLIT], 1)
+
+
+
+class TestSplitParagraphsInTree(unittest.TestCase):
+    def test_short_paragraphs_are_not_split(self):
+        # Абзацы, в которых даже оценка сверху количества слов не больше max_len, не передаются разбиению
+        prolog, root = parse_html('<p>Один два три.</p><p>Четыре <b>пять</b>. Шесть семь.</p>')
+        split_paragraph = mock.Mock()
+        split_paragraphs_in_tree(root, 3, split_paragraph=split_paragraph)
+        self.assertEqual([call.args[0] for call in split_paragraph.call_args_list], [root[1]])
+        self.assertEqual(split_paragraph.call_args.args[4].html, 'Четыре <b>пять</b>. Шесть семь.')
+
+    def test_paragraph_content(self):
+        prolog, root = parse_html('<p>Четыре <b>пять</b>. Шесть семь.</p>')
+        self.assertEqual(paragraph_content(root[0], split_paragraph_lxml).html, 'Четыре <b>пять</b>. Шесть семь.')
+        self.assertEqual(paragraph_content(root[0], split_paragraph_dom), 'Четыре пять. Шесть семь.')
+
+class TestSplitParagraphDom(unittest.TestCase):
+    def split(self, html_content, max_len):
+        return process_epub_html(html_content, max_len, engine=ENGINE_LXML_DOM)
+
+    def test_boundary_inside_inline_element(self):
+        self.assertEqual(
+            self.split('<p>Один два три. <em>Четыре пять шесть. Семь восемь девять.</em> Десять.</p>', 3),
+            '<p>Один два три.</p><p><em>Четыре пять шесть.</em></p><p><em>Семь восемь девять.</em></p><p>Десять.</p>'
+        )
+
+    def test_nested_wrappers_are_cloned_without_id(self):
+        self.assertEqual(
+            self.split('<p id="p1" class="c">Один <span id="s" class="k">два три. Четыре <b>пять шесть. Семь</b></span></p>', 3),
+            '<p id="p1" class="c">Один <span id="s" class="k">два три.</span></p>'
+            '<p class="c"><span class="k">Четыре <b>пять шесть.</b></span></p>'
+            '<p class="c"><span class="k"><b>Семь</b></span></p>'
+        )
+
+    def test_whitespace_between_paragraphs_is_removed(self):
+        self.assertEqual(
+            self.split('<div><p>Один два три.<span> </span> Четыре  пять\nшесть.</p>\n</div>', 3),
+            '<div><p>Один два три.</p><p>Четыре  пять\nшесть.</p>\n</div>'
+        )
+
+    def test_escaped_text(self):
+        self.assertEqual(
+            self.split('<p>Один &lt; два &amp; три. Четыре пять шесть.</p>', 3),
+            '<p>Один &lt; два &amp; три.</p><p>Четыре пять шесть.</p>'
+        )
+
+    def test_empty_elements_go_to_next_paragraph(self):
+        self.assertEqual(
+            self.split('<p>Один два три.<br/>Четыре пять шесть.</p>', 3),
+            '<p>Один два три.</p><p><br/>Четыре пять шесть.</p>'
+        )
+
+    def test_short_paragraph_is_untouched(self):
+        html_content = '<p>Один <em>два</em>  три.</p>'
+        self.assertEqual(self.split(html_content, 10), html_content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+Разбиение абзацев во время конвертации calibre: на дереве книги (OEBBook), а не в записанном файле.
+
+При постобработке (on_postprocess) calibre уже записал книгу, и плагину приходится распаковывать архив,
+заново разбирать документы, сериализовать их и запаковывать архив обратно. В режиме преобразования абзацы
+разбиваются в документах spine книги calibre (item.data - уже разобранное lxml-дерево) так же, как это
+делают преобразования из calibre.ebooks.oeb.transforms, перед тем как плагин вывода запишет книгу:
+без лишнего разбора и записи архива и для любого формата вывода, который calibre собирает из OEB.
+Для форматов без своего обработчика файла (MOBI, AZW3, DOCX, FB2) это единственный способ разбиения:
+один разбор для всех форматов вместо распаковки и разбора каждого контейнера отдельно.
+
+Точки расширения для своих преобразований в конвейере конвертации (Plumber) нет, а в zip-плагине может
+быть только один класс плагина, поэтому преобразование встраивается в метод convert встроенных плагинов
+вывода (install_transform вызывается из initialize плагина, в том числе в рабочих процессах конвертации).
+"""
+import functools
+
+from lxml import etree
+
+try:
+    from .epub_split import ENGINE_LXML, ENGINE_LXML_DOM
+    from .lxml_split import split_paragraphs_in_tree
+    from .stats import NULL_STATS, COUNTER_DOCUMENTS
+    from .splitter_context import SplitterContext
+except ImportError:
+    from epub_split import ENGINE_LXML, ENGINE_LXML_DOM
+    from lxml_split import split_paragraphs_in_tree
+    from stats import NULL_STATS, COUNTER_DOCUMENTS
+    from splitter_context import SplitterContext
+
+# Режимы работы плагина: разбиение в записанном файле после конвертации или в дереве книги во время конвертации
+MODE_POSTPROCESS = 'postprocess'
+MODE_TRANSFORM = 'transform'
+
+# Форматы, которые плагин умеет обрабатывать в записанном файле (в режиме MODE_POSTPROCESS)
+POSTPROCESS_FILE_TYPES = frozenset(['epub', 'txt'])
+
+# Форматы, абзацы в которых разбиваются только в дереве книги во время конвертации (в любом режиме):
+# для них нет своего обработчика файла, а calibre собирает их из того же OEB
+OEB_FILE_TYPES = frozenset(['azw3', 'mobi', 'docx', 'fb2'])
+
+# Признак обернутого метода convert плагина вывода
+WRAPPED_ATTRIBUTE = '_paragraphs_plugin_wrapped'
+
+# Признак книги, абзацы в которой уже разбиты (плагины вывода, например TXTZ, вызывают convert родительского класса)
+SPLIT_ATTRIBUTE = '_paragraphs_plugin_split'
+
+
+class SplitParagraphs:
+    """
+    Преобразование книги calibre: разбивает длинные абзацы в документах spine.
+
+    Движок BeautifulSoup работает со строкой, а не с деревом, поэтому вместо него используется движок lxml
+    (его результат совпадает с результатом движка BeautifulSoup, см. lxml_split.py).
+    """
+
+    def __init__(self, max_len=10, merge_before_splitting=False, engine=ENGINE_LXML, stats=NULL_STATS,
+                 abbreviations=None, conditional_abbreviations=None):
+        """
+        :param max_len: Максимальное количество слов в абзаце.
+        :param merge_before_splitting: Признак того, что необходимо объединить абзацы в один перед дальнейшим разбиением.
+        :param engine: Движок разбиения абзацев (ENGINE_LXML_DOM - разбиение по дереву, остальные - по разметке).
+        :param stats: ProcessingStats для замера времени этапов и счетчиков (см. stats.py).
+        :param abbreviations: Пользовательские безусловные сокращения (см. segmenters.py) или None.
+        :param conditional_abbreviations: Пользовательские условные сокращения (см. segmenters.py) или None.
+        """
+        self.max_len = max_len
+        self.merge_before_splitting = merge_before_splitting
+        self.engine = ENGINE_LXML_DOM if engine == ENGINE_LXML_DOM else ENGINE_LXML
+        self.stats = stats
+        self.abbreviations = abbreviations
+        self.conditional_abbreviations = conditional_abbreviations
+
+    def make_context(self, language=None):
+        """
+        Настройки разбиения для книги на языке language (см. splitter_context.py).
+
+        :param language: Код языка книги или None.
+        :return: SplitterContext.
+        """
+        return SplitterContext.for_book(self.max_len, self.merge_before_splitting, self.engine, language,
+                                        self.abbreviations, self.conditional_abbreviations)
+
+    def split_document(self, root, context=None):
+        """
+        Разбивает абзацы в документе книги.
+
+        :param root: Корень lxml-дерева документа (элемент html).
+        :param context: SplitterContext книги (по умолчанию - без учета языка книги).
+        """
+        context = context or self.make_context()
+        split_paragraphs_in_tree(root, context.max_len, context.merge_before_splitting, context.split_paragraph,
+                                 self.stats, context.segmenter)
+        self.stats.count(COUNTER_DOCUMENTS)
+
+    def __call__(self, oeb, opts=None):
+        # Настройки и правила для языка книги собираются один раз на все документы
+        context = self.make_context(book_language(oeb))
+        for item in oeb.spine:
+            # Необязательные для чтения документы (linear="no") не обрабатываются, как и в find_spine_documents
+            if getattr(item, 'linear', True) and etree.iselement(item.data):
+                self.split_document(item.data, context)
+
+
+def book_language(oeb):
+    """
+    Язык книги calibre: первый элемент language в метаданных (как в calibre.ebooks.oeb.transforms.htmltoc).
+
+    :param oeb: Книга calibre (OEBBook).
+    :return: Код языка или None.
+    """
+    languages = getattr(getattr(oeb, 'metadata', None), 'language', None)
+    return str(languages[0]) if languages else None
+
+
+def transform_needed(file_type, mode, disabled=False, file_types=None):
+    """
+    Нужно ли разбивать абзацы в дереве книги при конвертации в формат file_type.
+
+    install_transform вызывается из initialize, а calibre вызывает initialize и у отключенных плагинов,
+    поэтому включен ли плагин, проверяется при каждой конвертации.
+
+    :param file_type: Формат вывода.
+    :param mode: Режим работы плагина (MODE_POSTPROCESS или MODE_TRANSFORM).
+    :param disabled: Признак того, что плагин отключен пользователем.
+    :param file_types: Форматы плагина или None (любой формат).
+    :return: Признак того, что нужно преобразование (False - не нужно или книга будет обработана при постобработке).
+    """
+    if disabled or (file_types is not None and file_type not in file_types):
+        return False
+    # EPUB и TXT в режиме постобработки обрабатываются в записанном файле, остальные форматы - только здесь
+    return file_type not in POSTPROCESS_FILE_TYPES or mode == MODE_TRANSFORM
+
+
+def wrap_convert(convert, make_transform, file_type=None):
+    """
+    Оборачивает метод convert плагина вывода: перед записью книги к ней применяется преобразование.
+
+    :param convert: Исходный метод convert(self, oeb, output_path, input_plugin, opts, log).
+    :param make_transform: Функция make_transform(file_type, output_path, log), которая возвращает
+                           преобразование transform(oeb, opts) или None (преобразование не нужно).
+    :param file_type: Формат плагина, чей метод оборачивается. Наследники (например, TXTZ) вызывают
+                      convert родительского класса со своим self.file_type, поэтому формат берется отсюда,
+                      а self.file_type - только если формат не передан.
+    :return: Обернутый метод.
+    """
+    @functools.wraps(convert)
+    def wrapper(self, oeb, output_path, input_plugin, opts, log):
+        if not getattr(oeb, SPLIT_ATTRIBUTE, False):
+            transform = make_transform(file_type or self.file_type, output_path, log)
+            if transform is not None:
+                # Ошибка разбиения не должна прерывать конвертацию (как и ошибка при постобработке)
+                try:
+                    transform(oeb, opts)
+                except Exception as e:
+                    log.exception(f"[Split paragraphs plugin] An error occurred: {e}")
+                setattr(oeb, SPLIT_ATTRIBUTE, True)
+        return convert(self, oeb, output_path, input_plugin, opts, log)
+
+    setattr(wrapper, WRAPPED_ATTRIBUTE, True)
+    return wrapper
+
+
+def install_transform(file_types, make_transform):
+    """
+    Встраивает преобразование в конвейер конвертации calibre: оборачивает метод convert встроенных
+    плагинов вывода форматов file_types (см. wrap_convert). Повторный вызов ничего не меняет.
+
+    :param file_types: Форматы вывода ('epub', 'txt', ...).
+    :param make_transform: См. wrap_convert.
+    """
+    from calibre.customize.builtins import plugins
+    from calibre.customize.conversion import OutputFormatPlugin
+
+    for plugin_class in plugins:
+        if (isinstance(plugin_class, type) and issubclass(plugin_class, OutputFormatPlugin)
+                and plugin_class.file_type in file_types
+                and not getattr(plugin_class.convert, WRAPPED_ATTRIBUTE, False)):
+            plugin_class.convert = wrap_convert(plugin_class.convert, make_transform, plugin_class.file_type)
@@ -0,0 +1,151 @@
+import unittest
+
+from lxml import etree
+
+from oeb_transform import *
+from lxml_split import process_epub_html_lxml
+from stats import ProcessingStats
+
+
+def make_document(body):
+    return etree.fromstring(f'<html xmlns="http://www.w3.org/1999/xhtml"><body>{body}</body></html>')
+
+
+class FakeItem:
+    """Документ книги calibre: item.data - lxml-дерево документа."""
+
+    def __init__(self, data, linear=True):
+        self.data = data
+        self.linear = linear
+
+
+class FakeBook:
+    def __init__(self, *items):
+        self.spine = list(items)
+
+
+class FakeLog:
+    def __init__(self):
+        self.messages = []
+
+    def exception(self, message):
+        self.messages.append(message)
+
+
+def body_html(root):
+    body = root[0]
+    return ''.join(etree.tostring(child, encoding='unicode', with_tail=True) for child in body)
+
+
+class TestSplitParagraphs(unittest.TestCase):
+    CHAPTER = '<p>Один два три. Четыре <em>пять</em> шесть. Семь восемь девять.</p><p class="a">Десять.</p>'
+
+    def test_split_spine_documents(self):
+        chapter = make_document(self.CHAPTER)
+        notes = make_document(self.CHAPTER)
+        stats = ProcessingStats()
+        SplitParagraphs(max_len=3, stats=stats)(FakeBook(FakeItem(chapter), FakeItem(notes, linear=False)))
+
+        self.assertEqual(body_html(chapter).count('<p'), 4)
+        self.assertIn('<em>пять</em>', body_html(chapter))
+        # Необязательные для чтения документы не обрабатываются
+        self.assertEqual(body_html(notes).count('<p'), 2)
+        self.assertEqual(stats.counters['documents'], 1)
+        self.assertEqual(stats.counters['paragraphs split'], 1)
+
+    def test_same_result_as_epub_engine(self):
+        chapter = make_document(self.CHAPTER)
+        SplitParagraphs(max_len=3, merge_before_splitting=True)(FakeBook(FakeItem(chapter)))
+        expected = process_epub_html_lxml(self.CHAPTER, max_len=3, merge_before_splitting=True)
+        self.assertEqual(body_html(chapter).replace(' xmlns="http://www.w3.org/1999/xhtml"', ''), expected)
+
+
+class TestTransformNeeded(unittest.TestCase):
+    def test_mode(self):
+        self.assertFalse(transform_needed('epub', MODE_POSTPROCESS))
+        self.assertTrue(transform_needed('epub', MODE_TRANSFORM))
+        # Для форматов без обработчика файла - в любом режиме
+        self.assertTrue(transform_needed('mobi', MODE_POSTPROCESS))
+
+    def test_unsupported_file_type(self):
+        self.assertFalse(transform_needed('txtz', MODE_POSTPROCESS, file_types={'epub', 'txt'}))
+        self.assertTrue(transform_needed('txt', MODE_TRANSFORM, file_types={'epub', 'txt'}))
+
+    def test_disabled_plugin(self):
+        for file_type in ('epub', 'mobi'):
+            self.assertFalse(transform_needed(file_type, MODE_TRANSFORM, disabled=True))
+
+
+class TestWrapConvert(unittest.TestCase):
+    def make_plugin_class(self, make_transform):
+        class OutputPlugin:
+            file_type = 'epub'
+            written = []
+
+            def convert(self, oeb, output_path, input_plugin, opts, log):
+                self.written.append(body_html(oeb.spine[0].data))
+
+        class ZipOutputPlugin(OutputPlugin):
+            # Как TXTZ: convert вызывает convert родительского класса
+            def convert(self, oeb, output_path, input_plugin, opts, log):
+                OutputPlugin.convert(self, oeb, output_path, input_plugin, opts, log)
+
+        OutputPlugin.convert = wrap_convert(OutputPlugin.convert, make_transform)
+        ZipOutputPlugin.convert = wrap_convert(ZipOutputPlugin.convert, make_transform)
+        return OutputPlugin, ZipOutputPlugin
+
+    def test_transform_before_output(self):
+        calls = []
+
+        def make_transform(file_type, output_path, log):
+            calls.append((file_type, output_path))
+            return SplitParagraphs(max_len=3)
+
+        _, plugin_class = self.make_plugin_class(make_transform)
+        book = FakeBook(FakeItem(make_document(TestSplitParagraphs.CHAPTER)))
+        plugin_class().convert(book, 'book.epub', None, None, FakeLog())
+        # Преобразование применяется к книге один раз
+        self.assertEqual(calls, [('epub', 'book.epub')])
+        self.assertEqual(plugin_class.written[0].count('<p'), 4)
+        self.assertTrue(getattr(plugin_class.convert, WRAPPED_ATTRIBUTE))
+
+    def test_file_type_of_wrapped_class(self):
+        # Как TXTZ: наследник со своим форматом вызывает обернутый convert родительского класса
+        calls = []
+
+        def make_transform(file_type, output_path, log):
+            calls.append(file_type)
+
+        class OutputPlugin:
+            file_type = 'txt'
+
+            def convert(self, oeb, output_path, input_plugin, opts, log):
+                pass
+
+        class ZipOutputPlugin(OutputPlugin):
+            file_type = 'txtz'
+
+        OutputPlugin.convert = wrap_convert(OutputPlugin.convert, make_transform, OutputPlugin.file_type)
+        ZipOutputPlugin().convert(FakeBook(), 'book.txtz', None, None, FakeLog())
+        self.assertEqual(calls, ['txt'])
+
+    def test_no_transform(self):
+        plugin_class, _ = self.make_plugin_class(lambda file_type, output_path, log: None)
+        book = FakeBook(FakeItem(make_document(TestSplitParagraphs.CHAPTER)))
+        plugin_class().convert(book, 'book.epub', None, None, FakeLog())
+        self.assertEqual(plugin_class.written[0].count('<p'), 2)
+
+    def test_error_does_not_stop_conversion(self):
+        def transform(oeb, opts):
+            raise ValueError('broken')
+
+        plugin_class, _ = self.make_plugin_class(lambda file_type, output_path, log: transform)
+        log = FakeLog()
+        book = FakeBook(FakeItem(make_document(TestSplitParagraphs.CHAPTER)))
+        plugin_class().convert(book, 'book.epub', None, None, log)
+        self.assertEqual(len(plugin_class.written), 1)
+        self.assertIn('broken', log.messages[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
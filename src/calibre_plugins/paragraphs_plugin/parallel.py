@@ -0,0 +1,126 @@
+"""
+Параллельная обработка независимых документов книги (или независимых книг) в пуле процессов.
+
+Разбиение абзацев написано на чистом Python и упирается в процессор, поэтому потоки не помогают
+(GIL), а процессы - помогают. Внутри calibre используется его собственный пул рабочих процессов
+(calibre.utils.ipc.pool.Pool): в собранном calibre свой интерпретатор, и multiprocessing в нем
+работает не везде. Вне calibre (запуск из командной строки) используется ProcessPoolExecutor.
+"""
+import os
+
+from queue import Empty
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def cpu_count():
+    """Количество процессоров (не меньше 1)."""
+    return os.cpu_count() or 1
+
+
+def resolve_workers(workers):
+    """
+    Приводит настройку количества рабочих процессов к числу: 0 (или None) означает
+    "по количеству процессоров".
+
+    :param workers: Количество процессов из настроек.
+    :return: Количество процессов (не меньше 1).
+    """
+    return max(workers or cpu_count(), 1)
+
+
+def map_in_processes(func, args_list, workers):
+    """
+    Вызывает func(*args) для каждого набора аргументов в пуле из workers процессов.
+
+    Результаты возвращаются в порядке args_list, независимо от того, в каком порядке
+    рабочие процессы закончили работу, поэтому результат детерминирован.
+
+    :param func: Функция уровня модуля (рабочий процесс импортирует ее по имени модуля).
+    :param args_list: Список кортежей аргументов.
+    :param workers: Количество рабочих процессов.
+    :return: Список результатов.
+    """
+    results = [None] * len(args_list)
+    for index, result in imap_in_processes(func, args_list, workers):
+        results[index] = result
+    return results
+
+
+def imap_in_processes(func, args_list, workers):
+    """
+    Как map_in_processes, но отдает результаты по мере готовности: пары (индекс набора аргументов, результат)
+    в порядке завершения задач. Нужно, когда результаты стоит показывать или сохранять, не дожидаясь
+    окончания всех задач (например, при пакетной обработке книг).
+
+    :param func: Функция уровня модуля (рабочий процесс импортирует ее по имени модуля).
+    :param args_list: Список кортежей аргументов.
+    :param workers: Количество рабочих процессов.
+    :return: Итератор пар (индекс, результат).
+    """
+    workers = min(workers, len(args_list))
+    if workers <= 1:
+        for index, args in enumerate(args_list):
+            yield index, func(*args)
+        return
+
+    # Внутри calibre модули плагина импортируются из zip-файла плагина как calibre_plugins.<имя>
+    if func.__module__.startswith('calibre_plugins.'):
+        yield from _imap_in_calibre_pool(func, args_list, workers)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(func, *args): index for index, args in enumerate(args_list)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+# Интервал (в секундах), с которым при ожидании результата проверяется, не сломался ли пул calibre
+RESULT_POLL_INTERVAL = 1
+
+# Код модуля, который выполняет рабочий процесс calibre: модули плагина становятся доступны для импорта
+# только после загрузки плагинов
+CALIBRE_WORKER_SOURCE = '''
+from calibre.customize.ui import initialized_plugins
+initialized_plugins()
+from {module} import {func}
+'''
+
+
+def _terminal_failure_message(pool, worker_result=None):
+    """Описание аварии пула calibre (pool.terminal_failure) или задачи, которая на ней прервалась."""
+    failure = pool.terminal_failure
+    if failure is not None:
+        return f"Worker pool failed: {failure.message}\n{failure.tb or ''}"
+    result = worker_result.result
+    return f"Worker process crashed while processing task #{worker_result.id}: {result.err}\n{result.traceback or ''}"
+
+
+def _imap_in_calibre_pool(func, args_list, workers):
+    """imap_in_processes на пуле рабочих процессов calibre."""
+    from calibre.utils.ipc.pool import Pool
+
+    source = CALIBRE_WORKER_SOURCE.format(module=func.__module__, func=func.__name__)
+    pool = Pool(max_workers=workers, name='SplitParagraphsPlugin')
+    try:
+        # Номер задачи - индекс набора аргументов, по нему результаты сопоставляются с аргументами
+        for job_id, args in enumerate(args_list):
+            pool(job_id, source, func.__name__, *args)
+
+        for _ in range(len(args_list)):
+            while True:
+                try:
+                    # WorkerResult(id, result, is_terminal_failure, worker), где result - Result(value, err, traceback)
+                    worker_result = pool.results.get(timeout=RESULT_POLL_INTERVAL)
+                    break
+                except Empty:
+                    # Если пул сломался (например, рабочий процесс аварийно завершился), результата не будет
+                    if pool.failed:
+                        raise RuntimeError(_terminal_failure_message(pool))
+            if worker_result.is_terminal_failure:
+                raise RuntimeError(_terminal_failure_message(pool, worker_result))
+            result = worker_result.result
+            if result.err:
+                raise RuntimeError(f"Worker failed to process task #{worker_result.id}: {result.err}\n{result.traceback}")
+            yield worker_result.id, result.value
+    finally:
+        pool.shutdown()
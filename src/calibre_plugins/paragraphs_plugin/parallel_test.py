@@ -0,0 +1,134 @@
+import sys
+import types
+import unittest
+import collections
+import contextlib
+
+from queue import Queue
+from unittest import mock
+
+from parallel import *
+
+
+def power(base, exponent):
+    return base ** exponent
+
+
+# Результаты пула calibre в том же виде, что в calibre.utils.ipc.pool
+Result = collections.namedtuple('Result', 'value err traceback')
+WorkerResult = collections.namedtuple('WorkerResult', 'id result is_terminal_failure worker')
+TerminalFailure = collections.namedtuple('TerminalFailure', 'message tb job_id')
+
+
+class FakeCalibrePool:
+    """
+    Пул calibre.utils.ipc.pool.Pool, который выполняет задачи сразу в текущем процессе
+    и кладет в results такие же WorkerResult, как настоящий пул.
+    """
+
+    def __init__(self, functions, crash_on=None, max_workers=None, name=None):
+        self.functions = functions
+        self.crash_on = crash_on
+        self.results = Queue()
+        self.terminal_failure = None
+        self.jobs = []
+        self.is_shut_down = False
+
+    @property
+    def failed(self):
+        return self.terminal_failure is not None
+
+    def __call__(self, job_id, module, func, *args, **kwargs):
+        self.jobs.append((job_id, module, func))
+        if job_id == self.crash_on:
+            # Так настоящий пул сообщает о рабочем процессе, который аварийно завершился
+            self.terminal_failure = TerminalFailure('Worker process crashed while executing job', 'Traceback', job_id)
+            self.results.put(WorkerResult(job_id, Result(None, None, None), True, None))
+            return
+        try:
+            result = Result(self.functions[func](*args, **kwargs), None, None)
+        except Exception as e:
+            result = Result(None, str(e), 'Traceback')
+        self.results.put(WorkerResult(job_id, result, False, None))
+
+    def shutdown(self):
+        self.is_shut_down = True
+
+
+@contextlib.contextmanager
+def fake_calibre_pool(func, crash_on=None):
+    """
+    Выполняет imap_in_processes(func, ...) через ветку пула calibre: func выглядит как функция модуля плагина
+    (calibre_plugins.*), а calibre.utils.ipc.pool.Pool заменяется на FakeCalibrePool.
+
+    :return: Список созданных пулов.
+    """
+    pools = []
+
+    def make_pool(**kwargs):
+        pools.append(FakeCalibrePool({func.__name__: func}, crash_on, **kwargs))
+        return pools[-1]
+
+    module = func.__module__
+    fake_module = types.ModuleType('calibre.utils.ipc.pool')
+    fake_module.Pool = make_pool
+    with mock.patch.dict(sys.modules, {'calibre.utils.ipc.pool': fake_module}):
+        func.__module__ = 'calibre_plugins.paragraphs_plugin.' + module
+        try:
+            yield pools
+        finally:
+            func.__module__ = module
+
+
+class TestMapInProcesses(unittest.TestCase):
+    def test_results_are_in_order(self):
+        args_list = [(base, 3) for base in range(50)]
+        self.assertEqual(map_in_processes(power, args_list, 4), [base ** 3 for base in range(50)])
+
+    def test_single_worker(self):
+        self.assertEqual(map_in_processes(power, [(2, 10)], 4), [1024])
+        self.assertEqual(map_in_processes(power, [(2, 3), (3, 2)], 1), [8, 9])
+
+    def test_empty(self):
+        self.assertEqual(map_in_processes(power, [], 4), [])
+
+
+class TestImapInProcesses(unittest.TestCase):
+    def test_all_results_with_indexes(self):
+        args_list = [(base, 2) for base in range(30)]
+        for workers in (1, 3):
+            results = list(imap_in_processes(power, args_list, workers))
+            self.assertEqual(sorted(results), [(base, base ** 2) for base in range(30)])
+
+
+class TestCalibrePool(unittest.TestCase):
+    def test_results(self):
+        args_list = [(base, 2) for base in range(10)]
+        with fake_calibre_pool(power) as pools:
+            results = list(imap_in_processes(power, args_list, 3))
+        self.assertEqual(sorted(results), [(base, base ** 2) for base in range(10)])
+        pool, = pools
+        self.assertIn('from calibre_plugins.paragraphs_plugin.parallel_test import power', pool.jobs[0][1])
+        self.assertTrue(pool.is_shut_down)
+
+    def test_task_error(self):
+        with fake_calibre_pool(power) as pools, self.assertRaisesRegex(RuntimeError, 'task #1'):
+            list(imap_in_processes(power, [(2, 2), ('2', 2)], 2))
+        self.assertTrue(pools[0].is_shut_down)
+
+    def test_terminal_failure(self):
+        with fake_calibre_pool(power, crash_on=1), self.assertRaisesRegex(RuntimeError, 'crashed'):
+            list(imap_in_processes(power, [(2, 2), (3, 2), (4, 2)], 2))
+
+
+class TestResolveWorkers(unittest.TestCase):
+    def test_auto(self):
+        self.assertEqual(resolve_workers(0), cpu_count())
+        self.assertEqual(resolve_workers(None), cpu_count())
+
+    def test_explicit(self):
+        self.assertEqual(resolve_workers(3), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
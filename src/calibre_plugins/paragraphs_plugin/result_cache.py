@@ -0,0 +1,153 @@
+"""
+Дисковый кэш результатов обработки документов книги.
+
+Одни и те же книги часто конвертируются повторно, а большинство их документов между запусками
+не меняется. Кэш адресуется содержимым: ключ - хэш от байтов документа, настроек разбиения
+и версии плагина, поэтому устаревших записей в нем не бывает, а при попадании документ не нужно даже
+разбирать. Размер кэша ограничен: при переполнении удаляются давно не использовавшиеся записи (LRU
+по времени изменения файла, которое обновляется при каждом чтении).
+"""
+import os
+import hashlib
+import tempfile
+
+# Размер кэша по умолчанию
+DEFAULT_MAX_SIZE = 200 * 1024 * 1024
+
+# При переполнении кэш очищается до этой доли от максимального размера, чтобы не чистить его на каждой записи
+EVICTION_RATIO = 0.9
+
+
+def default_cache_dir():
+    """
+    Директория кэша в кэше calibre (если плагин запущен внутри calibre).
+
+    :return: Путь к директории или None вне calibre.
+    """
+    try:
+        from calibre.constants import cache_dir
+    except ImportError:
+        return None
+    return os.path.join(cache_dir(), 'paragraphs_plugin')
+
+
+class ResultCache:
+    """
+    Кэш результатов: файл на каждую запись, имя файла - ключ записи.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, version=''):
+        """
+        :param directory: Директория кэша (создается при необходимости).
+        :param max_size: Максимальный размер кэша в байтах.
+        :param version: Версия плагина: входит в ключ, поэтому после обновления плагина старые записи не используются.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.version = version
+        # Текущий размер кэша: считается при первой записи, дальше обновляется без обхода директории
+        self._size = None
+
+    def key(self, content, *settings):
+        """
+        Вычисляет ключ записи.
+
+        :param content: Байты исходного документа.
+        :param settings: Настройки, от которых зависит результат (max_len, merge_before_splitting, ...).
+        :return: Ключ (шестнадцатеричная строка).
+        """
+        digest = hashlib.sha256()
+        digest.update(repr((self.version,) + settings).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(content)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        # Записи раскладываются по поддиректориям, чтобы в одной директории не было слишком много файлов
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+        Читает запись.
+
+        :param key: Ключ записи.
+        :return: Байты результата или None, если записи нет.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            # Отмечаем запись как недавно использованную
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        """
+        Сохраняет запись и, если кэш переполнен, удаляет давно не использовавшиеся записи.
+
+        :param key: Ключ записи.
+        :param data: Байты результата.
+        """
+        if len(data) > self.max_size:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Пишем во временный файл и переименовываем: параллельные конвертации не увидят недописанную запись
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path))
+        try:
+            with open(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += len(data)
+        if self._size > self.max_size:
+            self.evict(int(self.max_size * EVICTION_RATIO))
+
+    def _entries(self):
+        """Записи кэша: тройки (время последнего использования, размер, путь)."""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self, target_size):
+        """
+        Удаляет давно не использовавшиеся записи, пока размер кэша не станет не больше target_size.
+
+        :param target_size: Целевой размер кэша в байтах.
+        """
+        entries = sorted(self._entries())
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= target_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+        self._size = size
+
+    def clear(self):
+        """Удаляет все записи кэша."""
+        self.evict(0)
@@ -0,0 +1,59 @@
+import os
+import time
+import tempfile
+import unittest
+
+from result_cache import *
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(os.path.join(self.tmp_dir.name, 'cache'), max_size=1000, version='1.0.0')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_put_and_get(self):
+        key = self.cache.key(b'<p>text</p>', 10, False)
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, b'<p>result</p>')
+        self.assertEqual(self.cache.get(key), b'<p>result</p>')
+
+    def test_key_depends_on_content_settings_and_version(self):
+        key = self.cache.key(b'<p>text</p>', 10, False)
+        self.assertEqual(key, self.cache.key(b'<p>text</p>', 10, False))
+        self.assertNotEqual(key, self.cache.key(b'<p>text!</p>', 10, False))
+        self.assertNotEqual(key, self.cache.key(b'<p>text</p>', 11, False))
+        self.assertNotEqual(key, self.cache.key(b'<p>text</p>', 10, True))
+        other_version = ResultCache(self.cache.directory, version='1.0.1')
+        self.assertNotEqual(key, other_version.key(b'<p>text</p>', 10, False))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        keys = [self.cache.key(bytes([i])) for i in range(3)]
+        for i, key in enumerate(keys):
+            self.cache.put(key, b'x' * 300)
+            # Время изменения файлов различается, чтобы порядок использования был однозначным
+            os.utime(self.cache._path(key), (i, i))
+        # Первая запись использовалась недавно, поэтому удаляется вторая
+        self.cache.get(keys[0])
+        self.cache.put(self.cache.key(b'new'), b'x' * 300)
+
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertLessEqual(sum(size for _, size, _ in self.cache._entries()), 1000)
+
+    def test_too_large_entry_is_not_stored(self):
+        key = self.cache.key(b'big')
+        self.cache.put(key, b'x' * 2000)
+        self.assertIsNone(self.cache.get(key))
+
+    def test_clear(self):
+        key = self.cache.key(b'<p>text</p>')
+        self.cache.put(key, b'result')
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+"""
+Правила разбиения на предложения для разных языков.
+
+Разбиватель предложений (split_paragraph_into_sentence_spans в epub_split.py) не завершает предложение
+на точке после сокращения. Какие слова считать сокращениями, зависит от языка книги: "z.B." в немецкой
+книге, "ім." в украинской, "cf." во французской. Язык берется из метаданных книги (dc:language), и по нему
+из реестра LANGUAGE_RULES выбирается набор сокращений. Набор для любого языка включает базовые русские
+и английские сокращения (unconditional_abbreviations и conditional_abbreviations из epub_split.py), поэтому
+для книг на русском, на английском и без указанного языка разбиение не меняется.
+
+Пользователь может дополнить наборы своими сокращениями (настройки плагина 'abbreviations'
+и 'conditional_abbreviations': словари "язык -> список сокращений", ALL_LANGUAGES - для всех языков),
+в том числе для языков, для которых в реестре правил нет.
+
+Автомат сокращений (см. compile_abbreviation_regex) для каждого набора компилируется один раз
+и переиспользуется для всех документов книги и всех книг с тем же набором, в том числе в рабочих процессах:
+Segmenter передается в процесс по набору сокращений и там берется из того же кэша.
+"""
+import hashlib
+import functools
+
+try:
+    from . import epub_split
+    from .epub_split import compile_abbreviation_regex, find_abbreviations
+except ImportError:
+    import epub_split
+    from epub_split import compile_abbreviation_regex, find_abbreviations
+
+# Ключ пользовательских сокращений, которые действуют для книг на любом языке
+ALL_LANGUAGES = '*'
+
+# Сокращения по языкам (в дополнение к базовым): пары (безусловные, условные), см. epub_split.py.
+# Для русского и английского базовых сокращений достаточно, они заданы здесь, чтобы язык считался известным
+LANGUAGE_RULES = {
+    'ru': ((), ()),
+    'en': ((), ()),
+    'de': (
+        ('z.b.', 'd.h.', 'u.a.', 'o.ä.', 'z.t.', 'bzw.', 'vgl.', 'ggf.', 'evtl.', 'nr.', 'hr.', 'fr.', 'ca.',
+         'bd.', 'abs.', 'str.', 'dt.', 's.', 'st.'),
+        ('usw.', 'u.s.w.', 'u.ä.', 'u.v.m.'),
+    ),
+    'uk': (
+        ('т.зв.', 'т.б.', 'вул.', 'ім.', 'р.', 'рр.', 'див.', 'ст.', 'с.', 'тис.', 'млн.', 'млрд.', 'грн.',
+         'проф.', 'акад.', 'обл.', 'напр.', 'англ.', 'лат.', 'укр.'),
+        ('ін.', 'т.ін.', 'т.д.', 'т.п.'),
+    ),
+    'fr': (
+        ('mm.', 'mlle.', 'mme.', 'p.ex.', 'cf.', 'av.', 'apr.', 'env.', 'ex.', 'éd.', 'vol.', 'chap.', 'cie.'),
+        ('m.',),
+    ),
+}
+
+# Трехбуквенные коды языков (ISO 639-2), которые встречаются в dc:language, и их двухбуквенные аналоги
+# (в том числе для языков без правил в реестре: для них ищутся пользовательские сокращения)
+LANGUAGE_ALIASES = {
+    'rus': 'ru', 'eng': 'en', 'deu': 'de', 'ger': 'de', 'ukr': 'uk', 'fra': 'fr', 'fre': 'fr',
+    'spa': 'es', 'ita': 'it', 'por': 'pt', 'pol': 'pl', 'bel': 'be', 'nld': 'nl', 'dut': 'nl', 'ces': 'cs',
+    'cze': 'cs',
+}
+
+
+def primary_language(language):
+    """
+    Основной подтег кода языка из метаданных книги: 'de-DE' -> 'de', 'rus' -> 'ru', 'es-MX' -> 'es'
+    (в том числе для языков, которых нет в LANGUAGE_RULES). По нему ищутся пользовательские сокращения.
+
+    :param language: Код языка (BCP 47 или ISO 639) или None.
+    :return: Основной подтег в нижнем регистре или None, если язык не указан.
+    """
+    language = (language or '').strip().lower().replace('_', '-').split('-', 1)[0]
+    return LANGUAGE_ALIASES.get(language, language) or None
+
+
+def normalize_language(language):
+    """
+    Приводит код языка из метаданных книги к ключу реестра: 'de-DE' -> 'de', 'rus' -> 'ru'.
+
+    :param language: Код языка (BCP 47 или ISO 639) или None.
+    :return: Ключ LANGUAGE_RULES или None, если язык не указан или неизвестен.
+    """
+    language = primary_language(language)
+    return language if language in LANGUAGE_RULES else None
+
+
+def _normalize_abbreviation(abbreviation):
+    """Сокращение в том виде, в каком его ищет автомат: в нижнем регистре и с завершающей точкой."""
+    abbreviation = abbreviation.strip().lower()
+    if abbreviation and not abbreviation.endswith('.'):
+        abbreviation += '.'
+    return abbreviation
+
+
+def _user_abbreviations(abbreviations, language):
+    """Пользовательские сокращения для языка: общие (ALL_LANGUAGES) и заданные для самого языка."""
+    if not abbreviations:
+        return []
+    result = list(abbreviations.get(ALL_LANGUAGES, ()))
+    if language:
+        result += abbreviations.get(language, ())
+    return [abbreviation for abbreviation in map(_normalize_abbreviation, result) if abbreviation != '.']
+
+
+class Segmenter:
+    """
+    Набор правил разбиения на предложения: сокращения и скомпилированный по ним автомат.
+
+    Экземпляры создаются через get_segmenter и не изменяются.
+    """
+
+    def __init__(self, language, unconditional, conditional):
+        """
+        :param language: Основной подтег языка книги (см. primary_language) или None.
+        :param unconditional: Безусловные сокращения (frozenset, с завершающей точкой).
+        :param conditional: Условные сокращения (frozenset, с завершающей точкой).
+        """
+        self.language = language
+        self.unconditional = unconditional
+        self.conditional = conditional
+        self.abbreviation_regex = compile_abbreviation_regex(unconditional, conditional)
+        # Ключ набора для кэша результатов и манифеста обработки: результат разбиения зависит от сокращений
+        digest = hashlib.sha1(repr((sorted(unconditional), sorted(conditional))).encode('utf-8')).hexdigest()
+        self.key = f'{language or ""}:{digest[:16]}'
+
+    def find_abbreviations(self, paragraph_text):
+        """Позиции знаков препинания, которые не завершают предложение (см. epub_split.find_abbreviations)."""
+        return find_abbreviations(paragraph_text, self.abbreviation_regex, self.unconditional, self.conditional)
+
+    def __reduce__(self):
+        # В рабочий процесс передаются только наборы сокращений, автомат берется из кэша процесса
+        return _compiled_segmenter, (self.language, self.unconditional, self.conditional)
+
+    def __repr__(self):
+        return f'Segmenter({self.key!r})'
+
+
+@functools.lru_cache(maxsize=32)
+def _compiled_segmenter(language, unconditional, conditional):
+    return Segmenter(language, unconditional, conditional)
+
+
+def get_segmenter(language=None, abbreviations=None, conditional_abbreviations=None):
+    """
+    Набор правил для книги на языке language (из кэша: автомат компилируется один раз на набор сокращений).
+
+    :param language: Код языка из метаданных книги (dc:language) или None. Для языка, которого нет
+                     в LANGUAGE_RULES, используются базовые сокращения и пользовательские сокращения этого языка.
+    :param abbreviations: Пользовательские безусловные сокращения: словарь "язык -> список сокращений"
+                          (ALL_LANGUAGES - для любого языка) или None.
+    :param conditional_abbreviations: Пользовательские условные сокращения в том же виде или None.
+    :return: Segmenter.
+    """
+    language = primary_language(language)
+    extra_unconditional, extra_conditional = LANGUAGE_RULES.get(language, ((), ()))
+    unconditional = frozenset(epub_split.unconditional_abbreviations).union(
+        extra_unconditional, _user_abbreviations(abbreviations, language))
+    conditional = frozenset(epub_split.conditional_abbreviations).union(
+        extra_conditional, _user_abbreviations(conditional_abbreviations, language))
+    # Сокращение не может быть одновременно безусловным и условным: безусловное важнее
+    return _compiled_segmenter(language, unconditional, conditional - unconditional)
+
+
+# Набор правил по умолчанию (базовые сокращения), тот же, что у разбивателя предложений без языка
+DEFAULT_SEGMENTER = get_segmenter()
+
+
+def parse_abbreviations(text):
+    """
+    Разбирает пользовательские сокращения из текста настроек: строки вида "de: z.B. usw.",
+    строка без языка - сокращения для всех языков.
+
+    :param text: Текст.
+    :return: Словарь "язык -> список сокращений".
+    """
+    abbreviations = {}
+    for line in text.splitlines():
+        language, separator, rest = line.partition(':')
+        if not separator or ' ' in language.strip() or not language.strip():
+            language, rest = ALL_LANGUAGES, line
+        else:
+            language = primary_language(language)
+        words = rest.split()
+        if words:
+            abbreviations.setdefault(language, []).extend(words)
+    return abbreviations
+
+
+def format_abbreviations(abbreviations):
+    """
+    Записывает пользовательские сокращения в текст настроек (обратно к parse_abbreviations).
+
+    :param abbreviations: Словарь "язык -> список сокращений".
+    :return: Текст.
+    """
+    lines = []
+    for language in sorted(abbreviations, key=lambda language: (language != ALL_LANGUAGES, language)):
+        words = ' '.join(abbreviations[language])
+        lines.append(words if language == ALL_LANGUAGES else f'{language}: {words}')
+    return '\n'.join(lines)
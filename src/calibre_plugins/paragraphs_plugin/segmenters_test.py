@@ -0,0 +1,79 @@
+import io
+import pickle
+import zipfile
+import unittest
+
+from segmenters import *
+from epub_split import split_paragraph_into_sentences, find_language
+
+
+class TestGetSegmenter(unittest.TestCase):
+    def test_default_rules(self):
+        # Без языка, для русского и английского - базовые сокращения, как у разбивателя по умолчанию
+        text = 'См. рис. 3. Mr. Smith came, etc. And left.'
+        for language in (None, 'ru', 'en-US', 'xx'):
+            with self.subTest(language=language):
+                self.assertEqual(split_paragraph_into_sentences(text, get_segmenter(language)),
+                                 split_paragraph_into_sentences(text))
+
+    def test_language_rules(self):
+        text = 'Er kam z.B. gestern. Das ist gut.'
+        self.assertEqual(split_paragraph_into_sentences(text), ['Er kam z.', 'B. gestern.', 'Das ist gut.'])
+        self.assertEqual(split_paragraph_into_sentences(text, get_segmenter('de-DE')),
+                         ['Er kam z.B. gestern.', 'Das ist gut.'])
+        self.assertEqual(split_paragraph_into_sentences('Вулиця ім. Шевченка. Далі.', get_segmenter('ukr')),
+                         ['Вулиця ім. Шевченка.', 'Далі.'])
+
+    def test_user_abbreviations(self):
+        segmenter = get_segmenter('de', {ALL_LANGUAGES: ['Kap'], 'fr': ['Bd.']}, {'de': ['Abb.']})
+        self.assertIn('kap.', segmenter.unconditional)
+        self.assertNotIn('bd.', segmenter.conditional)
+        self.assertEqual(split_paragraph_into_sentences('Siehe Kap. Zwei und Abb. drei. Ende.', segmenter),
+                         ['Siehe Kap. Zwei und Abb. drei.', 'Ende.'])
+
+    def test_user_abbreviations_without_language_rules(self):
+        text = 'La sra. García llegó. Bien.'
+        abbreviations = parse_abbreviations('es: sra.')
+        self.assertEqual(split_paragraph_into_sentences(text, get_segmenter('es-MX', abbreviations)),
+                         ['La sra. García llegó.', 'Bien.'])
+        # Язык входит в ключ кэша результатов и манифеста
+        self.assertEqual(get_segmenter('spa', abbreviations), get_segmenter('es', abbreviations))
+        self.assertNotEqual(get_segmenter('es', abbreviations).key, get_segmenter('it', abbreviations).key)
+        self.assertEqual(split_paragraph_into_sentences(text, get_segmenter('it', abbreviations)),
+                         ['La sra.', 'García llegó.', 'Bien.'])
+
+    def test_cached(self):
+        self.assertIs(get_segmenter('de'), get_segmenter('deu'))
+        self.assertIs(get_segmenter(), DEFAULT_SEGMENTER)
+        self.assertNotEqual(get_segmenter('de').key, DEFAULT_SEGMENTER.key)
+        # В рабочий процесс передаются только сокращения, автомат берется из кэша
+        self.assertIs(pickle.loads(pickle.dumps(get_segmenter('fr'))), get_segmenter('fr'))
+
+
+class TestAbbreviationSettings(unittest.TestCase):
+    def test_round_trip(self):
+        abbreviations = parse_abbreviations('Kap. Abb.\nde: z.B.  usw.\n\nukr: ім.\n')
+        self.assertEqual(abbreviations, {ALL_LANGUAGES: ['Kap.', 'Abb.'], 'de': ['z.B.', 'usw.'], 'uk': ['ім.']})
+        self.assertEqual(parse_abbreviations(format_abbreviations(abbreviations)), abbreviations)
+
+
+class TestFindLanguage(unittest.TestCase):
+    def make_zip(self, opf):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zip_ref:
+            zip_ref.writestr('META-INF/container.xml',
+                             '<container><rootfiles><rootfile full-path="OEBPS/content.opf"/></rootfiles></container>')
+            zip_ref.writestr('OEBPS/content.opf', opf)
+        return zipfile.ZipFile(buffer)
+
+    def test_language(self):
+        opf = ('<package xmlns="http://www.idpf.org/2007/opf" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+               '<metadata><dc:language> de-DE </dc:language><dc:language>en</dc:language></metadata></package>')
+        with self.make_zip(opf) as zip_ref:
+            self.assertEqual(find_language(zip_ref), 'de-DE')
+        with self.make_zip('<package><metadata/></package>') as zip_ref:
+            self.assertIsNone(find_language(zip_ref))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+Отметка об обработке книги для инкрементальной повторной обработки.
+
+Обработанный EPUB получает в META-INF файл-манифест (читалки игнорируют незнакомые файлы в META-INF):
+в нем записаны настройки разбиения и версия плагина, а для каждого обработанного документа - его размер,
+CRC-32 и SHA-256 после обработки. При повторной обработке той же книги с теми же настройками документ,
+содержимое которого совпадает с записанным, уже разбит - его не нужно ни разбирать, ни сжимать
+заново: запись архива копируется как есть. Размер и CRC-32 берутся из заголовка записи
+архива, поэтому измененные документы отсеиваются без распаковки, а SHA-256 проверяется только у совпавших.
+"""
+import json
+import zlib
+import hashlib
+
+# Запись архива с манифестом
+MANIFEST_ENTRY = 'META-INF/paragraphs-plugin.json'
+
+# Версия формата манифеста: манифест другой версии не используется
+MANIFEST_FORMAT = 1
+
+# Размер блока, которым читается документ при проверке SHA-256
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def settings_fingerprint(version, *settings):
+    """
+    Строка, описывающая настройки, от которых зависит результат обработки документа.
+
+    :param version: Версия плагина.
+    :param settings: Настройки (max_len, merge_before_splitting, engine, ...).
+    :return: Строка (записывается в манифест как есть, чтобы ее можно было прочитать).
+    """
+    return repr((version,) + settings)
+
+
+def document_record(content):
+    """
+    Запись манифеста для обработанного документа.
+
+    :param content: Байты документа после обработки.
+    :return: Словарь с размером, CRC-32 (как в заголовке записи zip) и SHA-256 документа.
+    """
+    return {
+        'size': len(content),
+        'crc': zlib.crc32(content),
+        'sha256': hashlib.sha256(content).hexdigest(),
+    }
+
+
+def streamed_document_record(info, sha256):
+    """
+    Запись манифеста для документа, записанного в архив потоком (см. stream_split.py).
+
+    :param info: Запись нового архива (zipfile.ZipInfo) после записи: размер и CRC-32 берутся из нее.
+    :param sha256: Объект hashlib.sha256, в который передавались байты документа.
+    :return: Словарь, как у document_record.
+    """
+    return {'size': info.file_size, 'crc': info.CRC, 'sha256': sha256.hexdigest()}
+
+
+def read_manifest(epub_zip, fingerprint):
+    """
+    Читает манифест из архива.
+
+    :param epub_zip: Архив EPUB (zipfile.ZipFile, открытый на чтение).
+    :param fingerprint: Текущие настройки (см. settings_fingerprint).
+    :return: Словарь {имя записи: запись манифеста} документов, обработанных с теми же настройками.
+             Если манифеста нет, он поврежден или записан с другими настройками, словарь пустой.
+    """
+    try:
+        manifest = json.loads(epub_zip.read(MANIFEST_ENTRY).decode('utf-8'))
+    except (KeyError, ValueError):
+        return {}
+    if (not isinstance(manifest, dict) or manifest.get('format') != MANIFEST_FORMAT
+            or manifest.get('settings') != fingerprint or not isinstance(manifest.get('documents'), dict)):
+        return {}
+    return manifest['documents']
+
+
+def is_processed(epub_zip, info, record):
+    """
+    Проверяет, что запись архива совпадает с документом, записанным в манифест.
+
+    :param epub_zip: Архив EPUB (zipfile.ZipFile, открытый на чтение).
+    :param info: Запись архива (zipfile.ZipInfo).
+    :param record: Запись манифеста для этого документа или None.
+    :return: True, если документ уже обработан с текущими настройками.
+    """
+    if not isinstance(record, dict):
+        return False
+    # Размер и CRC из центрального каталога: отличающийся документ отсеивается без распаковки
+    if record.get('size') != info.file_size or record.get('crc') != info.CRC:
+        return False
+    # Читаем блоками: документ может быть большим (см. stream_split.py)
+    digest = hashlib.sha256()
+    with epub_zip.open(info) as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest() == record.get('sha256')
+
+
+def manifest_bytes(fingerprint, documents):
+    """
+    Содержимое манифеста.
+
+    :param fingerprint: Настройки обработки (см. settings_fingerprint).
+    :param documents: Словарь {имя записи: запись манифеста (см. document_record)}.
+    :return: Байты JSON.
+    """
+    manifest = {'format': MANIFEST_FORMAT, 'settings': fingerprint, 'documents': documents}
+    return json.dumps(manifest, ensure_ascii=False, indent=1, sort_keys=True).encode('utf-8')
@@ -0,0 +1,52 @@
+import io
+import zipfile
+import unittest
+
+from split_manifest import *
+
+
+class TestSplitManifest(unittest.TestCase):
+    FINGERPRINT = settings_fingerprint('1.0.0', 10, False, 'bs4')
+
+    def make_zip(self, documents, manifest=None):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zip_ref:
+            for name, content in documents.items():
+                zip_ref.writestr(name, content, zipfile.ZIP_DEFLATED)
+            if manifest is not None:
+                zip_ref.writestr(MANIFEST_ENTRY, manifest)
+        return zipfile.ZipFile(buffer)
+
+    def test_round_trip(self):
+        content = '<p>Абзац.</p>'.encode('utf-8')
+        manifest = manifest_bytes(self.FINGERPRINT, {'a.xhtml': document_record(content)})
+        with self.make_zip({'a.xhtml': content, 'b.xhtml': b'<p>B</p>'}, manifest) as zip_ref:
+            records = read_manifest(zip_ref, self.FINGERPRINT)
+            self.assertTrue(is_processed(zip_ref, zip_ref.getinfo('a.xhtml'), records.get('a.xhtml')))
+            self.assertFalse(is_processed(zip_ref, zip_ref.getinfo('b.xhtml'), records.get('b.xhtml')))
+
+    def test_changed_document(self):
+        record = document_record(b'<p>A</p>')
+        with self.make_zip({'a.xhtml': b'<p>B</p>'}) as zip_ref:
+            # Тот же размер, другой CRC
+            self.assertFalse(is_processed(zip_ref, zip_ref.getinfo('a.xhtml'), record))
+            # Совпавшие размер и CRC проверяются по SHA-256
+            record = dict(document_record(b'<p>B</p>'), sha256='0' * 64)
+            self.assertFalse(is_processed(zip_ref, zip_ref.getinfo('a.xhtml'), record))
+
+    def test_other_settings(self):
+        manifest = manifest_bytes(self.FINGERPRINT, {'a.xhtml': document_record(b'<p>A</p>')})
+        with self.make_zip({'a.xhtml': b'<p>A</p>'}, manifest) as zip_ref:
+            self.assertEqual(read_manifest(zip_ref, settings_fingerprint('1.0.0', 11, False, 'bs4')), {})
+            self.assertEqual(read_manifest(zip_ref, settings_fingerprint('1.0.1', 10, False, 'bs4')), {})
+
+    def test_missing_or_broken_manifest(self):
+        with self.make_zip({'a.xhtml': b'<p>A</p>'}) as zip_ref:
+            self.assertEqual(read_manifest(zip_ref, self.FINGERPRINT), {})
+        for manifest in (b'{', b'[]', b'{"format": 1}', '{"format": 2}'.encode('utf-8')):
+            with self.make_zip({'a.xhtml': b'<p>A</p>'}, manifest) as zip_ref:
+                self.assertEqual(read_manifest(zip_ref, self.FINGERPRINT), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
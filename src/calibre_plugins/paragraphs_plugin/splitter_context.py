@@ -0,0 +1,79 @@
+"""
+Настройки разбиения абзацев, собранные один раз на книгу.
+
+Раньше каждый документ получал настройки по отдельности (max_len, merge_before_splitting, engine, правила
+разбиения на предложения), и для каждого документа заново выбиралась функция разбиения абзаца движка lxml,
+а набор правил для языка книги искался в кэше. SplitterContext собирает все это один раз на книгу
+(или один раз на рабочий процесс) и передается в обработку каждого документа и каждого абзаца.
+
+В рабочий процесс контекст передается по настройкам: функции движка выбираются в процессе заново,
+а автомат сокращений берется из кэша процесса (см. segmenters.Segmenter).
+"""
+try:
+    from .epub_split import ENGINE_BS4, ENGINE_LXML, ENGINE_LXML_DOM
+    from .segmenters import get_segmenter, DEFAULT_SEGMENTER
+except ImportError:
+    from epub_split import ENGINE_BS4, ENGINE_LXML, ENGINE_LXML_DOM
+    from segmenters import get_segmenter, DEFAULT_SEGMENTER
+
+
+class SplitterContext:
+    """
+    Настройки разбиения абзацев книги: максимальное количество слов в абзаце, признак объединения абзацев,
+    движок и правила разбиения на предложения для языка книги.
+
+    Экземпляры не изменяются после создания.
+    """
+
+    def __init__(self, max_len=10, merge_before_splitting=False, engine=ENGINE_BS4, segmenter=DEFAULT_SEGMENTER):
+        """
+        :param max_len: Максимальное количество слов в абзаце.
+        :param merge_before_splitting: Признак того, что необходимо объединить абзацы в один перед дальнейшим разбиением.
+        :param engine: Движок разбиения абзацев (ENGINE_BS4, ENGINE_LXML или ENGINE_LXML_DOM).
+        :param segmenter: Правила разбиения на предложения (см. segmenters.py).
+        """
+        if engine not in (ENGINE_BS4, ENGINE_LXML, ENGINE_LXML_DOM):
+            raise ValueError(f"Unsupported engine: {engine}")
+        self.max_len = max_len
+        self.merge_before_splitting = merge_before_splitting
+        self.engine = engine
+        self.segmenter = segmenter if segmenter is not None else DEFAULT_SEGMENTER
+
+        # Функция разбиения абзаца для движков lxml (для движка BeautifulSoup - None)
+        self.split_paragraph = None
+        if engine != ENGINE_BS4:
+            if __package__:
+                from .lxml_split import split_paragraph_lxml, split_paragraph_dom
+            else:
+                from lxml_split import split_paragraph_lxml, split_paragraph_dom
+            self.split_paragraph = split_paragraph_dom if engine == ENGINE_LXML_DOM else split_paragraph_lxml
+
+    @classmethod
+    def for_book(cls, max_len=10, merge_before_splitting=False, engine=ENGINE_BS4, language=None, abbreviations=None,
+                 conditional_abbreviations=None):
+        """
+        Контекст для книги на языке language (см. segmenters.get_segmenter).
+
+        :param language: Код языка книги (dc:language) или None.
+        :param abbreviations: Пользовательские безусловные сокращения или None.
+        :param conditional_abbreviations: Пользовательские условные сокращения или None.
+        :return: SplitterContext.
+        """
+        return cls(max_len, merge_before_splitting, engine,
+                   get_segmenter(language, abbreviations, conditional_abbreviations))
+
+    @property
+    def language(self):
+        """Основной подтег языка правил разбиения на предложения (см. segmenters.primary_language) или None."""
+        return self.segmenter.language
+
+    @property
+    def settings(self):
+        """Настройки, от которых зависит результат: входят в ключи кэша результатов и в манифест обработки."""
+        return self.max_len, self.merge_before_splitting, self.engine, self.segmenter.key
+
+    def __reduce__(self):
+        return SplitterContext, (self.max_len, self.merge_before_splitting, self.engine, self.segmenter)
+
+    def __repr__(self):
+        return f'SplitterContext{self.settings!r}'
@@ -0,0 +1,50 @@
+import pickle
+import unittest
+
+from splitter_context import *
+from epub_split import process_epub_html, process_document, process_epub_html_in_worker
+from lxml_split import split_paragraph_dom
+from segmenters import get_segmenter
+
+
+class TestSplitterContext(unittest.TestCase):
+    HTML = '<p>Er kam z.B. gestern. Das ist gut. Sehr gut.</p><p>Kurz.</p>'
+
+    def test_same_result_as_process_epub_html(self):
+        for engine in (ENGINE_BS4, ENGINE_LXML, ENGINE_LXML_DOM):
+            with self.subTest(engine=engine):
+                context = SplitterContext(4, True, engine)
+                self.assertEqual(process_document(self.HTML, context),
+                                 process_epub_html(self.HTML, 4, True, engine))
+
+    def test_for_book(self):
+        context = SplitterContext.for_book(4, engine=ENGINE_LXML_DOM, language='de-AT')
+        self.assertEqual(context.language, 'de')
+        self.assertIs(context.segmenter, get_segmenter('de'))
+        self.assertIs(context.split_paragraph, split_paragraph_dom)
+        self.assertEqual(process_document(self.HTML, context),
+                         '<p>Er kam z.B. gestern.</p><p>Das ist gut. Sehr gut.</p><p>Kurz.</p>')
+
+    def test_settings(self):
+        self.assertEqual(SplitterContext(4).settings, SplitterContext(4).settings)
+        self.assertNotEqual(SplitterContext(4).settings, SplitterContext.for_book(4, language='de').settings)
+        self.assertNotEqual(SplitterContext(4).settings, SplitterContext(4, engine=ENGINE_LXML).settings)
+        with self.assertRaises(ValueError):
+            SplitterContext(4, engine='html5lib')
+
+    def test_pickle(self):
+        context = SplitterContext.for_book(4, True, ENGINE_LXML, language='fr')
+        restored = pickle.loads(pickle.dumps(context))
+        self.assertEqual(restored.settings, context.settings)
+        # Правила для языка берутся из кэша процесса, а не компилируются заново
+        self.assertIs(restored.segmenter, context.segmenter)
+        self.assertIs(restored.split_paragraph, context.split_paragraph)
+
+    def test_worker(self):
+        result, stats = process_epub_html_in_worker(self.HTML, SplitterContext(4), True)
+        self.assertEqual(result, process_epub_html(self.HTML, 4))
+        self.assertEqual(stats.counters['paragraphs'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
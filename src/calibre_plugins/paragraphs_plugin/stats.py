@@ -0,0 +1,241 @@
+"""
+Замер времени этапов обработки книги и счетчики обработки.
+
+Этапы обработки (распаковка, разбор HTML, объединение абзацев, разбиение на предложения, подсчет слов,
+перегруппировка, сериализация, запись архива) перемежаются на каждом абзаце, поэтому время
+накапливается "кругами": clock() запоминает момент начала этапа, lap() добавляет прошедшее время
+к этапу и возвращает момент начала следующего. Кроме времени собираются счетчики (байты, абзацы,
+предложения) и время обработки каждого документа. Если замер не нужен, передается NULL_STATS,
+у которого все методы ничего не делают.
+
+Собранная статистика выводится в журнал (report) с настраиваемой подробностью: журналом может быть
+журнал задачи calibre или logging.Logger - используются только методы info и debug.
+"""
+import os
+import time
+import cProfile
+
+from contextlib import contextmanager
+
+# Этапы обработки в порядке выполнения
+STAGE_UNZIP = 'unzip'
+STAGE_PARSE = 'parse'
+STAGE_MERGE = 'merge'
+STAGE_EXTRACT = 'extract'
+STAGE_SENTENCE_SPLIT = 'sentence split'
+STAGE_TOKENIZE = 'tokenize'
+STAGE_REGROUP = 'regroup'
+STAGE_SERIALIZE = 'serialize'
+STAGE_ZIP = 'zip'
+
+STAGES = [STAGE_UNZIP, STAGE_PARSE, STAGE_MERGE, STAGE_EXTRACT, STAGE_SENTENCE_SPLIT, STAGE_TOKENIZE,
+          STAGE_REGROUP, STAGE_SERIALIZE, STAGE_ZIP]
+
+# Счетчики обработки
+COUNTER_DOCUMENTS = 'documents'                    # Обработанные документы
+COUNTER_CACHE_HITS = 'cache hits'                  # Документы, взятые из кэша результатов
+COUNTER_UNCHANGED = 'unchanged'                    # Документы, уже обработанные раньше (см. split_manifest.py)
+COUNTER_PARSE_FALLBACKS = 'parse fallbacks'        # Некорректные XHTML-документы, которые вместо lxml разобрал BeautifulSoup
+COUNTER_BYTES_IN = 'bytes in'                      # Размер документов до обработки
+COUNTER_BYTES_OUT = 'bytes out'                    # Размер документов после обработки
+COUNTER_PARAGRAPHS = 'paragraphs'                  # Абзацы (после объединения)
+COUNTER_PARAGRAPHS_MERGED = 'paragraphs merged'    # Абзацы, присоединенные к предыдущим
+COUNTER_PARAGRAPHS_SPLIT = 'paragraphs split'      # Разбитые абзацы
+COUNTER_PARAGRAPHS_CREATED = 'paragraphs created'  # Абзацы, получившиеся из разбитых
+COUNTER_PARAGRAPHS_UNSPLIT = 'paragraphs unsplit'  # Абзацы, которые движок lxml не смог разбить по узлам дерева
+COUNTER_SENTENCES = 'sentences'                    # Предложения в разбитых абзацах
+
+COUNTERS = [COUNTER_DOCUMENTS, COUNTER_CACHE_HITS, COUNTER_UNCHANGED, COUNTER_PARSE_FALLBACKS, COUNTER_BYTES_IN,
+            COUNTER_BYTES_OUT, COUNTER_PARAGRAPHS, COUNTER_PARAGRAPHS_MERGED, COUNTER_PARAGRAPHS_SPLIT,
+            COUNTER_PARAGRAPHS_CREATED, COUNTER_PARAGRAPHS_UNSPLIT, COUNTER_SENTENCES]
+
+# Подробность отчета: ничего, итоговая строка, + время этапов и самые медленные документы, + каждый документ
+VERBOSITY_OFF = 0
+VERBOSITY_SUMMARY = 1
+VERBOSITY_STAGES = 2
+VERBOSITY_DOCUMENTS = 3
+
+# Сколько самых медленных документов показывать в отчете
+SLOWEST_DOCUMENTS = 5
+
+
+class ProcessingStats:
+    """
+    Суммарное время (в секундах) по этапам обработки, счетчики и время обработки документов.
+
+    Объект можно передавать между процессами (pickle): рабочие процессы возвращают свою статистику,
+    которая добавляется к общей (update).
+    """
+
+    def __init__(self):
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        # Документы: четверки (время обработки, имя, размер до обработки, размер после обработки)
+        self.documents = []
+
+    def clock(self):
+        """Момент начала этапа."""
+        return time.perf_counter()
+
+    def lap(self, stage, start):
+        """
+        Добавляет к этапу время, прошедшее с момента start.
+
+        :param stage: Этап (одна из констант STAGE_*).
+        :param start: Момент начала этапа (результат clock() или предыдущего lap()).
+        :return: Текущий момент - начало следующего этапа.
+        """
+        now = time.perf_counter()
+        self.times[stage] += now - start
+        return now
+
+    def count(self, counter, n=1):
+        """
+        Увеличивает счетчик.
+
+        :param counter: Счетчик (одна из констант COUNTER_*).
+        :param n: На сколько увеличить.
+        """
+        self.counters[counter] += n
+
+    def add_document(self, name, seconds, bytes_in, bytes_out):
+        """
+        Учитывает обработанный документ.
+
+        :param name: Имя документа (путь внутри архива).
+        :param seconds: Время обработки документа.
+        :param bytes_in: Размер документа до обработки.
+        :param bytes_out: Размер документа после обработки.
+        """
+        self.documents.append((seconds, name, bytes_in, bytes_out))
+        self.counters[COUNTER_DOCUMENTS] += 1
+        self.counters[COUNTER_BYTES_IN] += bytes_in
+        self.counters[COUNTER_BYTES_OUT] += bytes_out
+
+    def update(self, other):
+        """Добавляет статистику из другого объекта ProcessingStats (например, из рабочего процесса)."""
+        for stage, seconds in other.times.items():
+            self.times[stage] = self.times.get(stage, 0.0) + seconds
+        for counter, n in other.counters.items():
+            self.counters[counter] = self.counters.get(counter, 0) + n
+        self.documents.extend(other.documents)
+
+    def slowest_documents(self, n=SLOWEST_DOCUMENTS):
+        """Самые медленные документы: четверки (время, имя, размер до, размер после) по убыванию времени."""
+        return sorted(self.documents, reverse=True)[:n]
+
+    @property
+    def total(self):
+        """Суммарное время всех этапов."""
+        return sum(self.times.values())
+
+    def as_dict(self):
+        """Статистика в виде словаря (для JSON)."""
+        return {
+            'stages': dict(self.times),
+            'counters': dict(self.counters),
+            'slowest_documents': [
+                {'name': name, 'seconds': seconds, 'bytes_in': bytes_in, 'bytes_out': bytes_out}
+                for seconds, name, bytes_in, bytes_out in self.slowest_documents()
+            ],
+        }
+
+
+class NullStats:
+    """Заглушка ProcessingStats для обработки без замеров: методы ничего не делают."""
+
+    def clock(self):
+        return 0.0
+
+    def lap(self, stage, start):
+        return 0.0
+
+    def count(self, counter, n=1):
+        pass
+
+    def add_document(self, name, seconds, bytes_in, bytes_out):
+        pass
+
+
+NULL_STATS = NullStats()
+
+
+def _format_size(size):
+    """Размер в КиБ с одним знаком после запятой."""
+    return f'{size / 1024:.1f} KiB'
+
+
+def report(stats, log, verbosity=VERBOSITY_SUMMARY, title='book'):
+    """
+    Выводит статистику обработки в журнал.
+
+    :param stats: ProcessingStats.
+    :param log: Журнал: журнал задачи calibre (calibre.utils.logging.Log) или logging.Logger.
+    :param verbosity: Подробность (одна из констант VERBOSITY_*).
+    :param title: Что обрабатывалось (например, имя файла книги).
+    """
+    if verbosity <= VERBOSITY_OFF:
+        return
+
+    counters = stats.counters
+    total = stats.total
+    log.info(f"[Split paragraphs plugin] {title}: {counters[COUNTER_DOCUMENTS]} documents "
+             f"({counters[COUNTER_CACHE_HITS]} from cache, {counters[COUNTER_UNCHANGED]} skipped as unchanged, "
+             f"{counters[COUNTER_PARSE_FALLBACKS]} malformed parsed by BeautifulSoup), "
+             f"{_format_size(counters[COUNTER_BYTES_IN])} -> {_format_size(counters[COUNTER_BYTES_OUT])}, "
+             f"paragraphs: {counters[COUNTER_PARAGRAPHS]} seen, {counters[COUNTER_PARAGRAPHS_MERGED]} merged, "
+             f"{counters[COUNTER_PARAGRAPHS_SPLIT]} split into {counters[COUNTER_PARAGRAPHS_CREATED]}, "
+             f"{counters[COUNTER_PARAGRAPHS_UNSPLIT]} left unsplit, "
+             f"sentences: {counters[COUNTER_SENTENCES]}, time: {total:.3f} s")
+    if verbosity < VERBOSITY_STAGES:
+        return
+
+    for stage in STAGES:
+        seconds = stats.times.get(stage, 0.0)
+        share = seconds / total * 100 if total else 0.0
+        log.info(f"[Split paragraphs plugin]   {stage:<15} {seconds * 1000:10.1f} ms {share:5.1f}%")
+    for seconds, name, bytes_in, bytes_out in stats.slowest_documents():
+        log.info(f"[Split paragraphs plugin]   slow document: {name}: {seconds * 1000:.1f} ms, "
+                 f"{_format_size(bytes_in)} -> {_format_size(bytes_out)}")
+    if verbosity < VERBOSITY_DOCUMENTS:
+        return
+
+    for seconds, name, bytes_in, bytes_out in stats.documents:
+        log.debug(f"[Split paragraphs plugin]   document: {name}: {seconds * 1000:.1f} ms, "
+                  f"{_format_size(bytes_in)} -> {_format_size(bytes_out)}")
+
+
+def profile_path_for(profile_dir, book_path):
+    """
+    Путь к файлу профиля cProfile для книги: <profile_dir>/<имя книги>-<дата и время>.prof.
+
+    :param profile_dir: Директория профилей (пустая строка или None - профилирование выключено).
+    :param book_path: Путь к книге.
+    :return: Путь к файлу профиля или None.
+    """
+    if not profile_dir:
+        return None
+    name = os.path.splitext(os.path.basename(book_path))[0]
+    return os.path.join(profile_dir, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+
+
+@contextmanager
+def profiled(profile_path):
+    """
+    Профилирует блок with с помощью cProfile и записывает профиль в profile_path
+    (его можно открыть, например, через python -m pstats или snakeviz). Рабочие процессы не профилируются.
+
+    :param profile_path: Путь к файлу профиля или None (профилирование выключено).
+    """
+    if not profile_path:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(os.path.abspath(profile_path)), exist_ok=True)
+        profiler.dump_stats(profile_path)
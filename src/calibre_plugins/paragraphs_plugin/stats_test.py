@@ -0,0 +1,78 @@
+import os
+import pickle
+import pstats
+import logging
+import tempfile
+import unittest
+
+from stats import *
+
+
+class ListLog:
+    """Журнал, который запоминает сообщения (как журнал задачи calibre, у него есть info и debug)."""
+
+    def __init__(self):
+        self.messages = []
+
+    def info(self, message):
+        self.messages.append(('info', message))
+
+    def debug(self, message):
+        self.messages.append(('debug', message))
+
+
+class TestProcessingStats(unittest.TestCase):
+    def make_stats(self):
+        stats = ProcessingStats()
+        stats.lap(STAGE_PARSE, stats.clock())
+        stats.count(COUNTER_PARAGRAPHS, 10)
+        stats.add_document('a.xhtml', 0.5, 100, 120)
+        stats.add_document('b.xhtml', 1.5, 200, 220)
+        return stats
+
+    def test_update(self):
+        stats = self.make_stats()
+        stats.update(pickle.loads(pickle.dumps(self.make_stats())))
+        self.assertEqual(stats.counters[COUNTER_PARAGRAPHS], 20)
+        self.assertEqual(stats.counters[COUNTER_DOCUMENTS], 4)
+        self.assertEqual(stats.counters[COUNTER_BYTES_OUT], 680)
+        self.assertEqual(stats.slowest_documents(1), [(1.5, 'b.xhtml', 200, 220)])
+
+    def test_null_stats(self):
+        start = NULL_STATS.clock()
+        NULL_STATS.lap(STAGE_PARSE, start)
+        NULL_STATS.count(COUNTER_PARAGRAPHS)
+        NULL_STATS.add_document('a.xhtml', 1, 2, 3)
+
+    def test_report_verbosity(self):
+        stats = self.make_stats()
+        lengths = []
+        for verbosity in (VERBOSITY_OFF, VERBOSITY_SUMMARY, VERBOSITY_STAGES, VERBOSITY_DOCUMENTS):
+            log = ListLog()
+            report(stats, log, verbosity, 'book.epub')
+            lengths.append(len(log.messages))
+        self.assertEqual(lengths, [0, 1, 1 + len(STAGES) + 2, 1 + len(STAGES) + 2 + 2])
+
+    def test_report_to_logging(self):
+        with self.assertLogs(level=logging.INFO) as logs:
+            report(self.make_stats(), logging.getLogger(), VERBOSITY_SUMMARY, 'book.epub')
+        self.assertIn('book.epub: 2 documents', logs.output[0])
+
+
+class TestProfiled(unittest.TestCase):
+    def test_profile_is_written(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profile_path = profile_path_for(os.path.join(tmp_dir, 'profiles'), '/books/book.epub')
+            self.assertTrue(os.path.basename(profile_path).startswith('book-'))
+            with profiled(profile_path):
+                sorted(range(1000), reverse=True)
+            self.assertTrue(pstats.Stats(profile_path).total_calls > 0)
+
+    def test_disabled(self):
+        self.assertIsNone(profile_path_for('', 'book.epub'))
+        with profiled(None):
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+"""
+Потоковое разбиение абзацев в больших документах с ограниченным расходом памяти.
+
+Некоторые EPUB (часто сконвертированные из PDF или TXT) хранят всю книгу в одном XHTML-файле на несколько
+мегабайт. Дерево BeautifulSoup для такого документа занимает в памяти в десятки раз больше самого файла.
+Здесь документ читается блоками и разбирается событийным парсером (html.parser.HTMLParser, тот же,
+что использует BeautifulSoup), а все, что не входит в абзацы, сразу пишется в результат в исходном виде.
+Каждый абзац копится, пока не закроется, разбивается выбранным движком (см. process_epub_html)
+и тоже сразу пишется в результат. Поэтому расход памяти зависит от размера самого большого абзаца
+(при merge_before_splitting - самой длинной серии объединяемых абзацев), а не от размера документа.
+
+Отличия от обработки целого документа: разметка вне абзацев не нормализуется (как у движка lxml),
+а абзацы, вложенные в другие абзацы, разбиваются вместе с внешним абзацем.
+"""
+import io
+
+from html.parser import HTMLParser
+
+try:
+    from .epub_split import process_document
+    from .word_counts import count_word_starts
+    from .splitter_context import SplitterContext
+    from .stats import NULL_STATS, COUNTER_PARAGRAPHS, COUNTER_PARAGRAPHS_MERGED
+except ImportError:
+    from epub_split import process_document
+    from word_counts import count_word_starts
+    from splitter_context import SplitterContext
+    from stats import NULL_STATS, COUNTER_PARAGRAPHS, COUNTER_PARAGRAPHS_MERGED
+
+# Размер блока (в символах), которым читается документ
+READ_CHUNK_SIZE = 64 * 1024
+
+# Результат копится до этого размера (в символах) и записывается одним блоком
+WRITE_BUFFER_SIZE = 64 * 1024
+
+# Пустые элементы HTML: у них нет закрывающего тега, поэтому они не попадают в стек открытых элементов
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'
+])
+
+
+def _merge_key(attrs):
+    """Ключ совместимости абзаца для объединения (см. epub_split._merge_key) по атрибутам открывающего тега."""
+    attrs = dict(attrs)
+    return ' '.join((attrs.get('class') or '').split()), attrs.get('style') or ''
+
+
+class StreamingSplitter(HTMLParser):
+    """
+    Событийный разбор документа: разметка вне абзацев передается в результат как есть,
+    абзацы накапливаются и разбиваются по одному.
+
+    Разметка восстанавливается по событиям парсера: открывающие теги - в исходном виде (get_starttag_text),
+    закрывающие - с именем из открывающего тега (HTMLParser приводит имена к нижнему регистру, а в XHTML,
+    например в SVG, регистр важен), ссылки на символы - без замены на сами символы.
+    """
+
+    def __init__(self, write, context, stats=NULL_STATS):
+        """
+        :param write: Функция, которая получает очередную часть результата (строку).
+        :param context: SplitterContext книги (см. splitter_context.py).
+        :param stats: ProcessingStats для замера времени этапов (см. stats.py).
+        """
+        super().__init__(convert_charrefs=False)
+        self.write = write
+        self.max_len = context.max_len
+        self.merge_before_splitting = context.merge_before_splitting
+        # Абзацы (и объединенные серии) разбиваются по одному, уже без объединения
+        self.paragraph_context = context
+        if context.merge_before_splitting:
+            self.paragraph_context = SplitterContext(context.max_len, False, context.engine, context.segmenter)
+        self.stats = stats
+
+        # Открытые элементы: тройки (имя в нижнем регистре, имя в исходном виде, номер элемента)
+        self.stack = []
+        self.element_count = 0
+        # Накапливаемый абзац: открывающий тег, атрибуты, части содержимого и глубина стека,
+        # на которой он открыт (None - вне абзаца)
+        self.paragraph_start_tag = None
+        self.paragraph_attrs = []
+        self.paragraph = []
+        self.paragraph_depth = None
+        # Серия объединяемых абзацев: открывающий тег первого абзаца, содержимое абзацев серии, родитель,
+        # ключ совместимости и разметка между абзацами серии (она остается после объединенного абзаца)
+        self.run_start_tag = None
+        self.run_contents = []
+        self.run_parent = None
+        self.run_key = None
+        self.run_tail = []
+        self.run_depth = None
+        # Буфер результата
+        self.output = []
+        self.output_size = 0
+
+    # Запись результата
+
+    def _emit(self, text):
+        self.output.append(text)
+        self.output_size += len(text)
+        if self.output_size >= WRITE_BUFFER_SIZE:
+            self._flush_output()
+
+    def _flush_output(self):
+        if self.output:
+            self.write(''.join(self.output))
+            self.output = []
+            self.output_size = 0
+
+    def _markup(self, text):
+        """Разметка вне абзацев: в накапливаемый абзац, в промежуток серии или сразу в результат."""
+        if self.paragraph_depth is not None:
+            self.paragraph.append(text)
+        elif self.run_start_tag is not None:
+            self.run_tail.append(text)
+        else:
+            self._emit(text)
+
+    # Абзацы
+
+    def _split(self, start_tag, content):
+        """Разбивает абзац и записывает результат (незакрытый абзац при этом закрывается)."""
+        paragraph_html = f'{start_tag}{content}</p>'
+        # Быстрая проверка, как в process_document: короткий абзац не нужно даже разбирать
+        if count_word_starts([content])[0] <= self.max_len:
+            self.stats.count(COUNTER_PARAGRAPHS)
+            self._emit(paragraph_html)
+        else:
+            self._emit(process_document(paragraph_html, self.paragraph_context, self.stats))
+
+    def _flush_run(self):
+        """Записывает серию объединяемых абзацев: объединенный абзац, а за ним разметку между абзацами серии."""
+        if self.run_start_tag is None:
+            return
+        self.stats.count(COUNTER_PARAGRAPHS_MERGED, len(self.run_contents) - 1)
+        self._split(self.run_start_tag, ''.join(self.run_contents))
+        for text in self.run_tail:
+            self._emit(text)
+        self.run_start_tag = None
+        self.run_contents = []
+        self.run_tail = []
+        self.run_depth = None
+
+    def _end_paragraph(self):
+        """Абзац закрылся (закрывающим тегом или вместе с элементом, в котором он лежит)."""
+        start_tag, content, depth = self.paragraph_start_tag, ''.join(self.paragraph), self.paragraph_depth
+        self.paragraph = []
+        self.paragraph_depth = None
+        if not self.merge_before_splitting:
+            self._split(start_tag, content)
+            return
+        # Абзац продолжает серию, если у него тот же родитель и те же class и style, что у первого абзаца серии
+        parent = self.stack[depth - 1][2] if depth else None
+        key = _merge_key(self.paragraph_attrs)
+        if self.run_start_tag is not None and parent == self.run_parent and key == self.run_key:
+            self.run_contents.append(content)
+            return
+        self._flush_run()
+        self.run_start_tag, self.run_contents = start_tag, [content]
+        self.run_parent, self.run_key = parent, key
+        self.run_depth = depth
+
+    # События парсера
+
+    def handle_starttag(self, tag, attrs):
+        start_tag = self.get_starttag_text()
+        if tag == 'p' and self.paragraph_depth is None:
+            self.paragraph_start_tag, self.paragraph_attrs = start_tag, attrs
+            self.paragraph_depth = len(self.stack)
+        else:
+            self._markup(start_tag)
+        if tag not in VOID_ELEMENTS:
+            self.element_count += 1
+            # Имя в исходном виде: после '<' до пробела, '/' или '>'
+            raw_name = start_tag[1:1 + len(tag)]
+            self.stack.append((tag, raw_name, self.element_count))
+
+    def handle_startendtag(self, tag, attrs):
+        self._markup(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        # Закрываем элемент вместе со всеми незакрытыми вложенными в него; закрывающий тег без открывающего
+        # просто переносится в результат
+        index = next((i for i in range(len(self.stack) - 1, -1, -1) if self.stack[i][0] == tag), None)
+        if index is None:
+            self._markup(f'</{tag}>')
+            return
+        end_tag = f'</{self.stack[index][1]}>'
+        if self.paragraph_depth is not None and index <= self.paragraph_depth:
+            closed_paragraph = index == self.paragraph_depth
+            # Закрылся сам абзац или элемент, в котором лежит незакрытый абзац
+            del self.stack[index + 1:]
+            self._end_paragraph()
+            if closed_paragraph:
+                del self.stack[index:]
+                return
+        del self.stack[index:]
+        if self.run_depth is not None and len(self.stack) < self.run_depth:
+            # Закрылся родитель серии: дальше абзацы в нее не попадут
+            self._flush_run()
+        self._markup(end_tag)
+
+    def handle_data(self, data):
+        self._markup(data)
+
+    def handle_entityref(self, name):
+        self._markup(f'&{name};')
+
+    def handle_charref(self, name):
+        self._markup(f'&#{name};')
+
+    def handle_comment(self, data):
+        self._markup(f'<!--{data}-->')
+
+    def handle_decl(self, decl):
+        self._markup(f'<!{decl}>')
+
+    def handle_pi(self, data):
+        self._markup(f'<?{data}>')
+
+    def unknown_decl(self, data):
+        # Секции CDATA и подобные закрываются ']]>', условные секции ('<![if ...]>') - ']>'
+        end = ']>' if data.split(' ', 1)[0].lower() in ('if', 'else', 'endif') else ']]>'
+        self._markup(f'<![{data}{end}')
+
+    def close(self):
+        super().close()
+        if self.paragraph_depth is not None:
+            self._end_paragraph()
+        self._flush_run()
+        self._flush_output()
+
+
+def process_epub_html_stream(source, write, context, stats=NULL_STATS):
+    """
+    Обрабатывает HTML-документ EPUB так же, как process_epub_html, но потоково: документ читается блоками,
+    а результат записывается частями по мере разбора (см. StreamingSplitter).
+
+    :param source: Двоичный файловый объект с документом в UTF-8 (например, запись архива, открытая на чтение).
+    :param write: Функция, которая получает очередную часть результата (строку).
+    :param context: SplitterContext книги (см. splitter_context.py).
+    :param stats: ProcessingStats для замера времени этапов (см. stats.py).
+    """
+    splitter = StreamingSplitter(write, context, stats)
+    # newline='' - переводы строк передаются как есть
+    reader = io.TextIOWrapper(source, encoding='utf-8', newline='')
+    try:
+        for chunk in iter(lambda: reader.read(READ_CHUNK_SIZE), ''):
+            splitter.feed(chunk)
+        splitter.close()
+    finally:
+        # Исходный файл закрывает вызывающий код
+        reader.detach()
@@ -0,0 +1,96 @@
+import io
+import os
+import zipfile
+import tempfile
+import unittest
+
+from stream_split import *
+from splitter_context import SplitterContext
+from epub_split import process_epub, process_epub_html
+from split_manifest import MANIFEST_ENTRY, read_manifest, settings_fingerprint, is_processed
+from segmenters import DEFAULT_SEGMENTER
+from stats import ProcessingStats
+
+
+def split_stream(html_content, stats=NULL_STATS, **kwargs):
+    parts = []
+    process_epub_html_stream(io.BytesIO(html_content.encode('utf-8')), parts.append, SplitterContext(**kwargs), stats)
+    return ''.join(parts)
+
+
+class TestProcessEpubHtmlStream(unittest.TestCase):
+    DOCUMENT = ('<html xmlns="http://www.w3.org/1999/xhtml">\n<head><title>Глава</title></head>\n<body>\n'
+                '<h1>Глава 1</h1>\n'
+                '<p class="a">Один два три. Четыре <em>пять</em> шесть. Семь восемь&nbsp;девять.</p>\n'
+                '<p>Десять.</p>\n'
+                '<div><p>Один два три. Четыре пять шесть.</p></div>\n'
+                '</body>\n</html>')
+
+    def test_same_result_as_document_processing(self):
+        for merge in (False, True):
+            with self.subTest(merge=merge):
+                self.assertEqual(split_stream(self.DOCUMENT, max_len=3, merge_before_splitting=merge),
+                                 process_epub_html(self.DOCUMENT, max_len=3, merge_before_splitting=merge))
+
+    def test_merge_runs(self):
+        html_content = ('<body><p class="a">Раз.</p><p class="a">Два.</p><p class="b">Три.</p>'
+                        '<div><p class="b">Четыре.</p></div></body>')
+        stats = ProcessingStats()
+        result = split_stream(html_content, max_len=10, merge_before_splitting=True, stats=stats)
+        self.assertEqual(result, process_epub_html(html_content, max_len=10, merge_before_splitting=True))
+        self.assertEqual(stats.counters['paragraphs merged'], 1)
+
+    def test_markup_outside_paragraphs_is_kept(self):
+        html_content = ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n<html><body>'
+                        '<!-- комментарий --><svg viewBox="0 0 1 1"><linearGradient id="g"/>'
+                        '<foreignObject>&#169;</foreignObject></svg><br/><![CDATA[x]]></body></html>')
+        self.assertEqual(split_stream(html_content, max_len=3), html_content)
+
+    def test_unclosed_paragraph(self):
+        html_content = '<body><div><p>Один два три. Четыре пять шесть.</div></body>'
+        self.assertEqual(split_stream(html_content, max_len=3),
+                         '<body><div><p>Один два три.</p><p>Четыре пять шесть.</p></div></body>')
+
+    def test_small_chunks(self):
+        from unittest import mock
+
+        # Теги и абзацы, разрезанные границей блока, разбираются так же
+        with mock.patch('stream_split.READ_CHUNK_SIZE', 7):
+            self.assertEqual(split_stream(self.DOCUMENT, max_len=3), process_epub_html(self.DOCUMENT, max_len=3))
+
+
+class TestProcessEpubStreaming(unittest.TestCase):
+    CHAPTER = '<html><body><p>Один два три. Четыре пять шесть. Семь восемь девять.</p></body></html>'
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.epub_path = os.path.join(self.tmp_dir.name, 'book.epub')
+        with zipfile.ZipFile(self.epub_path, 'w') as zip_ref:
+            zip_ref.writestr('mimetype', 'application/epub+zip', zipfile.ZIP_STORED)
+            zip_ref.writestr('OEBPS/chapter.xhtml', self.CHAPTER, zipfile.ZIP_DEFLATED)
+            zip_ref.writestr('OEBPS/short.xhtml', '<p>Один.</p>', zipfile.ZIP_STORED)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_large_documents_are_streamed(self):
+        stats = ProcessingStats()
+        process_epub(self.epub_path, max_len=3, stream_threshold=32, incremental=True, version='1.0.0', stats=stats)
+        with zipfile.ZipFile(self.epub_path) as zip_ref:
+            self.assertIsNone(zip_ref.testzip())
+            self.assertEqual(
+                zip_ref.read('OEBPS/chapter.xhtml').decode('utf-8'),
+                '<html><body><p>Один два три.</p><p>Четыре пять шесть.</p><p>Семь восемь девять.</p></body></html>'
+            )
+            self.assertEqual(zip_ref.getinfo('OEBPS/chapter.xhtml').compress_type, zipfile.ZIP_DEFLATED)
+            # Манифест потоково записанного документа совпадает с записью в архиве
+            records = read_manifest(zip_ref, settings_fingerprint('1.0.0', 3, False, 'bs4', DEFAULT_SEGMENTER.key))
+            for name in ('OEBPS/chapter.xhtml', 'OEBPS/short.xhtml'):
+                self.assertTrue(is_processed(zip_ref, zip_ref.getinfo(name), records[name]))
+            self.assertIn(MANIFEST_ENTRY, zip_ref.namelist())
+        self.assertEqual(stats.counters['documents'], 2)
+        self.assertEqual(stats.counters['paragraphs split'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,382 @@
+"""
+Потоковое разбиение абзацев в TXT-книгах.
+
+Файл читается блоками, поэтому расход памяти не зависит от размера книги: в памяти держится только
+текущий блок и незаконченный хвост строки из предыдущего блока. Абзацем считается строка текста,
+предложения ищутся тем же разбивателем, что и в EPUB (split_paragraph_into_counted_sentences),
+и группируются так же: предложения накапливаются, пока количество слов не достигнет max_len.
+"""
+import io
+import os
+import re
+import codecs
+import logging
+
+try:
+    from .epub_split import split_paragraph_into_counted_sentences, atomic_replace, count_words
+    from .word_counts import count_word_starts
+except ImportError:
+    from epub_split import split_paragraph_into_counted_sentences, atomic_replace, count_words
+    from word_counts import count_word_starts
+
+# Размер блока чтения (в символах)
+CHUNK_SIZE = 1024 * 1024
+
+# Если строка без перевода строки длиннее этого значения, ее законченные предложения записываются,
+# не дожидаясь конца строки (иначе одна гигантская строка заняла бы всю память)
+MAX_CARRY = 4 * CHUNK_SIZE
+
+# Если в длинной строке меньше трех предложений (граница предложения не найдена), строка записывается
+# до последнего пробела, а в переносе остается только хвост такой длины: разбивателю предложений
+# нужно немного текста после точки, чтобы решить, граница ли это
+CARRY_CONTEXT = 4096
+
+WHITESPACE_REGEX = re.compile(r'\s+')
+
+
+# Метки порядка байтов: UTF-32 проверяется раньше UTF-16, так как BOM UTF-32 LE начинается с BOM UTF-16 LE
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Выборка для определения кодировки: начало файла и несколько окон, равномерно распределенных по файлу.
+# Время определения зависит только от размера выборки, а не от размера файла
+SAMPLE_PREFIX_SIZE = 64 * 1024
+SAMPLE_WINDOW_SIZE = 16 * 1024
+SAMPLE_WINDOWS = 4
+
+# Если уверенность chardet ниже этого значения, используется определение кодировки calibre
+MIN_CONFIDENCE = 0.5
+
+# Кодировка по умолчанию
+DEFAULT_ENCODING = 'utf-8'
+
+
+def detect_bom(head):
+    """
+    Определяет кодировку по метке порядка байтов (BOM).
+
+    :param head: Первые байты файла (не меньше 4).
+    :return: Кодировка или None, если BOM нет.
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    return None
+
+
+def read_samples(f, prefix_size=SAMPLE_PREFIX_SIZE, window_size=SAMPLE_WINDOW_SIZE, windows=SAMPLE_WINDOWS):
+    """
+    Читает выборку из файла: начало файла и windows окон, равномерно распределенных по остальной части.
+    Окна начинаются с начала строки, чтобы не резать многобайтовые символы.
+
+    :param f: Файл, открытый в двоичном режиме.
+    :param prefix_size: Размер начала файла.
+    :param window_size: Размер окна.
+    :param windows: Количество окон.
+    :return: Список фрагментов файла.
+    """
+    size = f.seek(0, os.SEEK_END)
+    f.seek(0)
+    samples = [f.read(prefix_size)]
+    if size <= prefix_size:
+        return samples
+
+    stride = (size - prefix_size) // windows
+    if stride < window_size:
+        # Файл чуть больше начала: окна бы перекрывались, поэтому дочитываем его целиком
+        return samples + [f.read()]
+
+    for k in range(1, windows + 1):
+        f.seek(prefix_size + k * stride - window_size)
+        window = f.read(window_size)
+        newline = window.find(b'\n')
+        samples.append(window[newline + 1:] if newline != -1 else window)
+    return samples
+
+
+def _is_utf8(samples):
+    """Признак того, что все фрагменты выборки - корректный UTF-8 (окно может обрываться посреди символа)."""
+    for sample in samples:
+        try:
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        except UnicodeDecodeError:
+            return False
+    return True
+
+
+def _detect_with_chardet(samples):
+    """Определяет кодировку выборки инкрементальным детектором chardet: (кодировка, уверенность)."""
+    try:
+        from chardet.universaldetector import UniversalDetector
+    except ImportError:
+        return None, 0
+
+    detector = UniversalDetector()
+    for sample in samples:
+        detector.feed(sample)
+        if detector.done:
+            break
+    detector.close()
+    return detector.result['encoding'], detector.result['confidence'] or 0
+
+
+def _detect_with_calibre(samples):
+    """Определяет кодировку выборки средствами calibre (если плагин запущен внутри calibre)."""
+    try:
+        from calibre.ebooks.chardet import detect
+    except ImportError:
+        return None
+    return detect(b''.join(samples))['encoding']
+
+
+def detect_encoding(txt_path):
+    """
+    Определяет кодировку TXT-файла по ограниченной выборке: сначала по BOM, затем проверкой на UTF-8,
+    затем инкрементальным детектором chardet (UniversalDetector), а если он не уверен -
+    средствами calibre (calibre.ebooks.chardet).
+
+    :param txt_path: Путь к TXT-файлу.
+    :return: Кодировка, подходящая для open(..., encoding=...).
+    """
+    with open(txt_path, 'rb') as f:
+        encoding = detect_bom(f.read(4))
+        if encoding:
+            logging.info(f"[Split paragraphs plugin] Detected encoding by BOM: {encoding}")
+            return encoding
+        samples = read_samples(f)
+
+    if _is_utf8(samples):
+        # Чистый ASCII тоже попадает сюда: UTF-8 - его надмножество
+        return DEFAULT_ENCODING
+
+    encoding, confidence = _detect_with_chardet(samples)
+    if encoding is None or confidence < MIN_CONFIDENCE:
+        encoding = _detect_with_calibre(samples) or encoding
+
+    if encoding is None:
+        logging.warning(f"[Split paragraphs plugin] Unable to detect encoding, defaulting to '{DEFAULT_ENCODING}'")
+        return DEFAULT_ENCODING
+
+    logging.info(f"[Split paragraphs plugin] Detected encoding: {encoding}")
+    return encoding
+
+
+def _sentence_text(text):
+    """
+    Текст для разбивателя предложений: символ '<' заменяется на символ той же длины,
+    чтобы обычный текст не был принят за начало HTML-тега.
+    """
+    return text.replace('<', '\ufffc')
+
+
+class TxtSplitter:
+    """
+    Потоковый разбиватель абзацев: принимает текст блоками (feed) и возвращает обработанный текст
+    по мере готовности, перенося незаконченную строку (а с ней и незаконченное предложение)
+    в следующий блок.
+    """
+
+    def __init__(self, max_len=10, separator=None, max_carry=MAX_CARRY):
+        """
+        :param max_len: Максимальное количество слов в абзаце.
+        :param separator: Разделитель новых абзацев. По умолчанию определяется по первому блоку с переводом строки:
+                          пустая строка, если абзацы в книге разделены пустыми строками, иначе перевод строки.
+        :param max_carry: Длина незаконченной строки, после которой ее законченные предложения записываются сразу.
+        """
+        self.max_len = max_len
+        self.separator = separator
+        self.max_carry = max_carry
+        # Перевод строки в книге ('\n' или '\r\n'), определяется по первому переводу строки
+        self.newline = None
+        # Незаконченная строка из предыдущих блоков
+        self.carry = ''
+        # Часть текущей строки уже записана (только для строк длиннее max_carry)
+        self.line_started = False
+        # Количество слов в незакрытом новом абзаце текущей строки
+        self.open_words = 0
+        # Количество слов в уже записанном начале предложения, которое продолжается в переносе (или None)
+        self.sentence_words = None
+
+    def feed(self, chunk):
+        """
+        Принимает очередной блок текста.
+
+        :param chunk: Блок текста.
+        :return: Обработанный текст, который уже можно записать.
+        """
+        self.carry += chunk
+        parts = []
+        if '\n' in chunk:
+            if self.newline is None:
+                self._detect_line_breaks(self.carry)
+            lines = self.carry.split('\n')
+            self.carry = lines.pop()
+            for line in lines:
+                parts.append(self._split(line, final=True))
+                parts.append('\n')
+
+        if len(self.carry) > self.max_carry:
+            parts.append(self._split(self.carry, final=False))
+        return ''.join(parts)
+
+    def _detect_line_breaks(self, text):
+        """Определяет по тексту с первым переводом строки вид перевода строки и разделитель абзацев."""
+        self.newline = '\r\n' if text[:text.index('\n')].endswith('\r') else '\n'
+        if self.separator is None:
+            self.separator = '\n\n' if '\n\n' in text or '\n\r\n' in text else '\n'
+
+    def close(self):
+        """
+        Завершает обработку: обрабатывает последнюю строку (без перевода строки в конце).
+
+        :return: Обработанный остаток текста.
+        """
+        text = self._split(self.carry, final=True) if self.carry or self.line_started else ''
+        self.carry = ''
+        return text
+
+    def _split(self, text, final):
+        """
+        Разбивает строку (или законченную часть длинной строки, если final=False) на абзацы.
+
+        :param text: Текст строки без перевода строки.
+        :param final: Признак того, что строка закончилась.
+        :return: Обработанный текст.
+        """
+        line_end = ''
+        if final and text.endswith('\r'):
+            # Переводы строк Windows сохраняем как есть
+            text, line_end = text[:-1], '\r'
+        if final:
+            newline = '\r\n' if line_end else '\n'
+        else:
+            # Конец строки еще не прочитан: используем перевод строки книги (пока в книге не встретилось
+            # ни одного перевода строки, считаем его '\n')
+            newline = self.newline or '\n'
+        separator = (self.separator or '\n').replace('\n', newline)
+
+        # Быстрая проверка: короткая строка целиком остается как есть (с отступами и пробелами)
+        if final and not self.line_started and count_word_starts([text])[0] <= self.max_len:
+            return text + line_end
+
+        sentences = split_paragraph_into_counted_sentences(_sentence_text(text))
+        if final and not self.line_started and sum(words_count for _, _, words_count in sentences) <= self.max_len:
+            return text + line_end
+
+        fragment = None
+        if not final:
+            if len(sentences) >= 3:
+                # Последнее предложение может продолжиться в следующем блоке, а граница перед ним - оказаться
+                # ложной (например, "т." в "т.е.", оборванном на конце блока): оставляем в переносе два предложения
+                self.carry = text[sentences[-2][0]:]
+                sentences = sentences[:-2]
+            else:
+                # Надежной границы предложения нет: записываем строку до последнего пробела перед хвостом
+                # из CARRY_CONTEXT символов, чтобы перенос (и повторный разбор на каждом блоке) не рос
+                cut = self._cut_position(text)
+                if cut is None:
+                    return ''
+                self.carry = text[cut:]
+                fragment = next(((start, cut) for start, end, _ in sentences if start < cut < end), None)
+                sentences = [sentence for sentence in sentences if sentence[1] <= cut]
+
+        parts = []
+        for start, end, words_count in sentences:
+            parts.append(self._sentence_start(text, start, separator))
+            parts.append(text[start:end])
+            self.open_words += self._sentence_words(words_count)
+            if self.open_words >= self.max_len:
+                self.open_words = 0
+
+        if fragment is not None:
+            # Начало предложения, которое продолжится в переносе: слова учитываются, когда оно закончится
+            start, cut = fragment
+            parts.append(self._sentence_start(text, start, separator))
+            parts.append(text[start:cut])
+            self.sentence_words = self._sentence_words(count_words(_sentence_text(text), start, cut))
+
+        if final:
+            parts.append(line_end)
+            self.line_started = False
+            self.open_words = 0
+            self.sentence_words = None
+        return ''.join(parts)
+
+    def _cut_position(self, text):
+        """Начало последнего пробела строки перед хвостом для переноса или None, если такого пробела нет."""
+        limit = len(text) - min(CARRY_CONTEXT, self.max_carry // 2)
+        cut = None
+        for match in WHITESPACE_REGEX.finditer(text, 0, limit):
+            cut = match.start()
+        return cut or None
+
+    def _sentence_start(self, text, start, separator):
+        """Что записать перед предложением, которое начинается в text со смещения start."""
+        if self.sentence_words is not None:
+            # Продолжение уже начатого предложения: пробелы перед ним - часть предложения
+            return text[:start]
+        started, self.line_started = self.line_started, True
+        if not started:
+            # Отступ в начале строки сохраняем
+            return text[:start]
+        return ' ' if self.open_words else separator
+
+    def _sentence_words(self, words_count):
+        """Количество слов предложения с учетом его уже записанного начала."""
+        if self.sentence_words is not None:
+            words_count += self.sentence_words
+            self.sentence_words = None
+        return words_count
+
+
+def split_txt(text, max_len=10, separator=None):
+    """
+    Разбивает длинные абзацы (строки) текста на меньшие.
+
+    :param text: Текст.
+    :param max_len: Максимальное количество слов в абзаце.
+    :param separator: Разделитель новых абзацев (см. TxtSplitter).
+    :return: Текст с разбитыми абзацами.
+    """
+    splitter = TxtSplitter(max_len, separator)
+    return splitter.feed(text) + splitter.close()
+
+
+def process_txt(txt_path, max_len=10, encoding='utf-8', chunk_size=CHUNK_SIZE, output_path=None):
+    """
+    Разбивает длинные абзацы TXT-файла, читая и записывая его блоками. Результат записывается
+    в кодировке UTF-8 во временный файл, который затем атомарно заменяет исходный.
+
+    :param txt_path: Путь к TXT-файлу.
+    :param max_len: Максимальное количество слов в абзаце.
+    :param encoding: Кодировка исходного файла.
+    :param chunk_size: Размер блока чтения (в символах).
+    :param output_path: Путь, по которому записывается результат (по умолчанию исходный файл перезаписывается).
+    """
+    splitter = TxtSplitter(max_len)
+    # newline='' - переводы строк читаются и записываются как есть
+    with io.open(txt_path, 'r', encoding=encoding, errors='replace', newline='') as source, \
+            atomic_replace(output_path or txt_path, 'w', mode_source=txt_path, encoding='utf-8', newline='') as target:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            target.write(splitter.feed(chunk))
+        target.write(splitter.close())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Разбиение длинных абзацев TXT файла.')
+    parser.add_argument('txt_path', help='Путь к TXT файлу для обработки.')
+    parser.add_argument('-l', '--len', type=int, default=10, help='Максимальное количество слов в абзаце.')
+    parser.add_argument('-e', '--encoding', help='Кодировка TXT файла (по умолчанию определяется автоматически).')
+    args = parser.parse_args()
+
+    process_txt(args.txt_path, args.len, args.encoding or detect_encoding(args.txt_path))
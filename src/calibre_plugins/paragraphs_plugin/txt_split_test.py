@@ -0,0 +1,145 @@
+import io
+import os
+import codecs
+import tempfile
+import importlib.util
+import unittest
+
+from txt_split import *
+
+LONG_LINE = 'Один два три. Четыре пять шесть. Семь восемь девять.'
+
+
+class TestSplitTxt(unittest.TestCase):
+    def test_short_lines_are_untouched(self):
+        text = '   Короткая  строка.\nЕще одна.\n\n'
+        self.assertEqual(split_txt(text, 10), text)
+
+    def test_long_line_split(self):
+        self.assertEqual(
+            split_txt(LONG_LINE + '\n', 3, '\n'),
+            'Один два три.\nЧетыре пять шесть.\nСемь восемь девять.\n'
+        )
+
+    def test_separator_detection(self):
+        self.assertEqual(
+            split_txt('  ' + LONG_LINE + '\n\nКонец.\n', 6),
+            '  Один два три. Четыре пять шесть.\n\nСемь восемь девять.\n\nКонец.\n'
+        )
+
+    def test_windows_line_endings(self):
+        self.assertEqual(
+            split_txt(LONG_LINE + '\r\nКонец.\r\n', 3, '\n'),
+            'Один два три.\r\nЧетыре пять шесть.\r\nСемь восемь девять.\r\nКонец.\r\n'
+        )
+
+    def test_abbreviations_and_angle_brackets(self):
+        self.assertEqual(
+            split_txt('Мы посетили ул. Ленина, где 2 < 3. Потом ушли домой.', 3, '\n'),
+            'Мы посетили ул. Ленина, где 2 < 3.\nПотом ушли домой.'
+        )
+
+    def test_chunks(self):
+        text = '\n'.join([LONG_LINE, 'Т.е. это т.д. и т.п. Конец абзаца.', '', '  ' + LONG_LINE * 3]) + '\n'
+        expected = split_txt(text, 4, '\n')
+        for chunk_size in (1, 2, 7, 50):
+            splitter = TxtSplitter(4, '\n')
+            parts = [splitter.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+            parts.append(splitter.close())
+            self.assertEqual(''.join(parts), expected)
+
+    def test_long_line_is_flushed_before_its_end(self):
+        text = ' '.join([LONG_LINE] * 20)
+        splitter = TxtSplitter(3, '\n', max_carry=100)
+        flushed = splitter.feed(text)
+        # Законченные предложения уже записаны, в переносе осталось только несколько последних
+        self.assertTrue(flushed)
+        self.assertLess(len(splitter.carry), 100)
+        self.assertEqual(flushed + splitter.close(), split_txt(text, 3, '\n'))
+
+    def test_long_line_without_sentence_ends_is_flushed(self):
+        # Строка без границ предложений записывается до последнего пробела, перенос не растет
+        text = 'Начало. ' + 'слово ' * 500 + 'конец. Еще предложение из пяти слов.'
+        for max_len, chunk_size in ((3, 7), (3, 64), (1000, 50)):
+            splitter = TxtSplitter(max_len, '\n', max_carry=200)
+            parts = []
+            for i in range(0, len(text), chunk_size):
+                parts.append(splitter.feed(text[i:i + chunk_size]))
+                self.assertLessEqual(len(splitter.carry), 200 + chunk_size)
+            parts.append(splitter.close())
+            self.assertEqual(''.join(parts), split_txt(text, max_len, '\n'))
+
+    def test_long_line_with_windows_line_endings(self):
+        # Законченные предложения длинной строки записываются до ее конца с тем же переводом строки, что в книге
+        text = 'Начало.\r\n' + ' '.join([LONG_LINE] * 20) + '\r\nКонец.\r\n'
+        expected = split_txt(text, 3)
+        self.assertNotIn('\n', expected.replace('\r\n', ''))
+        for chunk_size in (7, 50, len(text)):
+            splitter = TxtSplitter(3, max_carry=100)
+            parts = [splitter.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+            parts.append(splitter.close())
+            self.assertEqual(''.join(parts), expected)
+
+
+class TestProcessTxt(unittest.TestCase):
+    def test_process_txt(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            txt_path = os.path.join(tmp_dir, 'book.txt')
+            with open(txt_path, 'w', encoding='cp1251', newline='') as f:
+                f.write(LONG_LINE + '\n')
+
+            process_txt(txt_path, 3, encoding='cp1251', chunk_size=5)
+
+            with open(txt_path, encoding='utf-8', newline='') as f:
+                self.assertEqual(f.read(), 'Один два три.\nЧетыре пять шесть.\nСемь восемь девять.\n')
+            self.assertEqual(os.listdir(tmp_dir), ['book.txt'])
+
+
+class TestDetectEncoding(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.txt_path = os.path.join(self.tmp_dir.name, 'book.txt')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, data):
+        with open(self.txt_path, 'wb') as f:
+            f.write(data)
+
+    def test_bom(self):
+        for bom, encoding in [(codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'),
+                              (codecs.BOM_UTF16_BE, 'utf-16'), (codecs.BOM_UTF32_LE, 'utf-32')]:
+            self.write(bom + LONG_LINE.encode(encoding.replace('-sig', '')))
+            self.assertEqual(detect_encoding(self.txt_path), encoding)
+
+    def test_utf8(self):
+        self.write((LONG_LINE + '\n').encode('utf-8') * 10000)
+        self.assertEqual(detect_encoding(self.txt_path), 'utf-8')
+
+    def test_ascii_is_utf8(self):
+        self.write(b'Plain text.\n')
+        self.assertEqual(detect_encoding(self.txt_path), 'utf-8')
+
+    @unittest.skipUnless(importlib.util.find_spec('chardet'), 'chardet is not installed')
+    def test_cp1251(self):
+        self.write((LONG_LINE + '\n').encode('cp1251') * 10000)
+        self.assertEqual(detect_encoding(self.txt_path).lower(), 'windows-1251')
+
+    def test_samples_are_bounded(self):
+        data = (LONG_LINE + '\n').encode('utf-8') * 100000
+        samples = read_samples(io.BytesIO(data), prefix_size=1000, window_size=100, windows=3)
+        self.assertEqual(len(samples), 4)
+        self.assertEqual(samples[0], data[:1000])
+        self.assertLessEqual(sum(map(len, samples)), 1000 + 3 * 100)
+        # Окна начинаются с начала строки
+        for sample in samples[1:]:
+            self.assertTrue(LONG_LINE.encode('utf-8').startswith(sample[:20]))
+
+    def test_small_file_is_read_whole(self):
+        data = b'x' * 1050
+        self.assertEqual(b''.join(read_samples(io.BytesIO(data), prefix_size=1000, window_size=100)), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
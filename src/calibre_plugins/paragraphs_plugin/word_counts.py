@@ -0,0 +1,101 @@
+"""
+Пакетная оценка количества слов во всех абзацах документа.
+
+Чтобы решить, нужно ли разбивать абзац, достаточно знать, что слов в нем не больше max_len, а таких абзацев
+в книге большинство: они отсекаются без разбивателя предложений и полного подсчета слов. Здесь для всех
+абзацев документа сразу считаются начала "слов" - переходы от символа не из \\w к символу из \\w (теги при этом
+не пропускаются, а слова через дефис считаются по частям). Каждое слово, которое находит count_words, начинается
+с такого перехода, поэтому это оценка сверху: если она не больше max_len, абзац точно не нужно разбивать.
+
+Оценку используют все способы обработки: process_document (движок BeautifulSoup), split_paragraphs_in_tree
+(движки lxml, в том числе при преобразовании книги calibre, см. oeb_transform.py), потоковая обработка больших
+документов (stream_split.py) и обработка TXT (txt_split.py).
+
+Если установлен NumPy, абзацы склеиваются в один буфер кодов символов, переходы находятся векторными операциями
+по таблице символов \\w, а количества по абзацам - одним searchsorted по границам абзацев. Без NumPy каждый
+абзац просматривается одним вызовом регулярного выражения, без цикла на Python по символам или словам.
+
+calibre NumPy не поставляет, поэтому в плагине всегда работает вариант с регулярным выражением. Ветка NumPy
+ускоряет только запуск из командной строки (batch.py, epub_split.py) в окружении, где NumPy установлен.
+"""
+import re
+
+# Начало слова: символ из \w, перед которым нет символа из \w
+WORD_START_REGEX = re.compile(r'\b\w')
+
+# Символ из \w (для построения таблицы символов)
+WORD_CHAR_REGEX = re.compile(r'\w')
+
+# Разделитель абзацев в общем буфере: не из \w, поэтому слова соседних абзацев не склеиваются
+SEPARATOR = '\n'
+
+# Таблица символов \w строится для базовой многоязычной плоскости Unicode; документы с символами за ее пределами
+# (например, эмодзи) считаются регулярным выражением
+TABLE_SIZE = 0x10000
+
+# Для коротких документов накладные расходы NumPy больше выигрыша
+MIN_VECTORIZED_LENGTH = 4096
+
+_word_char_table = None
+
+# Модуль NumPy, None (не установлен) или False (еще не искали)
+_numpy = False
+
+
+def _load_numpy():
+    """NumPy, если он установлен, иначе None (неудачный импорт не повторяется при каждом вызове)."""
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+
+def _table(numpy):
+    """Таблица "код символа -> символ из \\w" (строится один раз на процесс)."""
+    global _word_char_table
+    if _word_char_table is None:
+        table = numpy.zeros(TABLE_SIZE, dtype=bool)
+        chars = ''.join(map(chr, range(TABLE_SIZE)))
+        table[[match.start() for match in WORD_CHAR_REGEX.finditer(chars)]] = True
+        _word_char_table = table
+    return _word_char_table
+
+
+def count_word_starts_vectorized(texts, numpy):
+    """
+    count_word_starts на NumPy.
+
+    :return: Список оценок или None, если в текстах есть символы за пределами таблицы.
+    """
+    codes = numpy.frombuffer(SEPARATOR.join(texts).encode('utf-32-le', 'surrogatepass'), dtype='<u4')
+    if codes.size == 0:
+        return [0] * len(texts)
+    if int(codes.max()) >= TABLE_SIZE:
+        return None
+    is_word = _table(numpy)[codes]
+    starts = is_word.copy()
+    starts[1:] &= ~is_word[:-1]
+    positions = numpy.flatnonzero(starts)
+    # Конец каждого абзаца в буфере - позиция разделителя после него
+    ends = numpy.cumsum([len(text) + 1 for text in texts]) - 1
+    return numpy.diff(numpy.searchsorted(positions, ends), prepend=0).tolist()
+
+
+def count_word_starts(texts, use_numpy=True):
+    """
+    Оценивает сверху количество слов (см. count_words в epub_split.py) сразу в нескольких текстах.
+
+    :param texts: Список текстов (возможно, с HTML-разметкой), например, содержимое всех абзацев документа.
+    :param use_numpy: Признак того, что можно использовать NumPy (если он установлен).
+    :return: Список оценок в том же порядке.
+    """
+    numpy = _load_numpy() if use_numpy else None
+    if numpy is not None and sum(map(len, texts)) >= MIN_VECTORIZED_LENGTH:
+        counts = count_word_starts_vectorized(texts, numpy)
+        if counts is not None:
+            return counts
+    return [len(WORD_START_REGEX.findall(text)) for text in texts]
@@ -0,0 +1,43 @@
+import unittest
+
+from word_counts import *
+from word_counts import _load_numpy
+from epub_split import count_words
+
+TEXTS = [
+    '',
+    'Один',
+    'Нью-Йорк, e-mail и т.д.',
+    '<p class="a b">Текст с <b>жирным</b>&nbsp;и <i>курсивом</i>.</p>',
+    'Числа 3.14 и 2,5 — тоже слова; snake_case - одно слово.',
+    'Эмодзи 😀 между словами',
+    '   \n\t ',
+]
+
+
+class TestCountWordStarts(unittest.TestCase):
+    def test_upper_bound(self):
+        for text, bound in zip(TEXTS, count_word_starts(TEXTS, use_numpy=False)):
+            with self.subTest(text=text):
+                self.assertGreaterEqual(bound, count_words(text))
+
+    def test_plain_text_is_exact(self):
+        text = 'Это обычный текст без разметки, в нем пять... нет, десять слов'
+        self.assertEqual(count_word_starts([text]), [count_words(text)])
+
+    def test_paragraphs_are_counted_separately(self):
+        # Слова на границе соседних абзацев не склеиваются
+        self.assertEqual(count_word_starts(['раз два', 'три', '', 'четыре'], use_numpy=False), [2, 1, 0, 1])
+
+    @unittest.skipIf(_load_numpy() is None, 'NumPy не установлен')
+    def test_vectorized_same_as_regex(self):
+        numpy = _load_numpy()
+        texts = [text for text in TEXTS if '😀' not in text] * 3
+        self.assertEqual(count_word_starts_vectorized(texts, numpy), count_word_starts(texts, use_numpy=False))
+        # Символы за пределами таблицы считаются регулярным выражением
+        self.assertIsNone(count_word_starts_vectorized(TEXTS, numpy))
+        self.assertEqual(count_word_starts(TEXTS * 1000), count_word_starts(TEXTS * 1000, use_numpy=False))
+
+
+if __name__ == '__main__':
+    unittest.main()